@@ -7,13 +7,14 @@ from PyQt6.QtWidgets import (
     QVBoxLayout, QPushButton, QWidget, QLineEdit, QDialog, QFormLayout, QMessageBox, 
     QInputDialog, QTabWidget, QLabel, QCheckBox, QHeaderView, QHBoxLayout, QComboBox, QGroupBox
 )
-from PyQt6.QtCore import QTimer, QUrl
+from PyQt6.QtCore import Qt, QTimer, QUrl
 from PyQt6.QtWebSockets import QWebSocket, QWebSocketProtocol
 from PyQt6.QtNetwork import QAbstractSocket
 import random
 import string
 from datetime import datetime, timedelta
 from email_utils import send_2fa_code
+from ws_reconnect import ReconnectManager
 import requests
 from admin_utils.gui_components import (
     BaseDialog, AddSiteDialog, TwoFactorDialog,
@@ -23,6 +24,15 @@ from admin_utils.database_utils import DatabaseManager, DatabaseError
 from admin_utils.dialog_utils import DialogManager
 from admin_utils.table_utils import TableManager  # Import TableManager
 
+# Registered users fetched per request; more are loaded while scrolling
+USERS_PAGE_SIZE = 200
+
+# Reports tab: time ranges offered, and rows shown per table
+REPORT_RANGES = {'Last 24 hours': 1, 'Last 7 days': 7, 'Last 30 days': 30}
+REPORT_LIMIT = 20
+RULE_SEARCH_FIELDS = {'Blocked site': 'blocked_sites', 'Excluded site': 'excluded_sites', 'Keyword': 'categories'}
+RULE_SEARCH_PAGE = 200
+
 class LoginDialog(BaseDialog):
     def __init__(self, parent=None):
         super().__init__('Login', parent)
@@ -118,12 +128,21 @@ class DashboardWindow(QMainWindow):
         self.blocked_sites_file = 'blocked_sites.json'
         self.blocked_sites, self.excluded_sites, self.category_keywords = self.load_data()
         self.current_user_id = None
+        self.current_settings_version = None  # Version of the settings loaded in User Management
+        self.user_settings_cache = {}  # user_id -> settings response, filled by one batch request per refresh
+        self.user_rows = {}  # user_id -> row of the registered users listed in the Users table
+        self.users_cursor = None  # Keyset cursor of the next /user-ips/ page, None when all are loaded
+        self.online_users = {}  # user_id -> presence entry, kept current by 'presence' WebSocket events
         
         self.db = DatabaseManager()
         self.server_url = os.getenv('SERVER_URL', 'http://192.168.0.103:8000')
+        # Staff session on the server, needed by the endpoints that read or change many users at once
+        self.api = requests.Session()
+        self.login_to_server()
         
         # Initialize WebSocket
         self.websocket = QWebSocket()
+        self.reconnect = ReconnectManager(self.connect_websocket)
         self.websocket.connected.connect(self.on_websocket_connected)
         self.websocket.disconnected.connect(self.on_websocket_disconnected)
         self.websocket.textMessageReceived.connect(self.on_websocket_message)
@@ -148,7 +167,9 @@ class DashboardWindow(QMainWindow):
     def on_websocket_connected(self):
         """Handle WebSocket connection"""
         self.connection_status.setText("WebSocket: Connected")
-        # Send initial admin status message
+        self.reconnect.connected()
+        # Send initial admin status message; the server answers with the users online now.
+        # A reconnect gets a fresh snapshot, which covers presence events missed while disconnected
         self.websocket.sendTextMessage(json.dumps({
             'type': 'admin_connect',
             'message': 'Admin connected'
@@ -161,14 +182,13 @@ class DashboardWindow(QMainWindow):
 
     def on_websocket_disconnected(self):
         """Handle WebSocket disconnection"""
-        self.connection_status.setText("WebSocket: Disconnected")
-        
         # Stop ping timer if it exists
         if hasattr(self, 'ping_timer'):
             self.ping_timer.stop()
             
-        # Try to reconnect after a delay
-        QTimer.singleShot(5000, self.connect_websocket)
+        # Try to reconnect after a backoff delay
+        delay = self.reconnect.disconnected()
+        self.connection_status.setText(f"WebSocket: Disconnected, reconnecting in {delay:.0f}s")
 
     def send_ping(self):
         """Send ping message to keep WebSocket connection alive"""
@@ -184,13 +204,18 @@ class DashboardWindow(QMainWindow):
         try:
             data = json.loads(message)
             if 'type' in data:
-                if data['type'] == 'user_status':
-                    # Update online users list
-                    self.refresh_online_users()
+                if data['type'] == 'presence_snapshot':
+                    # Full list sent once after admin_connect, later changes arrive as 'presence' events
+                    self.set_online_users(data.get('online_users', []))
+                elif data['type'] == 'presence':
+                    self.apply_presence_event(data)
                 elif data['type'] == 'settings_change':
                     # Refresh settings if currently viewing this user
                     if self.current_user_id == data.get('user_id'):
                         self.load_user_settings(self.current_user_id)
+                elif data['type'] == 'retry_later':
+                    # Turned away by admission control; the server closes the connection next
+                    self.reconnect.server_retry_after(data.get('retry_after'))
                 elif data['type'] == 'pong':
                     # Received pong response
                     print(f"Received pong from user {data.get('user_id', 'unknown')}")
@@ -221,8 +246,13 @@ class DashboardWindow(QMainWindow):
         self.tabs.addTab(self.create_excluded_sites_tab(), "Excluded Sites")
         self.tabs.addTab(self.create_categories_tab(), "Categories")
         self.tabs.addTab(self.create_settings_tab(), "Settings")
-        self.tabs.addTab(self.create_online_users_tab(), "Online Users")
+        self.tabs.addTab(self.create_users_tab(), "Users")
         self.tabs.addTab(self.create_user_management_tab(), "User Management")  # New tab
+        self.tabs.addTab(self.create_reports_tab(), "Reports")
+        self.tabs.addTab(self.create_rule_search_tab(), "Rule Search")
+
+        # Initial load, once both the Users table and the User Management selector exist
+        self.refresh_users()
 
         self.setGeometry(100, 100, 800, 600)
 
@@ -282,27 +312,32 @@ class DashboardWindow(QMainWindow):
         container.setLayout(layout)
         return container
 
-    def create_online_users_tab(self):
+    def create_users_tab(self):
         container = QWidget()
         layout = QVBoxLayout()
 
-        # Create table for online users
-        self.online_users_table = QTableWidget()
+        # Create table for registered users and whether they are online
+        self.users_table = QTableWidget()
         TableManager.setup_table(
-            self.online_users_table,
-            ['User ID', 'Address'],
+            self.users_table,
+            ['User ID', 'Address', 'Status'],
             stretch_columns=[0, 1]
         )
-        layout.addWidget(self.online_users_table)
+        # Load the next page when scrolled close to the end
+        self.users_table.verticalScrollBar().valueChanged.connect(self.on_users_scrolled)
+        layout.addWidget(self.users_table)
+
+        # Server-side search by user ID or IP prefix
+        self.users_search = QLineEdit()
+        self.users_search.setPlaceholderText("Search by user ID or IP prefix")
+        self.users_search.returnPressed.connect(self.refresh_users)
+        layout.addWidget(self.users_search)
 
         # Refresh button
         refresh_button = QPushButton("Refresh Users")
-        refresh_button.clicked.connect(self.refresh_online_users)
+        refresh_button.clicked.connect(self.refresh_users)
         layout.addWidget(refresh_button)
 
-        # Initial refresh
-        self.refresh_online_users()
-
         container.setLayout(layout)
         return container
 
@@ -314,7 +349,7 @@ class DashboardWindow(QMainWindow):
         # Create user selection section
         user_selection_layout = QHBoxLayout()
         user_label = QLabel("Select User:")
-        self.user_combo = QComboBox()  # Will be populated with online users
+        self.user_combo = QComboBox()  # Will be populated with registered users
         self.user_combo.setMinimumWidth(300)  # Set minimum width to make dropdown wider
         self.user_combo.currentTextChanged.connect(self.on_user_selected)  # Add signal handler
         user_selection_layout.addWidget(user_label)
@@ -322,7 +357,7 @@ class DashboardWindow(QMainWindow):
         
         # Add refresh button next to user selection
         refresh_btn = QPushButton("Refresh")
-        refresh_btn.clicked.connect(self.refresh_online_users)
+        refresh_btn.clicked.connect(self.refresh_users)
         user_selection_layout.addWidget(refresh_btn)
         user_selection_layout.addStretch()
         
@@ -415,7 +450,10 @@ class DashboardWindow(QMainWindow):
         button_layout = QHBoxLayout()
         save_btn = QPushButton("Save Changes")
         save_btn.clicked.connect(self.save_user_settings)
+        apply_all_btn = QPushButton("Apply to All Users")
+        apply_all_btn.clicked.connect(self.apply_settings_to_all_users)
         button_layout.addStretch()
+        button_layout.addWidget(apply_all_btn)
         button_layout.addWidget(save_btn)
         
         # Add all components to main layout
@@ -425,6 +463,178 @@ class DashboardWindow(QMainWindow):
         tab.setLayout(layout)
         return tab
 
+    def create_reports_tab(self):
+        """Filtering activity from the server's rollups (/api/reports/), never from raw events"""
+        container = QWidget()
+        layout = QVBoxLayout()
+
+        filters_layout = QHBoxLayout()
+        self.report_range_combo = QComboBox()
+        self.report_range_combo.addItems(REPORT_RANGES.keys())
+        self.report_range_combo.setCurrentText('Last 7 days')
+        self.report_action_combo = QComboBox()
+        self.report_action_combo.addItems(['blocked', 'allowed'])
+        # A class is the set of users sharing a policy
+        self.report_policy_combo = QComboBox()
+        self.report_prefix_input = QLineEdit()
+        self.report_prefix_input.setPlaceholderText("User ID prefix")
+        self.report_prefix_input.returnPressed.connect(self.refresh_reports)
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh_reports)
+        for label, widget in (("Range:", self.report_range_combo), ("Action:", self.report_action_combo),
+                              ("Class:", self.report_policy_combo), ("Users:", self.report_prefix_input)):
+            filters_layout.addWidget(QLabel(label))
+            filters_layout.addWidget(widget)
+        filters_layout.addWidget(refresh_button)
+        layout.addLayout(filters_layout)
+
+        tables_layout = QHBoxLayout()
+        self.report_tables = {}
+        for report, title, column in (('categories', 'Top Categories', 'Category'),
+                                      ('users', 'Top Users', 'User ID'),
+                                      ('domains', 'Top Domains (all users)', 'Domain')):
+            group = QGroupBox(title)
+            group_layout = QVBoxLayout()
+            table = QTableWidget()
+            TableManager.setup_table(table, [column, 'Events'], stretch_columns=[0])
+            group_layout.addWidget(table)
+            group.setLayout(group_layout)
+            tables_layout.addWidget(group)
+            self.report_tables[report] = table
+        layout.addLayout(tables_layout)
+
+        self.load_report_policies()
+        self.refresh_reports()
+
+        container.setLayout(layout)
+        return container
+
+    def load_report_policies(self):
+        """Fill the class filter with the shared policies"""
+        self.report_policy_combo.clear()
+        self.report_policy_combo.addItem("All users", None)
+        try:
+            response = requests.get(f"{self.server_url}/api/policies/", timeout=5)
+            if response.status_code == 200:
+                for policy in response.json().get('policies', []):
+                    self.report_policy_combo.addItem(policy['name'], policy['id'])
+        except Exception as e:
+            print(f"Error loading policies: {str(e)}")
+
+    def refresh_reports(self):
+        """Reload the three report tables for the selected range and filters"""
+        since = datetime.utcnow() - timedelta(days=REPORT_RANGES[self.report_range_combo.currentText()])
+        params = {
+            'since': since.isoformat() + 'Z',  # Until now
+            'action': self.report_action_combo.currentText(),
+            'limit': REPORT_LIMIT,
+        }
+        user_filters = {}
+        if self.report_policy_combo.currentData() is not None:
+            user_filters['policy_id'] = self.report_policy_combo.currentData()
+        if self.report_prefix_input.text().strip():
+            user_filters['user_id_prefix'] = self.report_prefix_input.text().strip()
+
+        for report, table in self.report_tables.items():
+            # The domain rollup is not per user, so the user filters don't apply to it
+            report_params = params if report == 'domains' else {**params, **user_filters}
+            try:
+                response = self.admin_request(
+                    'GET', f"{self.server_url}/api/reports/{report}/", params=report_params, timeout=5
+                )
+                if response.status_code != 200:
+                    print(f"Error loading {report} report: {response.text}")
+                    continue
+                key = {'categories': 'category', 'users': 'user_id', 'domains': 'host'}[report]
+                # Blocked sites and allowed pages have no category
+                rows = [[row[key] or '(no category)', row['count']] for row in response.json()['results']]
+                TableManager.populate_table(table, rows, is_list_of_lists=True)
+            except Exception as e:
+                print(f"Error loading {report} report: {str(e)}")
+
+    def create_rule_search_tab(self):
+        """Which policies and users block or exclude a site, or filter on a keyword (/api/rules/search/)"""
+        container = QWidget()
+        layout = QVBoxLayout()
+
+        search_layout = QHBoxLayout()
+        self.rule_field_combo = QComboBox()
+        self.rule_field_combo.addItems(RULE_SEARCH_FIELDS.keys())
+        self.rule_query_input = QLineEdit()
+        self.rule_query_input.setPlaceholderText("youtube.com or a keyword")
+        self.rule_query_input.returnPressed.connect(self.search_rules)
+        self.rule_category_input = QLineEdit()
+        self.rule_category_input.setPlaceholderText("Category (keywords only, optional)")
+        search_button = QPushButton("Search")
+        search_button.clicked.connect(self.search_rules)
+        self.rule_more_button = QPushButton("More users")
+        self.rule_more_button.setEnabled(False)
+        self.rule_more_button.clicked.connect(lambda: self.search_rules(more=True))
+        for widget in (self.rule_field_combo, self.rule_query_input, self.rule_category_input, search_button,
+                       self.rule_more_button):
+            search_layout.addWidget(widget)
+        layout.addLayout(search_layout)
+
+        tables_layout = QHBoxLayout()
+        policies_group = QGroupBox("Policies")
+        policies_layout = QVBoxLayout()
+        self.rule_policies_table = QTableWidget()
+        TableManager.setup_table(self.rule_policies_table, ['Policy', 'Version'], stretch_columns=[0])
+        policies_layout.addWidget(self.rule_policies_table)
+        policies_group.setLayout(policies_layout)
+        tables_layout.addWidget(policies_group)
+
+        users_group = QGroupBox("Users")
+        users_layout = QVBoxLayout()
+        self.rule_users_table = QTableWidget()
+        TableManager.setup_table(self.rule_users_table, ['User ID', 'Own rule', 'Via policies'], stretch_columns=[0])
+        users_layout.addWidget(self.rule_users_table)
+        users_group.setLayout(users_layout)
+        tables_layout.addWidget(users_group, 2)
+        layout.addLayout(tables_layout)
+
+        self.rule_search_after = None
+        self.rule_user_rows = []
+        container.setLayout(layout)
+        return container
+
+    def search_rules(self, more=False):
+        """Run a rule search, or with more=True append the next page of users"""
+        query = self.rule_query_input.text().strip()
+        if not query:
+            return
+        params = {'field': RULE_SEARCH_FIELDS[self.rule_field_combo.currentText()], 'q': query, 'limit': RULE_SEARCH_PAGE}
+        if params['field'] == 'categories' and self.rule_category_input.text().strip():
+            params['category'] = self.rule_category_input.text().strip()
+        if more and self.rule_search_after:
+            params['after'] = self.rule_search_after
+        try:
+            response = self.admin_request('GET', f"{self.server_url}/api/rules/search/", params=params, timeout=5)
+            if response.status_code != 200:
+                QMessageBox.warning(self, "Search Error", response.json().get('message', response.text))
+                return
+            result = response.json()
+        except Exception as e:
+            print(f"Error searching rules: {str(e)}")
+            return
+
+        policy_names = {policy['id']: policy['name'] for policy in result['policies']}
+        if not more:
+            TableManager.populate_table(
+                self.rule_policies_table,
+                [[policy['name'], policy['version']] for policy in result['policies']],
+                is_list_of_lists=True
+            )
+            self.rule_user_rows = []
+        self.rule_user_rows += [
+            [user['user_id'], 'yes' if user['override'] else '',
+             ', '.join(policy_names.get(policy_id, str(policy_id)) for policy_id in user['policy_ids'])]
+            for user in result['users']
+        ]
+        TableManager.populate_table(self.rule_users_table, self.rule_user_rows, is_list_of_lists=True)
+        self.rule_search_after = result['next_after']
+        self.rule_more_button.setEnabled(self.rule_search_after is not None)
+
     def create_tab_layout(self, table_widget, buttons):
         layout = QVBoxLayout()
         layout.addWidget(table_widget)
@@ -645,48 +855,191 @@ class DashboardWindow(QMainWindow):
             print(f"Error saving settings: {str(e)}")  # Debug log
             DialogManager.show_error_dialog('Database Error', f'Could not save settings: {str(e)}', self)
 
-    def refresh_online_users(self):
+    def refresh_users(self):
+        """Reload the users list starting from its first page"""
+        self.clear_users()
+        self.load_users_page()
+
+    def load_users_page(self):
+        """Fetch the next page of registered users and append it to the table"""
+        params = {'fields': 'ip_address,port', 'limit': USERS_PAGE_SIZE}
+        if self.users_search.text().strip():
+            params['q'] = self.users_search.text().strip()
+        if self.users_cursor:
+            params['cursor'] = self.users_cursor
         try:
-            # Get registered users and their IPs
-            response = requests.get(f"{self.server_url}/user-ips/", timeout=5)
+            response = requests.get(f"{self.server_url}/user-ips/", params=params, timeout=5)
             if response.status_code == 200:
                 data = response.json()
-                
-                # Update online users table
-                online_users_data = []
-                user_combo_data = []
-                
-                for user in data['user_ips']:
-                    # Prepare table data
-                    address = f"{user['ip_address']}:{user['port']}"
-                    online_users_data.append([str(user['user_id']), address])
-                    
-                    # Prepare combo box data
-                    display_text = f"{user['user_id']} - {address}"
-                    user_combo_data.append(display_text)
-                
-                # Update table
-                TableManager.populate_table(
-                    self.online_users_table,
-                    online_users_data,
-                    is_list_of_lists=True
-                )
-                
-                # Update combo box if in user management tab
-                if hasattr(self, 'user_combo'):
-                    current_user = self.user_combo.currentText()
-                    self.user_combo.clear()
-                    self.user_combo.addItems(user_combo_data)
-                    
-                    # Restore previous selection if it still exists
-                    if current_user:
-                        index = self.user_combo.findText(current_user)
-                        if index >= 0:
-                            self.user_combo.setCurrentIndex(index)
-                    
+                self.users_cursor = data.get('next_cursor')
+                new_users = self.add_users(data['user_ips'])
+
+                # Load settings for the users of this page in one request
+                self.prefetch_user_settings(new_users)
         except Exception as e:
             print(f"Error refreshing users: {str(e)}")
 
+    def on_users_scrolled(self, value):
+        scroll_bar = self.users_table.verticalScrollBar()
+        if self.users_cursor and value >= scroll_bar.maximum() - 5:
+            self.load_users_page()
+
+    def set_online_users(self, users):
+        """Replace the online users with a full presence snapshot"""
+        self.online_users = {str(user['user_id']): user for user in users}
+        for user_id in self.user_rows:
+            self.update_user_status(user_id)
+
+    def clear_users(self):
+        self.user_rows = {}
+        self.users_cursor = None
+        self.user_settings_cache = {}
+        self.users_table.setRowCount(0)
+        if hasattr(self, 'user_combo'):
+            self.user_combo.clear()
+
+    def add_users(self, users):
+        """Append users that are not listed yet; returns their IDs"""
+        added = []
+        for user in users:
+            user_id = str(user['user_id'])
+            if user_id in self.user_rows:
+                continue
+            added.append(user_id)
+
+            address = f"{user['ip_address']}:{user['port']}" if user.get('ip_address') else '-'
+            row = self.users_table.rowCount()
+            self.user_rows[user_id] = row
+            self.users_table.insertRow(row)
+            self.users_table.setItem(row, 0, QTableWidgetItem(user_id))
+            self.users_table.setItem(row, 1, QTableWidgetItem(address))
+            self.update_user_status(user_id)
+
+            # Keep the user management combo box in sync
+            if hasattr(self, 'user_combo'):
+                self.user_combo.addItem(f"{user_id} - {address}")
+        return added
+
+    def update_user_status(self, user_id):
+        """Show whether a listed user is online"""
+        row = self.user_rows.get(user_id)
+        if row is not None:
+            status = 'Online' if user_id in self.online_users else 'Offline'
+            self.users_table.setItem(row, 2, QTableWidgetItem(status))
+
+    def apply_presence_event(self, event):
+        """Update a single user's status instead of reloading the whole list"""
+        user_id = str(event.get('user_id'))
+        # Settings of a (re)joining user are fetched on selection
+        self.user_settings_cache.pop(user_id, None)
+        if event.get('status') == 'online':
+            self.online_users[user_id] = event
+            # A user registered after the list was loaded is appended
+            search = self.users_search.text().strip()
+            if not search or user_id.startswith(search) or (event.get('ip_address') or '').startswith(search):
+                self.add_users([event])
+        else:
+            self.online_users.pop(user_id, None)
+        self.update_user_status(user_id)
+
+    def login_to_server(self):
+        """Log in to the server's Django admin with SERVER_ADMIN_USERNAME and SERVER_ADMIN_PASSWORD from .env"""
+        username = os.getenv('SERVER_ADMIN_USERNAME')
+        if not username:
+            print("SERVER_ADMIN_USERNAME is not set, admin-only server requests will be refused")
+            return False
+        try:
+            login_url = f"{self.server_url}/admin/login/"
+            self.api.get(login_url, timeout=5)
+            self.api.post(login_url, data={
+                'username': username,
+                'password': os.getenv('SERVER_ADMIN_PASSWORD', ''),
+                'csrfmiddlewaretoken': self.api.cookies.get('csrftoken', ''),
+                'next': '/admin/'
+            }, headers={'Referer': login_url}, timeout=5)
+            if 'sessionid' not in self.api.cookies:
+                print("Server admin login failed, check SERVER_ADMIN_USERNAME and SERVER_ADMIN_PASSWORD")
+                return False
+            return True
+        except Exception as e:
+            print(f"Error logging in to server: {str(e)}")
+            return False
+
+    def admin_request(self, method, url, **kwargs):
+        """Send a request with the staff session, logging in again once if the server refuses it"""
+        response = self.api.request(method, url, **kwargs)
+        if response.status_code == 401 and self.login_to_server():
+            response = self.api.request(method, url, **kwargs)
+        return response
+
+    def prefetch_user_settings(self, user_ids):
+        """Fetch settings of many users with a single batch request and add them to the cache"""
+        if not user_ids:
+            return
+        try:
+            response = self.admin_request(
+                'POST',
+                f"{self.server_url}/api/user-settings/batch/fetch/",
+                json={'user_ids': user_ids},
+                timeout=10
+            )
+            if response.status_code == 200:
+                for result in response.json().get('results', []):
+                    if result.get('status') == 'success':
+                        self.user_settings_cache[result['user_id']] = {
+                            **result['settings'],
+                            'overrides': result['overrides'],
+                            'version': result['version']
+                        }
+        except Exception as e:
+            print(f"Error prefetching user settings: {str(e)}")
+
+    def apply_settings_to_all_users(self):
+        """Save the settings shown in User Management for every listed user in one request"""
+        user_ids = [self.user_combo.itemText(i).split(" - ")[0] for i in range(self.user_combo.count())]
+        if not user_ids:
+            DialogManager.show_warning_dialog("Error", "No users to update", self)
+            return
+        
+        if not DialogManager.show_confirmation_dialog(
+            "Apply to All Users",
+            f"Replace the settings of all {len(user_ids)} listed users with the settings shown?",
+            self
+        ):
+            return
+        
+        try:
+            settings = {
+                'blocked_sites': TableManager.get_table_data(self.user_blocked_table),
+                'excluded_sites': TableManager.get_table_data(self.user_excluded_table),
+                'categories': TableManager.get_table_data(self.user_categories_table, as_dict=True)
+            }
+            response = self.admin_request(
+                'POST',
+                f"{self.server_url}/api/user-settings/batch/update/",
+                json={'user_ids': user_ids, 'settings': settings},
+                timeout=30
+            )
+            if response.status_code != 200:
+                DialogManager.show_warning_dialog("Error", f"Failed to save settings to server: {response.text}", self)
+                return
+            
+            results = response.json().get('results', [])
+            failed = [result['user_id'] for result in results if result.get('status') != 'success']
+            self.user_settings_cache = {}
+            if failed:
+                DialogManager.show_warning_dialog(
+                    "Partially Applied",
+                    f"Settings saved for {len(results) - len(failed)} users. Failed for: {', '.join(failed)}",
+                    self
+                )
+            else:
+                DialogManager.show_info_dialog("Success", f"Settings saved for {len(results)} users.", self)
+            
+        except Exception as e:
+            print(f"Error applying settings to all users: {str(e)}")
+            DialogManager.show_error_dialog("Error", f"Failed to apply settings: {str(e)}", self)
+
     def on_user_selected(self):
         # Get the selected user info from the combo box
         selected_user = self.user_combo.currentText()
@@ -696,19 +1049,28 @@ class DashboardWindow(QMainWindow):
                 user_id = selected_user.split(" - ")[0]
                 self.current_user_id = user_id
                 
-                # Get user settings directly from the main server
-                user_settings_url = f"{self.server_url}/api/user-settings/{user_id}/"
-                headers = {'Authorization': f'Bearer {user_id}'}
-                print(f"Getting settings from: {user_settings_url}")  # Debug print
+                # Use the settings prefetched in batch, fall back to a single request
+                data = self.user_settings_cache.get(user_id)
+                if data is None:
+                    user_settings_url = f"{self.server_url}/api/user-settings/{user_id}/"
+                    headers = {'Authorization': f'Bearer {user_id}'}
+                    print(f"Getting settings from: {user_settings_url}")  # Debug print
+                    
+                    user_settings_response = requests.get(user_settings_url, headers=headers, timeout=5)
+                    if user_settings_response.status_code == 200:
+                        data = user_settings_response.json()
+                        self.user_settings_cache[user_id] = data
                 
-                user_settings_response = requests.get(user_settings_url, headers=headers, timeout=5)
-                if user_settings_response.status_code == 200:
-                    data = user_settings_response.json()
+                if data is not None:
+                    self.current_settings_version = data.get('version')
+                    
+                    # Edit the user's own overrides; shared policy rules are managed separately
+                    overrides = data.get('overrides', data)
                     
                     # Update tables using TableManager
-                    TableManager.populate_table(self.user_blocked_table, data.get('blocked_sites', []))
-                    TableManager.populate_table(self.user_excluded_table, data.get('excluded_sites', []))
-                    TableManager.populate_table(self.user_categories_table, data.get('categories', {}), is_dict=True)
+                    TableManager.populate_table(self.user_blocked_table, overrides.get('blocked_sites', []))
+                    TableManager.populate_table(self.user_excluded_table, overrides.get('excluded_sites', []))
+                    TableManager.populate_table(self.user_categories_table, overrides.get('categories', {}), is_dict=True)
                         
             except Exception as e:
                 print(f"Error loading user settings: {str(e)}")
@@ -736,6 +1098,10 @@ class DashboardWindow(QMainWindow):
                 'excluded_sites': excluded_sites,
                 'categories': categories
             }
+            payload = dict(settings)
+            if self.current_settings_version is not None:
+                # Only save if nobody changed the settings since they were loaded
+                payload['version'] = self.current_settings_version
 
             # Save to main server using POST method
             headers = {
@@ -745,26 +1111,28 @@ class DashboardWindow(QMainWindow):
             
             server_response = requests.post(
                 f"{self.server_url}/api/user-settings/{user_id}/",
-                json=settings,
+                json=payload,
                 headers=headers,
                 verify=False
             )
             
+            if server_response.status_code == 409:
+                DialogManager.show_warning_dialog(
+                    "Settings Changed",
+                    "These settings were changed by someone else. The latest settings will be reloaded.",
+                    self
+                )
+                self.user_settings_cache.pop(user_id, None)
+                self.on_user_selected()
+                return
+            
             if server_response.status_code != 200:
                 DialogManager.show_warning_dialog("Error", f"Failed to save settings to server: {server_response.text}", self)
                 return
+            self.current_settings_version = server_response.json().get('version')
+            self.user_settings_cache.pop(user_id, None)
             
-            # Send WebSocket message to notify clients about settings change
-            if self.websocket.state() == QAbstractSocket.SocketState.ConnectedState:
-                self.websocket.sendTextMessage(json.dumps({
-                    'type': 'settings_change',
-                    'user_id': user_id,
-                    'settings': settings
-                }))
-                print(f"WebSocket notification sent for user {user_id} settings change")
-            else:
-                print(f"WebSocket not connected (state: {self.websocket.state()}), can't send settings change notification")
-            
+            # The server pushes the new effective settings to the user's connected clients
             DialogManager.show_info_dialog("Success", "Settings saved successfully and notification sent to user.", self)
             
         except Exception as e:
@@ -938,17 +1306,6 @@ class DashboardWindow(QMainWindow):
         ):
             TableManager.delete_item(table, current_row)
 
-    def check_user_status(self, address, user_id):
-        try:
-            response = requests.get(f"http://{address}/status", timeout=2)
-            if response.status_code == 200:
-                data = response.json()
-                if str(data.get('user_id')) == str(user_id):  # Verify user_id matches
-                    return True, "Online"
-            return False, "Offline"
-        except:
-            return False, "Offline"
-
     def closeEvent(self, event):
         confirmation = QMessageBox.question(
             self, "Confirm Exit", "Are you sure you want to exit?",
@@ -1,40 +1,303 @@
 import mitmproxy.http
 from mitmproxy import ctx
+import collections
+import gzip
+import hashlib
 import json
+import os
 import re
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+POLICY_ARTIFACT_MAGIC = b'EFPA'
+POLICY_ARTIFACT_FORMAT = 1
+
+
+class EventReporter:
+    """
+    Upload block/allow events to the server in compressed batches.
+
+    Events are buffered in memory (the oldest are dropped when the buffer is
+    full) and sent by a background thread every flush_interval seconds, or
+    sooner once a full batch is waiting. A batch keeps its batch_id until the
+    server answers, so retrying after a timeout never stores it twice.
+    """
+
+    def __init__(self, flush_interval=5, max_batch=500, max_buffer=20000, max_backoff=60):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self.buffer = collections.deque(maxlen=max_buffer)
+        self.pending = None  # (batch_id, events) being sent until the server answers
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # The thread and done() must not send the same batch at once
+        self.wake = threading.Event()
+        self.thread = None
+
+    def record(self, action, reason, host, category=None):
+        with self.lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append({'ts': time.time(), 'action': action, 'reason': reason, 'host': host, 'category': category})
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='event-reporter', daemon=True)
+                self.thread.start()
+            if len(self.buffer) >= self.max_batch:
+                self.wake.set()
+
+    def run(self):
+        backoff = self.flush_interval
+        while True:
+            self.wake.wait(backoff)
+            self.wake.clear()
+            while self.send_next():
+                backoff = self.flush_interval
+            if self.pending:
+                # Server unreachable or busy: retry the same batch later, backing off
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def send_next(self):
+        """Send one batch; returns True if the next batch can be sent right away."""
+        with self.send_lock:
+            return self.send_pending()
+
+    def send_pending(self):
+        with self.lock:
+            if self.pending is None and self.buffer:
+                events = [self.buffer.popleft() for _ in range(min(self.max_batch, len(self.buffer)))]
+                self.pending = (str(uuid.uuid4()), events)
+        if self.pending is None:
+            return False
+
+        import requests
+        from dotenv import load_dotenv
+        load_dotenv()
+        user_id = os.getenv('USER_ID')
+        if not user_id:
+            return False  # Not registered yet; keep the events
+        batch_id, events = self.pending
+        body = gzip.compress(json.dumps({'user_id': user_id, 'batch_id': batch_id, 'events': events}).encode('utf-8'))
+        try:
+            response = requests.post(
+                f"{os.getenv('SERVER_URL', 'http://127.0.0.1:8000')}/api/events/batch/",
+                data=body,
+                headers={
+                    'Authorization': f'Bearer {user_id}',
+                    'Content-Type': 'application/json',
+                    'Content-Encoding': 'gzip',
+                },
+                timeout=10,
+            )
+        except requests.RequestException as e:
+            ctx.log.warn(f"Could not upload {len(events)} events: {e}")
+            return False
+        if response.status_code >= 500 or response.status_code == 429:
+            ctx.log.warn(f"Server did not store {len(events)} events ({response.status_code}), retrying later")
+            return False
+        if response.status_code != 200:
+            # Retrying cannot help (bad batch or credentials)
+            ctx.log.error(f"Server rejected {len(events)} events ({response.status_code}): {response.text[:200]}")
+        self.pending = None
+        return bool(self.buffer)
+
+    def flush(self):
+        """Send everything buffered, stopping at the first failure."""
+        while self.send_next():
+            pass
+
+
+def process_rss_kb():
+    """Resident memory of this process in KB (peak memory where the current value is not available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                    'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        get_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_process.restype = wintypes.HANDLE
+        if ctypes.windll.psapi.GetProcessMemoryInfo(get_process(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize // 1024
+        return None
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # Bytes on macOS, KB elsewhere
+
+
+class ProxyStats:
+    """
+    Counters of this proxy for the server's fleet view.
+
+    Every interval seconds (TELEMETRY_INTERVAL, the rate user_gui sends them
+    at) a snapshot is written to stats_file, which user_gui sends over its
+    WebSocket. Flow and block counts are totals since the proxy started;
+    latency (time spent in this addon per flow) covers the flows since the
+    previous snapshot.
+    """
+
+    def __init__(self, stats_file='proxy_stats.json', interval=None, max_samples=10000):
+        self.stats_file = stats_file
+        self.interval = interval or float(os.getenv('TELEMETRY_INTERVAL', '10'))
+        self.max_samples = max_samples
+        self.started_at = time.time()
+        self.flows = 0
+        self.blocked = collections.Counter()  # category, or 'site' for the blocked sites list
+        self.latencies_ms = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add_time(self, flow, seconds):
+        flow.metadata['edufilter_seconds'] = flow.metadata.get('edufilter_seconds', 0) + seconds
+
+    def finish_flow(self, flow, seconds):
+        total = flow.metadata.get('edufilter_seconds', 0) + seconds
+        with self.lock:
+            self.flows += 1
+            if len(self.latencies_ms) < self.max_samples:
+                self.latencies_ms.append(total * 1000)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='proxy-stats', daemon=True)
+                self.thread.start()
+
+    def record_block(self, kind):
+        with self.lock:
+            self.blocked[kind] += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies, self.latencies_ms = sorted(self.latencies_ms), []
+            flows, blocked = self.flows, dict(self.blocked)
+        return {
+            'ts': time.time(),
+            'started_at': self.started_at,
+            'interval': self.interval,
+            'flows': flows,
+            'blocked': blocked,
+            'latency_ms': {
+                'samples': len(latencies),
+                'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'p99': round(latencies[max(0, -(-len(latencies) * 99 // 100) - 1)], 3) if latencies else None,
+            },
+            'rss_kb': process_rss_kb(),
+        }
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                # Write and rename, so user_gui never reads half a file
+                with open(self.stats_file + '.tmp', 'w') as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(self.stats_file + '.tmp', self.stats_file)
+            except OSError as e:
+                ctx.log.error(f"Error writing proxy stats: {e}")
+
+
+def read_policy_artifact(path, artifact_id):
+    """
+    Read a policy artifact compiled by the server (see the server's
+    policy_artifacts.py), or None if it is missing, damaged or not artifact_id.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    header_size = len(POLICY_ARTIFACT_MAGIC) + 1 + 32
+    if len(data) < header_size or not data.startswith(POLICY_ARTIFACT_MAGIC):
+        return None
+    if data[len(POLICY_ARTIFACT_MAGIC)] != POLICY_ARTIFACT_FORMAT:
+        return None
+    checksum, body = data[header_size - 32:header_size], data[header_size:]
+    digest = hashlib.sha256(body)
+    if digest.digest() != checksum or digest.hexdigest() != artifact_id:
+        return None
+    try:
+        return json.loads(zlib.decompress(body))
+    except (zlib.error, ValueError):
+        return None
+
+
+def compile_rules(blocked_sites, excluded_sites, categories):
+    """Compile plain settings the way the server compiles a policy artifact."""
+    names = []
+    groups = []
+    for category, keywords in categories.items():
+        keywords = [keyword for keyword in dict.fromkeys(keywords or []) if keyword]
+        if not keywords:
+            continue
+        groups.append(rf"(?P<c{len(names)}>\b(?:{'|'.join(map(re.escape, keywords))})\b)")
+        names.append(category)
+    return {
+        'blocked_sites': list(dict.fromkeys(blocked_sites)),
+        'excluded_sites': list(dict.fromkeys(excluded_sites)),
+        'categories': names,
+        'content_pattern': '|'.join(groups) or None,
+    }
 
 
 class BlockSites:
     def __init__(self):
         self.blocked_sites_file = 'blocked_sites.json'
+        self.policy_file = 'policy.bin'  # Compiled by the server, downloaded by user_gui
         self.blocked_sites = []
         self.excluded_sites = []
-        self.category_keywords = {}
+        self.content_pattern = None
+        self.content_categories = []
+        self.settings_mtime = None
         self.last_update_time = 0
         self.reload_interval = 5  # Check for updates every 5 seconds
+        self.events = EventReporter()
+        self.stats = ProxyStats()
         self.load_blocked_sites()
 
     def load_blocked_sites(self):
-        """Load settings from local file only."""
+        """Load settings from local files only, if they changed since the last load."""
         try:
+            stat = os.stat(self.blocked_sites_file)
+            if (stat.st_mtime_ns, stat.st_size) == self.settings_mtime:
+                return
             with open(self.blocked_sites_file, 'r') as f:
                 data = json.load(f)
-                self.blocked_sites = data.get('blocked_sites', [])
-                self.excluded_sites = data.get('excluded_sites', [])
-                self.category_keywords = data.get('categories', {})
-                ctx.log.info("Configuration loaded successfully from local file.")
+            # The artifact is only used if it is the one these settings were saved with
+            rules = read_policy_artifact(self.policy_file, data['artifact_id']) if data.get('artifact_id') else None
+            source = 'compiled policy'
+            if rules is None:
+                rules = compile_rules(data.get('blocked_sites', []), data.get('excluded_sites', []), data.get('categories', {}))
+                source = 'settings'
+            self.apply_rules(rules)
+            self.settings_mtime = (stat.st_mtime_ns, stat.st_size)
+            ctx.log.info(f"Configuration loaded successfully from local file ({source}).")
         except Exception as e:
             ctx.log.error(f"Error loading local configuration file: {e}")
             # If local file fails, initialize with empty values
-            self.blocked_sites = []
-            self.excluded_sites = []
-            self.category_keywords = {}
+            self.apply_rules(compile_rules([], [], {}))
+            self.settings_mtime = None
             ctx.log.info("Initialized with empty configuration")
 
-    def create_pattern_for_keywords(self, keywords):
-        if not keywords:
-            return None
-        return re.compile("|".join(rf"\b{re.escape(keyword)}\b" for keyword in keywords), re.IGNORECASE)
+    def apply_rules(self, rules):
+        """Switch to compiled rules; the keyword pattern is compiled once here, not per page."""
+        pattern = rules.get('content_pattern')
+        self.content_pattern = re.compile(pattern, re.IGNORECASE) if pattern else None
+        self.content_categories = rules.get('categories', [])
+        self.blocked_sites = rules.get('blocked_sites', [])
+        self.excluded_sites = rules.get('excluded_sites', [])
 
     def is_excluded(self, host):
         # Always allow localhost and local network
@@ -86,11 +349,25 @@ class BlockSites:
         )
 
     def request(self, flow: mitmproxy.http.HTTPFlow) -> None:
+        start = time.perf_counter()
+        try:
+            self.check_request(flow)
+        finally:
+            self.stats.add_time(flow, time.perf_counter() - start)
+
+    def response(self, flow: mitmproxy.http.HTTPFlow) -> None:
+        start = time.perf_counter()
+        try:
+            self.check_response(flow)
+        finally:
+            # Counts every flow once, including those blocked in request() (the response hook sees the warning page)
+            self.stats.finish_flow(flow, time.perf_counter() - start)
+
+    def check_request(self, flow):
         # Skip if no host
         if not flow.request.host:
             return
             
-        import time
         current_time = time.time()
         if current_time - self.last_update_time > self.reload_interval:
             self.load_blocked_sites()
@@ -104,12 +381,18 @@ class BlockSites:
             if blocked_site in flow.request.host:
                 self.show_warning_page(flow, f"Site '{flow.request.host}' is blocked.")
                 ctx.log.info(f"Blocked site: {flow.request.pretty_url}")
+                # The response hook also sees the warning page; don't report it again
+                flow.metadata['edufilter_reported'] = True
+                self.events.record('blocked', 'site', flow.request.host)
+                self.stats.record_block('site')
                 return
 
-    def response(self, flow: mitmproxy.http.HTTPFlow) -> None:
+    def check_response(self, flow):
         # Skip if no host or is excluded
         if not flow.request.host or self.is_excluded(flow.request.host):
             return
+        if flow.metadata.get('edufilter_reported'):
+            return
 
         try:
             if flow.response and flow.response.content:
@@ -117,16 +400,24 @@ class BlockSites:
                 # Only check text content
                 if "text" in content_type or "javascript" in content_type:
                     content = flow.response.content.decode('utf-8', errors='ignore')
-                    for category, keywords in self.category_keywords.items():
-                        pattern = self.create_pattern_for_keywords(keywords)
-                        if pattern:
-                            matches = pattern.findall(content)
-                            if matches:  # Block if any keyword is found
-                                self.show_warning_page(flow, f"Blocked due to inappropriate content in category: {category}.")
-                                ctx.log.info(f"Blocked content from {flow.request.pretty_url} due to category: {category}")
-                                return
+                    # One scan for all categories; the first keyword found decides the category
+                    match = self.content_pattern.search(content) if self.content_pattern else None
+                    if match:  # Block if any keyword is found
+                        category = self.content_categories[int(match.lastgroup[1:])]
+                        self.show_warning_page(flow, f"Blocked due to inappropriate content in category: {category}.")
+                        ctx.log.info(f"Blocked content from {flow.request.pretty_url} due to category: {category}")
+                        self.events.record('blocked', 'category', flow.request.host, category)
+                        self.stats.record_block(category)
+                        return
+                    # Only pages are reported as allowed, not every script and stylesheet
+                    if "text/html" in content_type:
+                        self.events.record('allowed', 'page', flow.request.host)
         except Exception as e:
             ctx.log.error(f"Error processing response: {e}")
 
+    def done(self):
+        # mitmproxy is shutting down: upload what is still buffered
+        self.events.flush()
+
 
 addons = [BlockSites()]
\ No newline at end of file
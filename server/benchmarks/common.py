@@ -0,0 +1,45 @@
+"""Helpers shared by the benchmark scripts in this directory."""
+import json
+import os
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    """Make the server package importable and configure Django from .env like manage.py does."""
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'script_server.settings')
+    import django
+    django.setup()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def latency_summary(samples_ms):
+    """Summarize latencies in milliseconds."""
+    return {
+        'count': len(samples_ms),
+        'mean_ms': round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0,
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p95_ms': round(percentile(samples_ms, 95), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'max_ms': round(max(samples_ms), 3) if samples_ms else 0,
+    }
+
+
+def print_report(report, output=None):
+    """Print a report as JSON and optionally save it to a file."""
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
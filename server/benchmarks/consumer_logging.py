@@ -0,0 +1,106 @@
+"""
+WebSocket consumer throughput with different logging setups: messages/sec of
+ping/pong round trips over several concurrent connections.
+
+Modes:
+    off    - consumer logger at WARNING, nothing is logged per message
+    sync   - the old setup: DEBUG, every message and payload formatted and
+             written to a file on the event loop
+    queue  - the current setup: sampled per-message events handed to the
+             background writer thread
+
+Usage (from the server directory, with the database configured in .env):
+    python benchmarks/consumer_logging.py --connections 20 --messages 500
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from common import setup_django, print_report
+
+setup_django()
+
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.conf import settings  # noqa: E402
+from script_server import consumers  # noqa: E402
+from script_server.consumers import StatusConsumer  # noqa: E402
+from script_server.logging_utils import QueueListenerHandler, SamplingFilter  # noqa: E402
+
+MODES = ('off', 'sync', 'queue')
+
+
+def configure(mode, log_file):
+    """Point the consumer logger at the handler of a mode; returns the handler to close afterwards."""
+    logger = logging.getLogger('script_server')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.propagate = False
+
+    if mode == 'off':
+        logger.setLevel(logging.WARNING)
+        consumers.server_settings.WS_LOG_PAYLOADS = False
+        return None
+    if mode == 'sync':
+        logger.setLevel(logging.DEBUG)
+        consumers.server_settings.WS_LOG_PAYLOADS = True
+        handler = logging.StreamHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s %(fields)s'))
+    else:
+        logger.setLevel(logging.INFO)
+        consumers.server_settings.WS_LOG_PAYLOADS = False
+        handler = QueueListenerHandler(stream=log_file)
+        rate = settings.WS_LOG_SAMPLE_RATE
+        handler.addFilter(SamplingFilter({'ws_message': rate, 'ws_send': rate, 'ws_settings_push': rate}))
+    logger.addHandler(handler)
+    return handler
+
+
+async def client(messages):
+    communicator = WebsocketCommunicator(
+        StatusConsumer.as_asgi(), '/ws/status/', headers=[(b'origin', b'http://localhost')]
+    )
+    communicator.scope['client'] = ('127.0.0.1', 1)
+    connected, _ = await communicator.connect()
+    if not connected:
+        raise RuntimeError("WebSocket connection was rejected")
+    for _ in range(messages):
+        await communicator.send_json_to({'type': 'ping'})
+        await communicator.receive_json_from(timeout=5)
+    await communicator.disconnect()
+
+
+async def run(mode, connections, messages):
+    with tempfile.TemporaryFile('w+') as log_file:
+        handler = configure(mode, log_file)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(messages) for _ in range(connections)))
+        elapsed = time.perf_counter() - start
+        if handler:
+            handler.close()
+        log_file.seek(0, 2)
+        log_bytes = log_file.tell()
+    total = connections * messages
+    return {
+        'mode': mode,
+        'messages': total,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(total / elapsed, 1),
+        'log_bytes': log_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=500, help='Ping round trips per connection')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = [asyncio.run(run(mode, args.connections, args.messages)) for mode in args.modes]
+    print_report({'connections': args.connections, 'results': results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
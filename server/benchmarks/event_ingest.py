@@ -0,0 +1,121 @@
+"""
+Block event ingestion throughput: events/sec sustained by /api/events/batch/
+with gzip-compressed batches posted concurrently, as client proxies do.
+
+Start the server under daphne first, e.g.
+    daphne -b 127.0.0.1 -p 8000 script_server.asgi:application
+
+Usage:
+    python benchmarks/event_ingest.py --url http://127.0.0.1:8000 --concurrency 20 --batch-size 500 --duration 20
+
+Every batch has a new batch_id, so all events are stored; simulated users are
+named bench-events-<n>. Like http_load.py, only the standard library is used.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import time
+import uuid
+from urllib.parse import urlsplit
+from common import latency_summary, print_report
+from http_load import read_response
+
+USER_PREFIX = 'bench-events-'
+HOSTS = [f'site{i}.example.com' for i in range(200)]
+CATEGORIES = ['gambling_and_betting', 'violence_and_gore', 'addictive_or_distracting_content']
+
+
+def build_batch(user_id, size, host, compress):
+    """Return the raw HTTP request bytes for one batch upload and its uncompressed size."""
+    now = time.time()
+    events = []
+    for _ in range(size):
+        action = random.choice(('blocked', 'allowed', 'allowed', 'allowed'))
+        category = random.choice(CATEGORIES) if action == 'blocked' and random.random() < 0.5 else None
+        events.append({
+            'ts': now - random.random() * 60,
+            'action': action,
+            'reason': ('category' if category else 'site') if action == 'blocked' else 'page',
+            'host': random.choice(HOSTS),
+            'category': category,
+        })
+    raw = json.dumps({'user_id': user_id, 'batch_id': str(uuid.uuid4()), 'events': events}).encode()
+    body = gzip.compress(raw) if compress else raw
+    headers = {
+        'Host': host,
+        'Authorization': f'Bearer {user_id}',
+        'Connection': 'keep-alive',
+        'Content-Type': 'application/json',
+        'Content-Length': str(len(body)),
+    }
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    head = "POST /api/events/batch/ HTTP/1.1\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    return head.encode() + body, len(raw), len(body)
+
+
+async def worker(index, args, deadline, stats):
+    url = urlsplit(args.url)
+    user_id = f"{USER_PREFIX}{index}"
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        # Built outside the timed section: the client's cost is not what is measured
+        request, raw_size, sent_size = build_batch(user_id, args.batch_size, url.netloc, not args.no_gzip)
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await read_response(reader)
+            stats['latencies'].append((time.perf_counter() - start) * 1000)
+            if status == 200:
+                stats['events'] += args.batch_size
+                stats['raw_bytes'] += raw_size
+                stats['sent_bytes'] += sent_size
+            else:
+                stats['errors'][str(status)] = stats['errors'].get(str(status), 0) + 1
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+            stats['errors'][type(e).__name__] = stats['errors'].get(type(e).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run(args):
+    stats = {'latencies': [], 'events': 0, 'raw_bytes': 0, 'sent_bytes': 0, 'errors': {}}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(worker(i, args, deadline, stats) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': args.concurrency,
+        'batch_size': args.batch_size,
+        'gzip': not args.no_gzip,
+        'events_per_sec': round(stats['events'] / elapsed, 1),
+        'batches_per_sec': round(len(stats['latencies']) / elapsed, 1),
+        'compression_ratio': round(stats['raw_bytes'] / stats['sent_bytes'], 2) if stats['sent_bytes'] else None,
+        'latency': latency_summary(stats['latencies']),
+        'errors': stats['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=20, help='Simulated proxies uploading at the same time')
+    parser.add_argument('--batch-size', type=int, default=500, help='Events per batch')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--no-gzip', action='store_true', help='Send uncompressed batches')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    print_report(asyncio.run(run(args)), args.output)
+
+
+if __name__ == '__main__':
+    main()
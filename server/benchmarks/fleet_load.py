@@ -0,0 +1,414 @@
+"""
+Fleet load test: simulates N student clients and M admins against a running
+server and reports throughput, latency percentiles, settings propagation
+delay and server resource usage as JSON.
+
+Each simulated user does what user_gui does on start-up: POST
+/api/register-ip/, GET /api/user-settings/<id>/, open the WebSocket, send
+'user_status' and answer the server's pings. It also measures WebSocket
+round trips with its own pings. Admins connect with 'admin_connect' and save
+a user's settings every --admin-interval seconds (what save_user_settings
+in admin_panel does); the delay until that user receives the pushed
+'settings_change' is the propagation delay. Reconnect storms drop a share
+of the user connections at once and reconnect them immediately.
+
+Start the server first, e.g.
+    daphne -b 127.0.0.1 -p 8000 script_server.asgi:application
+
+Usage:
+    python benchmarks/fleet_load.py --url http://127.0.0.1:8000 --users 500 --admins 5 \\
+        --duration 60 --storms 2 --storm-fraction 0.5
+
+Server resources are sampled from /proc (Linux) for the daphne processes
+found automatically, or for the PIDs given with --pid (e.g. Postgres too).
+The load generator's own CPU is reported as well: if it is close to 100%,
+the numbers describe the client rather than the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from urllib.parse import urlsplit
+import websockets
+from common import latency_summary, print_report
+from http_load import read_response
+
+USER_PREFIX = 'bench-fleet-'
+MARKER_PREFIX = 'fleet-'
+MARKER_SUFFIX = '.bench.invalid'
+
+
+class Stats:
+    """Samples and counters shared by all simulated clients."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.counters = {}
+        # Settings saves waiting for their push: marker -> (user_id, perf_counter at save)
+        self.pending_pushes = {}
+
+    def observe(self, name, seconds):
+        self.latencies.setdefault(name, []).append(seconds * 1000)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+class ProcessSampler:
+    """Sample CPU, memory, open files and threads of processes from /proc once per interval."""
+
+    def __init__(self, pids, interval=1.0):
+        self.pids = pids
+        self.interval = interval
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.samples = {pid: [] for pid in pids}
+
+    def _read(self, pid):
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self.ticks
+        threads = int(fields[17])
+        rss_bytes = int(fields[21]) * self.page_size
+        fds = len(os.listdir(f'/proc/{pid}/fd'))
+        return cpu_seconds, rss_bytes, fds, threads
+
+    async def run(self):
+        previous = {}
+        while True:
+            now = time.perf_counter()
+            for pid in self.pids:
+                try:
+                    cpu_seconds, rss_bytes, fds, threads = self._read(pid)
+                except (OSError, IndexError, ValueError):
+                    continue
+                if pid in previous:
+                    last_time, last_cpu = previous[pid]
+                    cpu_pct = 100 * (cpu_seconds - last_cpu) / (now - last_time)
+                    self.samples[pid].append((cpu_pct, rss_bytes, fds, threads))
+                previous[pid] = (now, cpu_seconds)
+            await asyncio.sleep(self.interval)
+
+    def summary(self):
+        report = {}
+        for pid, samples in self.samples.items():
+            if not samples:
+                continue
+            cpu = [sample[0] for sample in samples]
+            report[str(pid)] = {
+                'name': process_name(pid),
+                'cpu_pct_mean': round(sum(cpu) / len(cpu), 1),
+                'cpu_pct_max': round(max(cpu), 1),
+                'rss_mb_max': round(max(sample[1] for sample in samples) / 2 ** 20, 1),
+                'open_fds_max': max(sample[2] for sample in samples),
+                'threads_max': max(sample[3] for sample in samples),
+            }
+        return report
+
+
+def process_name(pid):
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return f.read().replace(b'\0', b' ').decode(errors='replace').strip()[:120]
+    except OSError:
+        return ''
+
+
+def find_server_pids():
+    """PIDs of running daphne processes."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit() and int(entry) != os.getpid() and 'daphne' in process_name(int(entry)):
+            pids.append(int(entry))
+    return pids
+
+
+async def http_request(url, method, path, user_id, stats, name, body=None):
+    """Send one request on a fresh connection (like the requests-based clients) and record its latency."""
+    data = json.dumps(body).encode() if body is not None else b''
+    headers = {
+        'Host': url.netloc,
+        'Authorization': f'Bearer {user_id}',
+        'Connection': 'close',
+        'Content-Length': str(len(data)),
+    }
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+    request = f"{method} {path} HTTP/1.1\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    start = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        writer.write(request.encode() + data)
+        await writer.drain()
+        status = await read_response(reader)
+    except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+        stats.error(f'{name}:{type(e).__name__}')
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+    stats.observe(name, time.perf_counter() - start)
+    stats.count('http_requests')
+    if status >= 400:
+        stats.error(f'{name}:{status}')
+    return status
+
+
+class UserClient:
+    """One simulated user_gui instance."""
+
+    def __init__(self, index, args, stats):
+        self.user_id = f"{USER_PREFIX}{index}"
+        self.index = index
+        self.args = args
+        self.url = urlsplit(args.url)
+        self.ws_url = f"ws://{self.url.netloc}/ws/status/"
+        self.stats = stats
+        self.websocket = None
+        self.connected = asyncio.Event()
+        self.reconnect = asyncio.Event()
+
+    async def start_session(self, name):
+        """Register, fetch settings and connect the WebSocket; returns True when connected."""
+        await http_request(self.url, 'POST', '/api/register-ip/', self.user_id, self.stats, 'register_ip', {
+            'user_id': self.user_id,
+            'ip_address': f'10.{self.index // 65536 % 256}.{self.index // 256 % 256}.{self.index % 256}',
+            'port': 8081,
+        })
+        await http_request(self.url, 'GET', f'/api/user-settings/{self.user_id}/', self.user_id, self.stats, 'settings_get')
+        start = time.perf_counter()
+        try:
+            self.websocket = await websockets.connect(
+                self.ws_url, origin=f"http://{self.url.netloc}", ping_interval=None, open_timeout=30
+            )
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            self.stats.error(f'{name}:{type(e).__name__}')
+            return False
+        self.stats.observe(name, time.perf_counter() - start)
+        await self.send({'type': 'user_status', 'user_id': self.user_id, 'status': 'online'})
+        self.connected.set()
+        return True
+
+    async def send(self, message):
+        try:
+            await self.websocket.send(json.dumps(message))
+            self.stats.count('ws_messages_out')
+        except websockets.WebSocketException:
+            pass
+
+    async def receive_loop(self):
+        async for text in self.websocket:
+            self.stats.count('ws_messages_in')
+            message = json.loads(text)
+            message_type = message.get('type')
+            if message_type == 'ping':
+                await self.send({'type': 'pong', 'timestamp': message.get('timestamp')})
+            elif message_type == 'pong' and message.get('timestamp'):
+                self.stats.observe('ws_round_trip', time.perf_counter() - message['timestamp'])
+            elif message_type == 'settings_change':
+                self.record_push(message.get('settings') or {})
+
+    def record_push(self, settings):
+        received = time.perf_counter()
+        self.stats.count('settings_pushes')
+        for site in settings.get('blocked_sites', []):
+            if site.startswith(MARKER_PREFIX) and site in self.stats.pending_pushes:
+                _, saved = self.stats.pending_pushes.pop(site)
+                self.stats.observe('settings_propagation', received - saved)
+
+    async def ping_loop(self):
+        while True:
+            # Spread pings so the clients don't all fire at once
+            await asyncio.sleep(self.args.ws_ping_interval * random.uniform(0.5, 1.5))
+            await self.send({'type': 'ping', 'timestamp': time.perf_counter()})
+
+    async def run(self, stop):
+        name = 'ws_connect'
+        while not stop.is_set():
+            if not await self.start_session(name):
+                await asyncio.sleep(1)
+                continue
+            receiver = asyncio.create_task(self.receive_loop())
+            pinger = asyncio.create_task(self.ping_loop())
+            stop_waiter = asyncio.create_task(stop.wait())
+            reconnect_waiter = asyncio.create_task(self.reconnect.wait())
+            await asyncio.wait([receiver, stop_waiter, reconnect_waiter], return_when=asyncio.FIRST_COMPLETED)
+            self.connected.clear()
+            for task in (pinger, stop_waiter, reconnect_waiter):
+                task.cancel()
+            if receiver.done() and not self.reconnect.is_set() and not stop.is_set():
+                # The server closed the connection on its own
+                self.stats.error(f'ws_closed:{type(receiver.exception()).__name__}' if receiver.exception() else 'ws_closed')
+            await self.websocket.close()
+            receiver.cancel()
+            name = 'storm_reconnect' if self.reconnect.is_set() else 'ws_reconnect'
+            self.reconnect.clear()
+
+
+class AdminClient:
+    """One simulated admin_panel instance."""
+
+    def __init__(self, index, args, stats, users):
+        self.index = index
+        self.args = args
+        self.url = urlsplit(args.url)
+        self.stats = stats
+        self.users = users
+        self.sequence = 0
+
+    async def watch(self):
+        async with websockets.connect(
+            f"ws://{self.url.netloc}/ws/status/", origin=f"http://{self.url.netloc}", ping_interval=None
+        ) as websocket:
+            await websocket.send(json.dumps({'type': 'admin_connect', 'presence_snapshot': False}))
+            async for text in websocket:
+                message_type = json.loads(text).get('type')
+                if message_type == 'presence':
+                    self.stats.count('admin_presence_events')
+
+    async def save_settings(self, user):
+        self.sequence += 1
+        marker = f"{MARKER_PREFIX}{self.index}-{self.sequence}{MARKER_SUFFIX}"
+        self.stats.pending_pushes[marker] = (user.user_id, time.perf_counter())
+        self.stats.count('settings_saves')
+        status = await http_request(self.url, 'POST', f'/api/user-settings/{user.user_id}/', user.user_id, self.stats,
+                                    'settings_save', {'blocked_sites': [marker], 'excluded_sites': [], 'categories': {}})
+        if status != 200:
+            self.stats.pending_pushes.pop(marker, None)
+
+    async def run(self, stop):
+        watcher = asyncio.create_task(self.watch())
+        try:
+            while not stop.is_set():
+                await asyncio.sleep(self.args.admin_interval * random.uniform(0.5, 1.5))
+                connected = [user for user in self.users if user.connected.is_set()]
+                if connected:
+                    await self.save_settings(random.choice(connected))
+        finally:
+            watcher.cancel()
+
+
+async def storm(users, fraction, stats, at):
+    """Drop a share of the connected users at once; they reconnect immediately."""
+    connected = [user for user in users if user.connected.is_set()]
+    victims = random.sample(connected, int(len(connected) * fraction))
+    before = len(stats.latencies.get('storm_reconnect', []))
+    errors_before = sum(stats.errors.values())
+    start = time.perf_counter()
+    for user in victims:
+        user.reconnect.set()
+    # Wait (bounded) until the dropped users are back
+    while time.perf_counter() - start < 60:
+        await asyncio.sleep(0.1)
+        if all(user.connected.is_set() for user in victims):
+            break
+    samples = stats.latencies.get('storm_reconnect', [])[before:]
+    return {
+        'at_s': round(at, 1),
+        'clients': len(victims),
+        'recovered_s': round(time.perf_counter() - start, 2),
+        'recovered': sum(user.connected.is_set() for user in victims),
+        'reconnect': latency_summary(samples),
+        'errors': sum(stats.errors.values()) - errors_before,
+    }
+
+
+async def run(args):
+    stats = Stats()
+    pids = args.pid or find_server_pids()
+    sampler = ProcessSampler(pids + [os.getpid()])
+    sampler_task = asyncio.create_task(sampler.run())
+    stop = asyncio.Event()
+    users = [UserClient(index, args, stats) for index in range(args.users)]
+    admins = [AdminClient(index, args, stats, users) for index in range(args.admins)]
+
+    # Ramp up: connect users at --ramp-rate per second
+    ramp_start = time.perf_counter()
+    tasks = []
+    for user in users:
+        tasks.append(asyncio.create_task(user.run(stop)))
+        await asyncio.sleep(1 / args.ramp_rate)
+    while not all(user.connected.is_set() for user in users) and time.perf_counter() - ramp_start < 120:
+        await asyncio.sleep(0.1)
+    ramp_seconds = time.perf_counter() - ramp_start
+    connected_after_ramp = sum(user.connected.is_set() for user in users)
+
+    # Steady state with admin saves and reconnect storms spread over the duration
+    counters_before = dict(stats.counters)
+    tasks += [asyncio.create_task(admin.run(stop)) for admin in admins]
+    start = time.perf_counter()
+    storm_times = [args.duration * (i + 1) / (args.storms + 1) for i in range(args.storms)]
+    storms = []
+    for storm_at in storm_times:
+        await asyncio.sleep(max(0, start + storm_at - time.perf_counter()))
+        storms.append(await storm(users, args.storm_fraction, stats, storm_at))
+    await asyncio.sleep(max(0, start + args.duration - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    counters = {name: value - counters_before.get(name, 0) for name, value in stats.counters.items()}
+
+    # Give in-flight pushes a moment, then count the saves whose push never arrived
+    await asyncio.sleep(2)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    sampler_task.cancel()
+
+    resources = sampler.summary()
+    load_generator = resources.pop(str(os.getpid()), {})
+    return {
+        'label': args.label,
+        'url': args.url,
+        'users': args.users,
+        'admins': args.admins,
+        'duration_s': args.duration,
+        'ramp': {
+            'seconds': round(ramp_seconds, 2),
+            'connected': connected_after_ramp,
+        },
+        'throughput': {
+            'http_requests_per_sec': round(counters.get('http_requests', 0) / elapsed, 1),
+            'ws_messages_in_per_sec': round(counters.get('ws_messages_in', 0) / elapsed, 1),
+            'ws_messages_out_per_sec': round(counters.get('ws_messages_out', 0) / elapsed, 1),
+            'settings_saves_per_sec': round(counters.get('settings_saves', 0) / elapsed, 2),
+        },
+        'latency': {name: latency_summary(samples) for name, samples in sorted(stats.latencies.items())},
+        'settings_propagation': {
+            'saves': stats.counters.get('settings_saves', 0),
+            'delivered': len(stats.latencies.get('settings_propagation', [])),
+            'missed': len(stats.pending_pushes),
+        },
+        'admin_presence_events': stats.counters.get('admin_presence_events', 0),
+        'storms': storms,
+        'errors': stats.errors,
+        'server_resources': resources,
+        'load_generator': load_generator,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=200, help='Simulated user_gui clients')
+    parser.add_argument('--admins', type=int, default=2, help='Simulated admin_panel clients')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of steady state after the ramp-up')
+    parser.add_argument('--ramp-rate', type=float, default=100, help='New users per second during the ramp-up')
+    parser.add_argument('--ws-ping-interval', type=float, default=5, help='Seconds between round-trip pings per user')
+    parser.add_argument('--admin-interval', type=float, default=1, help='Seconds between settings saves per admin')
+    parser.add_argument('--storms', type=int, default=1, help='Reconnect storms during the steady state')
+    parser.add_argument('--storm-fraction', type=float, default=0.5, help='Share of users dropped per storm')
+    parser.add_argument('--pid', type=int, action='append', help='Server PID to sample (repeatable; default: daphne)')
+    parser.add_argument('--label', default='', help='Free text stored in the report')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    print_report(asyncio.run(run(args)), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Heartbeat write throughput: old get_or_create + save() path vs. single-statement
+upsert vs. the in-memory coalescer.
+
+Usage (from the server directory, with the database configured in .env):
+    python benchmarks/heartbeat_writes.py --users 500 --rounds 5
+"""
+import argparse
+import time
+from common import setup_django, print_report
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from script_server.models import UserStatus  # noqa: E402
+from script_server.heartbeats import HeartbeatCoalescer  # noqa: E402
+
+USER_PREFIX = 'bench-heartbeat-'
+
+
+def legacy_heartbeat(user_id):
+    user_status, created = UserStatus.objects.get_or_create(user_id=user_id)
+    user_status.last_heartbeat = timezone.now()
+    user_status.is_online = True
+    user_status.save()
+
+
+def upsert_heartbeat(user_id):
+    UserStatus.record_heartbeats({user_id: timezone.now()})
+
+
+def run(name, user_ids, rounds, handle, finish=None):
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for user_id in user_ids:
+                handle(user_id)
+            if finish:
+                finish()
+        elapsed = time.perf_counter() - start
+    heartbeats = len(user_ids) * rounds
+    return {
+        'path': name,
+        'heartbeats': heartbeats,
+        'seconds': round(elapsed, 3),
+        'heartbeats_per_sec': round(heartbeats / elapsed, 1),
+        'sql_statements': len(queries),
+        'statements_per_heartbeat': round(len(queries) / heartbeats, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5, help='heartbeats per user; the coalescer flushes once per round')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    user_ids = [f'{USER_PREFIX}{i}' for i in range(args.users)]
+    coalescer = HeartbeatCoalescer(interval=0)
+
+    results = []
+    try:
+        for name, handle, finish in (
+            ('get_or_create+save', legacy_heartbeat, None),
+            ('upsert', upsert_heartbeat, None),
+            ('coalesced', coalescer.record, coalescer.flush),
+        ):
+            UserStatus.objects.filter(user_id__startswith=USER_PREFIX).delete()
+            results.append(run(name, user_ids, args.rounds, handle, finish))
+    finally:
+        UserStatus.objects.filter(user_id__startswith=USER_PREFIX).delete()
+
+    print_report({'users': args.users, 'rounds': args.rounds, 'results': results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+HTTP load test for the hot client endpoints: requests/sec and latency
+percentiles at a given concurrency against a running server.
+
+Start the server under daphne first, e.g.
+    daphne -b 127.0.0.1 -p 8000 script_server.asgi:application
+
+Usage:
+    python benchmarks/http_load.py --url http://127.0.0.1:8000 --concurrency 200 --duration 20
+
+To compare with the synchronous views, run the same command against a server
+started from a checkout of an older revision (git worktree add ../sync <rev>).
+
+Uses only the standard library: each worker keeps one HTTP/1.1 keep-alive
+connection and sends requests back to back.
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+from common import latency_summary, print_report
+
+USER_PREFIX = 'bench-http-'
+
+
+def build_request(endpoint, user_id, host):
+    """Return the raw HTTP request bytes for one call of an endpoint."""
+    headers = {'Host': host, 'Authorization': f'Bearer {user_id}', 'Connection': 'keep-alive'}
+    body = b''
+    if endpoint == 'heartbeat':
+        method, path = 'POST', '/heartbeat/'
+        body = json.dumps({'user_id': user_id}).encode()
+    elif endpoint == 'register_ip':
+        method, path = 'POST', '/api/register-ip/'
+        body = json.dumps({'user_id': user_id, 'ip_address': '10.0.0.1', 'port': 8081}).encode()
+    elif endpoint == 'settings':
+        method, path = 'GET', f'/api/user-settings/{user_id}/'
+    elif endpoint == 'online_users':
+        method, path = 'GET', '/online-users/?limit=100'
+    else:
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+    if body:
+        headers['Content-Type'] = 'application/json'
+    headers['Content-Length'] = str(len(body))
+    head = f"{method} {path} HTTP/1.1\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    return head.encode() + body
+
+
+async def read_response(reader):
+    """Read one HTTP response and return its status code."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    status = int(status_line.split()[1])
+    length = None
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def worker(index, args, endpoint, deadline, latencies, errors):
+    url = urlsplit(args.url)
+    host = url.hostname
+    port = url.port or 80
+    user_id = f"{USER_PREFIX}{index % args.users}"
+    request = build_request(endpoint, user_id, url.netloc)
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run_endpoint(args, endpoint):
+    latencies = []
+    errors = {}
+    # Warm up: create settings rows etc. so the measured phase sees steady state
+    warmup_deadline = time.perf_counter() + args.warmup
+    await asyncio.gather(*(worker(i, args, endpoint, warmup_deadline, [], {}) for i in range(min(args.concurrency, args.users))))
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(worker(i, args, endpoint, deadline, latencies, errors) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'latency': latency_summary(latencies),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--endpoints', default='heartbeat,register_ip,settings,online_users',
+                        help='Comma separated: heartbeat, register_ip, settings, online_users')
+    parser.add_argument('--concurrency', type=int, default=100, help='Concurrent keep-alive connections')
+    parser.add_argument('--users', type=int, default=500, help='Distinct user IDs to spread requests over')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to measure per endpoint')
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds of unmeasured load per endpoint')
+    parser.add_argument('--label', default='', help='Free text stored in the report, e.g. "async views"')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    report = {
+        'label': args.label,
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'endpoints': {},
+    }
+    for endpoint in args.endpoints.split(','):
+        report['endpoints'][endpoint] = asyncio.run(run_endpoint(args, endpoint.strip()))
+    print_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
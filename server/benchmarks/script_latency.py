@@ -0,0 +1,88 @@
+"""
+Per-execution latency of script jobs: a new interpreter per job
+(SubprocessBackend) vs. children forked from warm interpreters
+(WarmPoolBackend).
+
+Runs the backends directly, without HTTP or the job queue, so the numbers
+are the cost of starting and running the script itself.
+
+Usage (from the server directory):
+    python benchmarks/script_latency.py --runs 200 --concurrency 1
+    python benchmarks/script_latency.py --script script.py --concurrency 4 --preload json,re
+"""
+import argparse
+import threading
+import time
+from common import latency_summary, print_report, setup_django
+
+setup_django()
+
+from script_executor.jobs import Job, SUCCEEDED, SubprocessBackend  # noqa: E402
+from script_executor.views import ALLOWED_SCRIPTS  # noqa: E402
+from script_executor.warm_pool import WarmPoolBackend  # noqa: E402
+
+
+def run_backend(backend, script_path, runs, concurrency):
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    per_thread = runs // concurrency
+
+    def worker():
+        for _ in range(per_thread):
+            job = Job('bench', script_path, 'bench')
+            start = time.perf_counter()
+            status = backend.run(job, lambda kill: False)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status != SUCCEEDED:
+                    failures.append(job.error[-200:])
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'runs_per_sec': round(len(latencies) / elapsed, 1),
+        'latency': latency_summary(latencies),
+        'failures': len(failures),
+        'first_failure': failures[0] if failures else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--script', default='script.py', choices=sorted(ALLOWED_SCRIPTS))
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=1, help='Jobs run at the same time (= warm workers)')
+    parser.add_argument('--preload', default='json,re,datetime,pathlib', help='Modules warm workers import up front')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    limits = {'timeout': 30, 'cpu_seconds': 30, 'memory_mb': 512}
+    script_path = ALLOWED_SCRIPTS[args.script]
+    warm = WarmPoolBackend(size=args.concurrency, max_runs=0, max_rss_mb=0,
+                           preload=[name for name in args.preload.split(',') if name], **limits)
+    start = time.perf_counter()
+    warm.start()
+    warm_start_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    report = {
+        'script': args.script,
+        'runs': args.runs,
+        'concurrency': args.concurrency,
+        'warm_pool_start_ms': warm_start_ms,
+        'backends': {
+            'subprocess': run_backend(SubprocessBackend(**limits), script_path, args.runs, args.concurrency),
+            'warm': run_backend(warm, script_path, args.runs, args.concurrency),
+        },
+    }
+    print_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
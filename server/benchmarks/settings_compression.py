@@ -0,0 +1,147 @@
+"""
+Size and encode/decode cost of a settings payload under each compression the
+server offers, and the time it takes on slow links.
+
+Encodings:
+    json                - uncompressed, as sent before
+    gzip                - HTTP responses (CompressionMiddleware)
+    br                  - HTTP responses, if the brotli package is installed
+    zlib_frame          - binary settings frames for clients without
+                          permessage-deflate (user_gui.py)
+    permessage_deflate  - a WebSocket message with permessage-deflate and no
+                          context takeover, as negotiated by routing.py
+
+The payload is the default settings, with --sites generated blocked sites
+added to model a real policy. With --url, the user settings endpoint of a
+running server is also fetched with each Accept-Encoding to measure bytes on
+the wire and request latency; start that server with the admission limits of
+the endpoint turned off (ADMISSION_USER_SETTINGS= ADMISSION_USER_SETTINGS_GLOBAL=).
+
+Usage (from the server directory, with the database configured in .env):
+    python benchmarks/settings_compression.py --sites 500
+    python benchmarks/settings_compression.py --url http://127.0.0.1:8000 --user 42 --requests 200
+"""
+import argparse
+import json
+import time
+import zlib
+import requests
+from common import setup_django, latency_summary, print_report
+
+setup_django()
+
+from django.utils.text import compress_string  # noqa: E402
+from script_server.middleware import BROTLI_QUALITY, brotli  # noqa: E402
+from script_server.models import DEFAULT_SETTINGS  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+
+def deflate_message(data):
+    """Compress a WebSocket message like permessage-deflate: raw deflate, flushed, without the 4 trailing bytes."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return (compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+def inflate_message(data):
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data + b'\x00\x00\xff\xff')
+
+
+def encodings():
+    """(name, encode, decode) of each encoding to compare."""
+    result = [
+        ('json', lambda data: data, lambda data: data),
+        ('gzip', compress_string, lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS)),
+    ]
+    if brotli is not None:
+        result.append(('br', lambda data: brotli.compress(data, quality=BROTLI_QUALITY), brotli.decompress))
+    result += [
+        ('zlib_frame', lambda data: zlib.compress(data, settings.WS_FRAME_COMPRESSION_LEVEL), zlib.decompress),
+        ('permessage_deflate', deflate_message, inflate_message),
+    ]
+    return result
+
+
+def build_payload(sites):
+    """A settings_change message with the default settings plus generated blocked sites."""
+    user_settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+    user_settings['blocked_sites'] += [f'blocked-{i}.example{i % 7}.com' for i in range(sites)]
+    user_settings['settings_version'] = 1
+    return json.dumps({'type': 'settings_change', 'user_id': '42', 'settings': user_settings}).encode()
+
+
+def measure(data, iterations, bandwidths):
+    raw_size = len(data)
+    report = {}
+    for name, encode, decode in encodings():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            encoded = encode(data)
+        encode_us = (time.perf_counter() - start) / iterations * 1e6
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decoded = decode(encoded)
+        decode_us = (time.perf_counter() - start) / iterations * 1e6
+        assert decoded == data, name
+        report[name] = {
+            'bytes': len(encoded),
+            'ratio': round(raw_size / len(encoded), 2),
+            'encode_us': round(encode_us, 1),
+            'decode_us': round(decode_us, 1),
+            # Transfer plus encode and decode time, per link speed
+            'total_ms': {
+                f'{kbps}kbps': round(len(encoded) * 8 / kbps + (encode_us + decode_us) / 1000, 2) for kbps in bandwidths
+            },
+        }
+    return report
+
+
+def fetch(url, user, count, accept_encoding):
+    """GET the user's settings count times; returns bytes on the wire and latencies."""
+    session = requests.Session()
+    headers = {'Authorization': f'Bearer {user}', 'Accept-Encoding': accept_encoding}
+    latencies = []
+    wire_bytes = content_encoding = None
+    for _ in range(count):
+        start = time.perf_counter()
+        # stream=True keeps the body as received, before requests decodes it
+        response = session.get(f'{url}/api/user-settings/{user}/', headers=headers, stream=True)
+        body = response.raw.read(decode_content=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code == 429:
+            raise SystemExit('Rate limited by the server: turn off ADMISSION_USER_SETTINGS and ADMISSION_USER_SETTINGS_GLOBAL')
+        response.raise_for_status()
+        wire_bytes = len(body)
+        content_encoding = response.headers.get('Content-Encoding', 'identity')
+    return {'content_encoding': content_encoding, 'bytes': wire_bytes, **latency_summary(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sites', type=int, default=0, help='Blocked sites added to the default settings')
+    parser.add_argument('--iterations', type=int, default=1000, help='Encode/decode rounds per encoding')
+    parser.add_argument('--bandwidth-kbps', type=int, nargs='+', default=[256, 2000, 20000],
+                        help='Link speeds to model transfer time at')
+    parser.add_argument('--url', help='Base URL of a running server to fetch the settings from')
+    parser.add_argument('--user', help='User ID whose settings to fetch (with --url)')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per Accept-Encoding (with --url)')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    data = build_payload(args.sites)
+    report = {
+        'sites': args.sites,
+        'json_bytes': len(data),
+        'encodings': measure(data, args.iterations, args.bandwidth_kbps),
+    }
+    if args.url:
+        if not args.user:
+            parser.error('--url needs --user')
+        accept = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+        report['http'] = {
+            encoding: fetch(args.url.rstrip('/'), args.user, args.requests, encoding) for encoding in accept
+        }
+    print_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+"""
+Background job queue for script execution.
+
+POST /api/execute/ only enqueues a job; a fixed number of worker threads
+run the jobs through an execution backend: SubprocessBackend starts a new
+interpreter per job (see runner.py), warm_pool.WarmPoolBackend reuses
+pre-started ones. Both enforce a wall-clock timeout and CPU time / memory
+limits. Output is collected as it is produced, up to
+SCRIPT_MAX_OUTPUT_BYTES per job. Finished jobs are kept in memory for
+SCRIPT_RESULT_TTL seconds so their owner can poll them, and the result is
+also pushed to the owner's WebSocket connections as a 'script_result'
+message. Streaming jobs push their output as 'script_output' messages while
+they run; /api/execute/<id>/stream/ serves it over chunked HTTP.
+
+Jobs live in the server process: with several server processes a job can
+only be polled or cancelled through the process that accepted it.
+"""
+import codecs
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from django.conf import settings
+from script_server import metrics
+from script_server.background import PeriodicTask
+from script_server.notifications import notify_script_output, notify_script_result
+
+logger = logging.getLogger(__name__)
+
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runner.py')
+
+# Upper bound on the output carried by one 'script_output' message (single chunks are at most 64 KiB)
+MAX_PUSH_CHARS = 64 * 1024
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, TIMEOUT, CANCELLED)
+
+
+class QueueFull(Exception):
+    """Raised when SCRIPT_QUEUE_SIZE jobs are already waiting."""
+
+
+class Job:
+    """
+    A script run and its output.
+
+    Output is kept as (stream, text) chunks in arrival order, up to
+    max_output_bytes (0 = no cap); anything beyond is dropped and the job is
+    marked truncated. Streaming readers follow the chunk list by index.
+    """
+
+    def __init__(self, script, script_path, owner, stream=False, max_output_bytes=0):
+        self.id = uuid.uuid4().hex
+        self.script = script
+        self.script_path = script_path
+        self.owner = owner
+        self.stream = stream
+        self.max_output_bytes = max_output_bytes
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.chunks = []
+        self.output_bytes = 0
+        self.truncated = False
+        self.pushed = 0
+        self.return_code = None
+        self.kill = None
+        self.cancel_requested = False
+        self._output_lock = threading.Lock()
+
+    def add_output(self, stream, text):
+        """Append text from 'stdout' or 'stderr', respecting the byte cap."""
+        if not text:
+            return
+        data = text.encode()
+        with self._output_lock:
+            if self.max_output_bytes:
+                room = self.max_output_bytes - self.output_bytes
+                if len(data) > room:
+                    self.truncated = True
+                    data = data[:max(room, 0)]
+                    text = data.decode(errors='ignore')
+                    if not text:
+                        return
+            self.output_bytes += len(data)
+            self.chunks.append((stream, text))
+
+    def _joined(self, stream):
+        return ''.join(text for chunk_stream, text in self.chunks if chunk_stream == stream)
+
+    @property
+    def output(self):
+        return self._joined('stdout')
+
+    @property
+    def error(self):
+        return self._joined('stderr')
+
+    def to_dict(self, include_output=True):
+        job = {
+            'job_id': self.id,
+            'script': self.script,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'return_code': self.return_code,
+            'truncated': self.truncated,
+        }
+        if include_output:
+            job['output'] = self.output
+            job['error'] = self.error
+        return job
+
+
+def read_stream(pipe, job, stream):
+    """Copy a binary pipe into the job's output as it arrives (runs on its own thread)."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        data = pipe.read1(65536)
+        if not data:
+            break
+        job.add_output(stream, decoder.decode(data))
+    job.add_output(stream, decoder.decode(b'', final=True))
+    pipe.close()
+
+
+def child_env():
+    """Environment of a script process: enough to run Python, none of the server's secrets."""
+    env = {name: os.environ[name] for name in ('PATH', 'LANG', 'SYSTEMROOT', 'TEMP', 'TMP') if name in os.environ}
+    # Unbuffered, so output reaches the caller while the script runs
+    env['PYTHONUNBUFFERED'] = '1'
+    return env
+
+
+def kill_process_group(pid):
+    """Kill a script process and anything it started (POSIX; scripts run in their own session)."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class SubprocessBackend:
+    """
+    Run every job in a new interpreter process.
+
+    Args:
+        timeout (float): Wall-clock seconds before a running job is killed
+        cpu_seconds (int): CPU time limit of a job's process (0 = none)
+        memory_mb (int): Address space limit of a job's process (0 = none)
+    """
+
+    def __init__(self, timeout, cpu_seconds, memory_mb):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+
+    def start(self):
+        pass
+
+    def run(self, job, set_kill):
+        """
+        Run the job's script, stream its output into the job, set its return code and return the final status.
+
+        set_kill(callable) registers how to kill the running script and returns
+        True if the job was cancelled in the meantime.
+        """
+        creation = {'start_new_session': True} if os.name == 'posix' else {}
+        process = subprocess.Popen(
+            [sys.executable, RUNNER, str(self.cpu_seconds), str(self.memory_mb), job.script_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.path.dirname(job.script_path),
+            env=child_env(),
+            **creation
+        )
+        kill = (lambda: kill_process_group(process.pid)) if os.name == 'posix' else process.kill
+        if set_kill(kill):
+            kill()
+        readers = [
+            threading.Thread(target=read_stream, args=(process.stdout, job, 'stdout'), daemon=True),
+            threading.Thread(target=read_stream, args=(process.stderr, job, 'stderr'), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            process.wait(timeout=self.timeout)
+            status = SUCCEEDED if process.returncode == 0 else FAILED
+        except subprocess.TimeoutExpired:
+            kill()
+            process.wait()
+            status = TIMEOUT
+        for reader in readers:
+            reader.join()
+        job.return_code = process.returncode
+        return status
+
+
+class JobQueue:
+    """
+    Run script jobs on a bounded pool of worker threads.
+
+    Args:
+        backend: Executes one job at a time per worker thread (SubprocessBackend, WarmPoolBackend)
+        workers (int): Jobs run at the same time
+        max_queued (int): Jobs allowed to wait; submit() raises QueueFull beyond that
+        result_ttl (float): Seconds finished jobs are kept for polling
+        max_output_bytes (int): Output kept per job (0 = no cap)
+        stream_interval (float): Seconds between 'script_output' pushes of streaming jobs
+    """
+
+    def __init__(self, backend, workers, max_queued, result_ttl, max_output_bytes=0, stream_interval=0.2):
+        self.backend = backend
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.max_output_bytes = max_output_bytes
+        self.output_pusher = PeriodicTask('script-output', stream_interval, self.push_output)
+        self._push_lock = threading.RLock()
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._queued = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads and the backend; submit() also does this on first use."""
+        with self._lock:
+            if self._threads:
+                return
+            self.backend.start()
+            self.output_pusher.start()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'script-worker-{index}', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def submit(self, script, script_path, owner, stream=False):
+        """
+        Enqueue a job and return it; raises QueueFull when too many jobs are waiting.
+
+        Output of streaming jobs is pushed to the owner as 'script_output' messages while they run.
+        """
+        self.start()
+        job = Job(script, script_path, owner, stream=stream, max_output_bytes=self.max_output_bytes)
+        with self._lock:
+            self._expire()
+            if self._queued >= self.max_queued:
+                raise QueueFull(f"{self._queued} script jobs are already waiting")
+            self._jobs[job.id] = job
+            self._queued += 1
+            self._update_gauges()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id, owner):
+        """The job if it exists and belongs to owner, else None."""
+        job = self._jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+
+    def cancel(self, job_id, owner):
+        """Cancel a queued or running job; returns the job, or None if it is unknown."""
+        job = self.get(job_id, owner)
+        if job is None:
+            return None
+        with self._lock:
+            if job.status == QUEUED:
+                self._queued -= 1
+                self._finish(job, CANCELLED)
+                return job
+            if job.status != RUNNING:
+                return job
+            job.cancel_requested = True
+            kill = job.kill
+        if kill is not None:
+            kill()
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queued, 'running': self._running, 'workers': self.workers, 'max_queued': self.max_queued}
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status != QUEUED:
+                    continue  # Cancelled while waiting
+                self._queued -= 1
+                self._running += 1
+                job.status = RUNNING
+                job.started = time.time()
+                self._update_gauges()
+            metrics.script_job_wait.observe(job.started - job.created)
+            try:
+                status = self.backend.run(job, lambda kill: self._set_kill(job, kill))
+            except Exception as e:
+                logger.exception("Script job %s failed to run", job.id)
+                job.add_output('stderr', str(e))
+                status = FAILED
+            with self._lock:
+                job.kill = None
+                self._running -= 1
+                self._finish(job, CANCELLED if job.cancel_requested else status)
+
+    def _set_kill(self, job, kill):
+        with self._lock:
+            job.kill = kill
+            return job.cancel_requested
+
+    def _finish(self, job, status):
+        # Called with the lock held
+        job.status = status
+        job.finished = time.time()
+        self._update_gauges()
+        metrics.script_jobs_total.inc(status=status)
+        if job.started is not None:
+            metrics.script_job_duration.observe(job.finished - job.started, status=status)
+        logger.info("Script job %s (%s) %s", job.id, job.script, status)
+        threading.Thread(target=self._publish, args=(job,), daemon=True).start()
+
+    def _publish(self, job):
+        try:
+            if job.stream:
+                # The owner gets the rest of the output in 'script_output' messages before the result
+                with self._push_lock:
+                    self._push_job_output(job)
+                    notify_script_result(job.owner, job.to_dict(include_output=False))
+            else:
+                notify_script_result(job.owner, job.to_dict())
+        except Exception:
+            logger.exception("Could not push the result of script job %s", job.id)
+
+    def push_output(self):
+        """Push new output of running streaming jobs; runs every stream_interval seconds."""
+        for job in list(self._jobs.values()):
+            if job.stream and job.status == RUNNING:
+                self._push_job_output(job)
+
+    def _push_job_output(self, job):
+        # Held while sending, so pushes of one job cannot overtake each other or the final result
+        with self._push_lock:
+            end = len(job.chunks)
+            chunks = job.chunks[job.pushed:end]
+            job.pushed = end
+            if not chunks:
+                return
+            # Merge consecutive chunks of the same stream, one WebSocket message per MAX_PUSH_CHARS
+            messages = [[]]
+            size = 0
+            for stream, text in chunks:
+                if size and size + len(text) > MAX_PUSH_CHARS:
+                    messages.append([])
+                    size = 0
+                frames = messages[-1]
+                if frames and frames[-1]['stream'] == stream:
+                    frames[-1]['data'] += text
+                else:
+                    frames.append({'stream': stream, 'data': text})
+                size += len(text)
+            for frames in messages:
+                notify_script_output(job.owner, job.id, frames)
+
+    def _expire(self):
+        # Called with the lock held
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job.id for job in self._jobs.values() if job.status in FINISHED and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _update_gauges(self):
+        metrics.script_jobs.set(self._queued, state=QUEUED)
+        metrics.script_jobs.set(self._running, state=RUNNING)
+
+
+def create_backend():
+    """The execution backend selected by SCRIPT_BACKEND ('subprocess' or 'warm')."""
+    limits = {
+        'timeout': settings.SCRIPT_TIMEOUT,
+        'cpu_seconds': settings.SCRIPT_CPU_SECONDS,
+        'memory_mb': settings.SCRIPT_MEMORY_MB,
+    }
+    if settings.SCRIPT_BACKEND == 'warm':
+        if hasattr(os, 'fork'):
+            from .warm_pool import WarmPoolBackend
+            return WarmPoolBackend(
+                size=settings.SCRIPT_WORKERS,
+                max_runs=settings.SCRIPT_WARM_MAX_RUNS,
+                max_rss_mb=settings.SCRIPT_WARM_MAX_RSS_MB,
+                preload=settings.SCRIPT_PRELOAD,
+                **limits
+            )
+        logger.warning("SCRIPT_BACKEND=warm needs os.fork(); using the subprocess backend")
+    return SubprocessBackend(**limits)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """The process-wide job queue, configured from the SCRIPT_* settings."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(
+                backend=create_backend(),
+                workers=settings.SCRIPT_WORKERS,
+                max_queued=settings.SCRIPT_QUEUE_SIZE,
+                result_ttl=settings.SCRIPT_RESULT_TTL,
+                max_output_bytes=settings.SCRIPT_MAX_OUTPUT_BYTES,
+                stream_interval=settings.SCRIPT_STREAM_INTERVAL,
+            )
+        return _job_queue
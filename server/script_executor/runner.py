@@ -0,0 +1,45 @@
+"""
+Entry point of a script job's child process.
+
+Usage: python runner.py <cpu_seconds> <memory_mb> <script_path>
+
+Applies the CPU time and address space limits to this process (0 means no
+limit) and then runs the script as __main__. Limits are set here rather
+than with Popen(preexec_fn=...), which is unsafe in the threaded server.
+"""
+import runpy
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits, the job timeout still applies
+    resource = None
+
+
+def apply_limits(cpu_seconds, memory_mb):
+    if resource is None:
+        return
+    if cpu_seconds > 0:
+        # The soft limit sends SIGXCPU, the hard limit one second later kills the process
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def line_buffered_output():
+    """Flush script output line by line: timely for streaming without one pipe write per print() part."""
+    sys.stdout.reconfigure(line_buffering=True, write_through=False)
+    sys.stderr.reconfigure(line_buffering=True, write_through=False)
+
+
+def main():
+    cpu_seconds, memory_mb, script_path = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+    apply_limits(cpu_seconds, memory_mb)
+    line_buffered_output()
+    sys.argv = [script_path]
+    runpy.run_path(script_path, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,7 @@ from . import views
 
 urlpatterns = [
     path('execute/', views.execute_script, name='execute_script'),
-]
\ No newline at end of file
+    path('execute/<str:job_id>/', views.job_status, name='script_job_status'),
+    path('execute/<str:job_id>/stream/', views.stream_job, name='stream_script_job'),
+    path('execute/<str:job_id>/cancel/', views.cancel_job, name='cancel_script_job'),
+]
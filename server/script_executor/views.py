@@ -1,10 +1,12 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-import subprocess
+import asyncio
+import json
 import os
 from pathlib import Path
-
-# Allowed scripts (for security)
+from script_server.auth import get_bearer_token
+from .jobs import FINISHED, QueueFull, get_job_queue
 
 # Base directory of the Django project
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -17,35 +19,90 @@ ALLOWED_SCRIPTS = {
     "script.py": os.path.join(SCRIPTS_DIR, "script.py"),  # Absolute path
 }
 
-# API key for authentication (change this to a secure key)
-API_KEY = "secret123"  # Replace this with a strong key in production
+
+def _submission(request):
+    # The GUI posts a form; JSON bodies are accepted as well
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+            return data.get('script'), bool(data.get('stream'))
+        except (json.JSONDecodeError, AttributeError):
+            return None, False
+    return request.POST.get('script'), request.POST.get('stream', '').lower() in ('1', 'true')
+
 
 @csrf_exempt
 def execute_script(request):
-    if request.method == 'POST':
-        script_name = request.POST.get('script')
+    """
+    Queue an allowed script and return its job ID; the result is polled or pushed over the WebSocket.
 
-        if script_name not in ALLOWED_SCRIPTS:
-            return JsonResponse({"error": "Unauthorized script"}, status=403)
+    With stream=true, output is also pushed as 'script_output' messages while the script runs.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"error": "Only POST requests are allowed"}, status=405)
 
-        script_path = ALLOWED_SCRIPTS[script_name]
-        print(f"Executing script: {script_path}")  # Debug print
+    # Jobs belong to the token that started them; only that token can poll or cancel them
+    owner = get_bearer_token(request)
+    if owner is None:
+        return JsonResponse({"error": "Invalid authorization header format. Expected: Bearer <token>"}, status=401)
 
-        try:
-            result = subprocess.run(
-                ["python", script_path],  # Explicitly use Python to run the script
-                capture_output=True,
-                text=True,
-                shell=True
-            )
-            print(f"Script output: {result.stdout}")  # Debug print
-            print(f"Script error: {result.stderr}")   # Debug print
-            return JsonResponse({
-                "output": result.stdout,
-                "error": result.stderr,
-                "return_code": result.returncode
-            })
-        except Exception as e:
-            return JsonResponse({"error": str(e)}, status=500)
-    else:
-        return JsonResponse({"error": "Only POST requests are allowed"}, status=405)
\ No newline at end of file
+    script_name, stream = _submission(request)
+    if script_name not in ALLOWED_SCRIPTS:
+        return JsonResponse({"error": "Unauthorized script"}, status=403)
+
+    job_queue = get_job_queue()
+    try:
+        job = job_queue.submit(script_name, ALLOWED_SCRIPTS[script_name], owner, stream=stream)
+    except QueueFull as e:
+        return JsonResponse({"error": str(e), "queue": job_queue.stats()}, status=503, headers={'Retry-After': '5'})
+    return JsonResponse({"job_id": job.id, "status": job.status}, status=202)
+
+
+def job_status(request, job_id):
+    """Current state of a job with its output so far (?output=0 for the state only)."""
+    owner = get_bearer_token(request)
+    job = get_job_queue().get(job_id, owner) if owner else None
+    if job is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse(job.to_dict(include_output=request.GET.get('output') != '0'))
+
+
+async def _output_lines(job):
+    sent = 0
+    while True:
+        # Check for the end first: every chunk is in place before the job is marked finished
+        finished = job.status in FINISHED
+        chunks = job.chunks[sent:]
+        sent += len(chunks)
+        for stream, text in chunks:
+            yield json.dumps({'stream': stream, 'data': text}) + '\n'
+        if finished:
+            yield json.dumps(job.to_dict(include_output=False)) + '\n'
+            return
+        await asyncio.sleep(settings.SCRIPT_STREAM_INTERVAL)
+
+
+def stream_job(request, job_id):
+    """
+    Stream a job's output as newline-delimited JSON (chunked): one {"stream", "data"}
+    line per chunk, from the start, then the job's final state without output.
+    """
+    owner = get_bearer_token(request)
+    job = get_job_queue().get(job_id, owner) if owner else None
+    if job is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    response = StreamingHttpResponse(_output_lines(job), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@csrf_exempt
+def cancel_job(request, job_id):
+    """Cancel a queued or running job."""
+    if request.method != 'POST':
+        return JsonResponse({"error": "Only POST requests are allowed"}, status=405)
+    owner = get_bearer_token(request)
+    job = get_job_queue().cancel(job_id, owner) if owner else None
+    if job is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse({"job_id": job.id, "status": job.status})
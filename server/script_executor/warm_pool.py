@@ -0,0 +1,176 @@
+"""
+Warm interpreter pool for script jobs (SCRIPT_BACKEND=warm, POSIX only).
+
+Keeps one long-lived worker interpreter (warm_worker.py) per job worker
+thread, started ahead of time with the SCRIPT_PRELOAD modules imported. A
+job forks a child from its worker, so it skips interpreter start-up and
+imports and still runs isolated from other scripts. Workers are replaced
+after SCRIPT_WARM_MAX_RUNS jobs, when their memory exceeds
+SCRIPT_WARM_MAX_RSS_MB, or when they die.
+"""
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from script_server import metrics
+from .jobs import FAILED, SUCCEEDED, TIMEOUT, child_env, kill_process_group
+
+logger = logging.getLogger(__name__)
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warm_worker.py')
+
+
+class WorkerDied(Exception):
+    """The worker interpreter exited or broke the protocol."""
+
+
+class WarmWorker:
+    def __init__(self, preload):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER, *preload],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            cwd=os.path.dirname(WORKER),
+            env=child_env(),
+            start_new_session=True,
+        )
+        self.runs = 0
+        self.rss_kb = 0
+        if not self.read().get('ready'):
+            raise WorkerDied("Worker did not report ready")
+
+    def send(self, message):
+        try:
+            self.process.stdin.write(json.dumps(message) + '\n')
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise WorkerDied(str(e)) from e
+
+    def read(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise WorkerDied(f"Worker exited with code {self.process.poll()}")
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError as e:
+            raise WorkerDied(f"Invalid worker message: {line[:200]!r}") from e
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class WarmPoolBackend:
+    """
+    Run jobs in children forked from pre-started worker interpreters.
+
+    Args:
+        timeout (float): Wall-clock seconds before a running job is killed
+        cpu_seconds (int): CPU time limit of a job's process (0 = none)
+        memory_mb (int): Address space limit of a job's process (0 = none)
+        size (int): Worker interpreters; one per job worker thread
+        max_runs (int): Jobs a worker runs before it is replaced
+        max_rss_mb (int): Worker memory above which it is replaced (0 = no limit)
+        preload (list): Modules each worker imports before taking jobs
+    """
+
+    def __init__(self, timeout, cpu_seconds, memory_mb, size, max_runs, max_rss_mb, preload):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.size = size
+        self.max_runs = max_runs
+        self.max_rss_mb = max_rss_mb
+        self.preload = list(preload)
+        self._idle = queue.Queue()
+        self._started = False
+
+    def start(self):
+        """Start the worker interpreters; later calls are no-ops."""
+        if self._started:
+            return
+        self._started = True
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        # Keep trying: a job thread waits for this worker, so the pool must not shrink
+        while True:
+            try:
+                return WarmWorker(self.preload)
+            except (OSError, WorkerDied):
+                logger.exception("Could not start a warm script worker, retrying")
+                time.sleep(1)
+
+    def _replace(self, worker, reason):
+        metrics.script_warm_worker_recycles.inc(reason=reason)
+        worker.close()
+        threading.Thread(target=lambda: self._idle.put(self._spawn()), daemon=True).start()
+
+    def _release(self, worker):
+        if self.max_runs and worker.runs >= self.max_runs:
+            self._replace(worker, 'runs')
+        elif self.max_rss_mb and worker.rss_kb > self.max_rss_mb * 1024:
+            self._replace(worker, 'memory')
+        else:
+            self._idle.put(worker)
+
+    def run(self, job, set_kill):
+        """Run the job in a warm worker; same contract as SubprocessBackend.run."""
+        self.start()
+        worker = self._idle.get()
+        while worker.process.poll() is not None:
+            # Died while idle; don't fail a job for it
+            self._replace(worker, 'died')
+            worker = self._idle.get()
+        timed_out = threading.Event()
+        try:
+            worker.send({
+                'script': job.script_path,
+                'cpu_seconds': self.cpu_seconds,
+                'memory_mb': self.memory_mb,
+                'max_output_bytes': job.max_output_bytes,
+            })
+            pid = worker.read()['pid']
+
+            def kill():
+                kill_process_group(pid)
+
+            def expire():
+                timed_out.set()
+                kill()
+
+            if set_kill(kill):
+                kill()
+            timer = threading.Timer(self.timeout, expire)
+            timer.start()
+            try:
+                while True:
+                    message = worker.read()
+                    if 'return_code' in message:
+                        break
+                    job.add_output(message['stream'], message['data'])
+            finally:
+                timer.cancel()
+            worker.runs += 1
+            worker.rss_kb = message['rss_kb']
+        except WorkerDied as e:
+            logger.warning("Warm script worker died running job %s: %s", job.id, e)
+            self._replace(worker, 'died')
+            job.add_output('stderr', f"Script worker died: {e}")
+            return FAILED
+        except Exception:
+            # E.g. a malformed message: the worker's state is unknown, but the pool must not shrink
+            self._replace(worker, 'error')
+            raise
+
+        self._release(worker)
+        job.return_code = message['return_code']
+        if timed_out.is_set():
+            return TIMEOUT
+        return SUCCEEDED if job.return_code == 0 else FAILED
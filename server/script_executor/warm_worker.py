@@ -0,0 +1,133 @@
+"""
+Long-lived worker interpreter of the warm script pool (POSIX only).
+
+Usage: python warm_worker.py [module ...]
+
+Imports the given modules once, then reads one JSON request per line on
+stdin: {"script": path, "cpu_seconds": n, "memory_mb": n, "max_output_bytes": n}.
+Each script runs in a child forked from this already initialised
+interpreter, so it starts without interpreter start-up or import cost but
+cannot change the worker's state or see other scripts' state. For every
+request the worker writes JSON lines to stdout: {"pid": <child pid>} as soon
+as the script starts, so the server can kill it, {"stream", "data"} for
+output as it arrives (up to max_output_bytes, 0 = no cap), and finally
+{"return_code", "rss_kb"}.
+"""
+import codecs
+import importlib
+import json
+import os
+import resource
+import runpy
+import selectors
+import sys
+import traceback
+from runner import apply_limits, line_buffered_output
+
+
+def run_child(request, stdout_fd, stderr_fd):
+    """Body of the forked child: never returns."""
+    code = 1
+    try:
+        # Own session, so killing the process group also kills what the script starts
+        os.setsid()
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        line_buffered_output()
+        script_path = request['script']
+        os.chdir(os.path.dirname(script_path))
+        apply_limits(request.get('cpu_seconds', 0), request.get('memory_mb', 0))
+        sys.argv = [script_path]
+        runpy.run_path(script_path, run_name='__main__')
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def forward_output(stdout_r, stderr_r, max_output_bytes, send):
+    """Send the child's output as it arrives until it closes both pipes."""
+    streams = {stdout_r: 'stdout', stderr_r: 'stderr'}
+    decoders = {fd: codecs.getincrementaldecoder('utf-8')(errors='replace') for fd in streams}
+    forwarded = 0
+    with selectors.DefaultSelector() as selector:
+        for fd in streams:
+            selector.register(fd, selectors.EVENT_READ)
+        open_fds = len(streams)
+        while open_fds:
+            for key, _ in selector.select():
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fd)
+                    open_fds -= 1
+                    text = decoders[key.fd].decode(b'', final=True)
+                elif max_output_bytes and forwarded >= max_output_bytes:
+                    # Keep draining so the script never blocks on a full pipe
+                    continue
+                else:
+                    forwarded += len(data)
+                    text = decoders[key.fd].decode(data)
+                if text:
+                    send({'stream': streams[key.fd], 'data': text})
+
+
+def run(request, send):
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    # Don't let the child inherit (and print again) anything still buffered here
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(stdout_r)
+        os.close(stderr_r)
+        run_child(request, stdout_w, stderr_w)
+    os.close(stdout_w)
+    os.close(stderr_w)
+    send({'pid': pid})
+    try:
+        forward_output(stdout_r, stderr_r, request.get('max_output_bytes', 0), send)
+    finally:
+        os.close(stdout_r)
+        os.close(stderr_r)
+    _, status = os.waitpid(pid, 0)
+    send({
+        'return_code': os.waitstatus_to_exitcode(status),
+        'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+
+def main():
+    # Keep the real stdout for the protocol and send anything else printed here to stderr
+    protocol = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    def send(message):
+        protocol.write(json.dumps(message) + '\n')
+        protocol.flush()
+
+    for name in sys.argv[1:]:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"warm worker: cannot preload {name}: {e}", file=sys.stderr)
+
+    send({'ready': True})
+    for line in sys.stdin:
+        run(json.loads(line), send)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Admission control for reconnect storms.
+
+When the server restarts, every client reconnects its WebSocket, registers
+its address and fetches its settings at about the same moment. Token
+buckets per client and over all clients cap the rate at which this server
+process admits those requests; the rest are turned away cheaply with a
+Retry-After telling them when to come back. Global rejections spread their
+Retry-After over the time the bucket takes to refill, so turned away
+clients do not all return at once.
+
+Limits are per server process, like /metrics.
+"""
+import collections
+import functools
+import math
+import random
+import threading
+import time
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from . import metrics
+from .auth import get_bearer_token
+
+
+def parse_limit(value):
+    """Parse a 'rate/burst' setting into (requests per second, burst); None if empty."""
+    if not value:
+        return None
+    rate, _, burst = value.partition('/')
+    rate = float(rate)
+    burst = float(burst or max(rate, 1))
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"Invalid rate limit {value!r}: expected 'rate/burst' with rate > 0 and burst >= 1")
+    return rate, burst
+
+
+class TokenBucket:
+    """Holds up to ``burst`` tokens, refilled at ``rate`` per second."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    A token bucket per client key and one over all clients.
+
+    Args:
+        scope (str): Name in metrics
+        client_limit (tuple): (rate, burst) per client, or None
+        global_limit (tuple): (rate, burst) over all clients, or None
+        max_clients (int): Client buckets kept; the least recently used are dropped first
+    """
+
+    def __init__(self, scope, client_limit, global_limit, max_clients):
+        self.scope = scope
+        self.client_limit = client_limit
+        self.max_clients = max_clients
+        self._global = TokenBucket(*global_limit, time.monotonic()) if global_limit else None
+        self._clients = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """
+        Admit a request from the client, taking a token from its bucket and the global one.
+
+        Returns:
+            float: 0 if admitted, otherwise the seconds the client should wait
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = None
+            client_delay = 0.0
+            if self.client_limit:
+                bucket = self._clients.get(key)
+                if bucket is None:
+                    bucket = self._clients[key] = TokenBucket(*self.client_limit, now)
+                    while len(self._clients) > self.max_clients:
+                        self._clients.popitem(last=False)
+                else:
+                    self._clients.move_to_end(key)
+                client_delay = bucket.delay(now)
+            global_delay = self._global.delay(now) if self._global else 0.0
+            if not client_delay and not global_delay:
+                if bucket:
+                    bucket.take()
+                if self._global:
+                    self._global.take()
+                return 0.0
+        if global_delay > client_delay:
+            metrics.admission_rejections.inc(scope=self.scope, limit='global')
+            return global_delay + random.uniform(0, self._global.burst / self._global.rate)
+        metrics.admission_rejections.inc(scope=self.scope, limit='client')
+        return client_delay
+
+
+class ConcurrencyLimit:
+    """Counts operations in progress and refuses to start more than ``limit`` (0 = no limit)."""
+
+    def __init__(self, scope, limit):
+        self.scope = scope
+        self.limit = limit
+        self.in_progress = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.limit and self.in_progress >= self.limit:
+                metrics.admission_rejections.inc(scope=self.scope, limit='concurrency')
+                return False
+            self.in_progress += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_progress -= 1
+
+
+def _limiter(scope, setting):
+    return RateLimiter(
+        scope,
+        parse_limit(getattr(settings, setting)),
+        parse_limit(getattr(settings, f'{setting}_GLOBAL')),
+        settings.ADMISSION_MAX_CLIENTS,
+    )
+
+
+register_ip_limiter = _limiter('register-ip', 'ADMISSION_REGISTER_IP')
+user_settings_limiter = _limiter('user-settings', 'ADMISSION_USER_SETTINGS')
+ws_connect_limiter = _limiter('ws-connect', 'ADMISSION_WS_CONNECT')
+ws_handshakes = ConcurrencyLimit('ws-handshake', settings.WS_MAX_CONCURRENT_HANDSHAKES)
+
+
+def admit_websocket(address):
+    """
+    Admit a WebSocket connection from address: rate limits, then a registration slot.
+
+    Returns:
+        float: 0 if admitted, in which case the caller must release ws_handshakes
+        once the client has registered; otherwise the seconds the client should wait
+    """
+    delay = ws_connect_limiter.check(f'ip:{address}')
+    if delay:
+        return delay
+    if not ws_handshakes.acquire():
+        # Slots are freed within WS_HANDSHAKE_TIMEOUT
+        return random.uniform(1, max(settings.WS_HANDSHAKE_TIMEOUT, 1))
+    return 0.0
+
+
+def retry_after_header(seconds):
+    """Retry-After value: whole seconds, at least 1."""
+    return str(max(1, math.ceil(seconds)))
+
+
+def too_many_requests(seconds):
+    response = JsonResponse({'status': 'error', 'message': 'Too many requests, retry later'}, status=429)
+    response['Retry-After'] = retry_after_header(seconds)
+    return response
+
+
+def client_key(request):
+    """Requests are counted per bearer token (the user ID), or per address without one."""
+    token = get_bearer_token(request)
+    return f'token:{token}' if token else f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+def rate_limited(limiter):
+    """Answer 429 with Retry-After when the limiter turns the request away; works for sync and async views."""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                delay = limiter.check(client_key(request))
+                if delay:
+                    return too_many_requests(delay)
+                return await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                delay = limiter.check(client_key(request))
+                if delay:
+                    return too_many_requests(delay)
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -13,12 +13,30 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 
-from . import routing
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'script_server.settings')
 
 django_asgi_app = get_asgi_application()
 
+# Imported after Django is set up: the consumers use the models
+from . import routing  # noqa: E402
+
+# daphne creates its WebSocket factory after importing the application
+routing.enable_permessage_deflate()
+
+# Background housekeeping runs in the server process, not on request paths
+from .presence import presence_sweeper
+presence_sweeper.start()
+from .events import partition_maintainer
+partition_maintainer.start()
+from .telemetry import fleet_publisher
+fleet_publisher.start()
+from .maintenance import maintenance_scheduler
+maintenance_scheduler.start()
+
+# Start script workers (and warm interpreters, if configured) before the first job
+from script_executor.jobs import get_job_queue
+get_job_queue().start()
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
@@ -0,0 +1,50 @@
+"""
+Authorization checks shared by the API views.
+
+Clients authenticate with ``Authorization: Bearer <user_id>``. The bearer
+helpers only look at the request headers, so they work the same in sync and
+async views. Endpoints that read or change many users at once need a staff
+session instead (check_admin); async views pass ``await request.auser()``.
+"""
+from django.http import JsonResponse
+from .admin_views import is_admin
+
+
+def get_bearer_token(request):
+    """Return the bearer token of the request, or None if the header is missing or malformed."""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    return auth_header[len('Bearer '):].strip() or None
+
+
+def check_bearer(request, user_id):
+    """
+    Verify that the request carries a bearer token matching user_id.
+
+    Returns:
+        JsonResponse: A 401 response if the check fails, otherwise None
+    """
+    token = get_bearer_token(request)
+    if token is None:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid authorization header format. Expected: Bearer <token>'
+        }, status=401)
+    if not user_id or token != user_id:
+        return JsonResponse({'status': 'error', 'message': 'Invalid credentials'}, status=401)
+    return None
+
+
+def check_admin(user):
+    """
+    Verify that the request's user is logged in as staff, like the admin_views endpoints.
+
+    Returns:
+        JsonResponse: A 401 or 403 response if the check fails, otherwise None
+    """
+    if not user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Authentication required'}, status=401)
+    if not is_admin(user):
+        return JsonResponse({'status': 'error', 'message': 'Admin access required'}, status=403)
+    return None
@@ -0,0 +1,38 @@
+"""Minimal periodic background threads for in-process housekeeping."""
+import logging
+import threading
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Run a function every ``interval`` seconds on a daemon thread."""
+
+    def __init__(self, name, interval, function):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the thread once; later calls are no-ops."""
+        with self._lock:
+            if self._thread is None and self.interval > 0:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.function()
+            except Exception:
+                logger.exception("Periodic task %s failed", self.name)
+            finally:
+                # The thread owns its own connection; don't keep it open between runs
+                connection.close()
@@ -0,0 +1,141 @@
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
+from .models import UserSettings
+from .settings_utils import SITE_LISTS, build_patch_updates, validate_string_list
+from . import policy_utils
+
+# Upper bound on users touched by one batch request
+MAX_BATCH_USERS = 1000
+
+
+def select_user_ids(user_ids=None, filters=None):
+    """
+    Resolve the users a batch request targets.
+
+    Args:
+        user_ids (list): Explicit user IDs
+        filters (dict): Alternative selection: {"policy_id": int, "user_id_prefix": str}
+
+    Returns:
+        list: Requested user IDs (explicit IDs are returned even if they have no settings)
+
+    Raises:
+        ValueError: If the selection is missing, malformed or too large
+    """
+    if user_ids is not None:
+        user_ids = validate_string_list(user_ids, 'user_ids')
+    elif filters is not None:
+        if not isinstance(filters, dict) or not filters:
+            raise ValueError("'filter' must be a non-empty object")
+        queryset = UserSettings.objects.all()
+        if 'policy_id' in filters:
+            queryset = queryset.filter(policies__id=filters['policy_id'])
+        if 'user_id_prefix' in filters:
+            queryset = queryset.filter(user_id__startswith=filters['user_id_prefix'])
+        user_ids = list(queryset.order_by('user_id').values_list('user_id', flat=True)[:MAX_BATCH_USERS + 1])
+    else:
+        raise ValueError("Either 'user_ids' or 'filter' is required")
+
+    if len(user_ids) > MAX_BATCH_USERS:
+        raise ValueError(f"A batch can target at most {MAX_BATCH_USERS} users")
+    return user_ids
+
+
+def _not_found(user_id):
+    return {'user_id': user_id, 'status': 'error', 'message': 'User settings not found'}
+
+
+def fetch_settings(user_ids):
+    """Fetch effective settings and overrides for many users in a fixed number of queries."""
+    rows = {row.user_id: row for row in UserSettings.objects.filter(user_id__in=user_ids)}
+    prefetch_related_objects(list(rows.values()), 'policies')
+
+    results = []
+    for user_id in user_ids:
+        row = rows.get(user_id)
+        if row is None:
+            results.append(_not_found(user_id))
+            continue
+        results.append({
+            'user_id': user_id,
+            'status': 'success',
+            'settings': policy_utils.get_effective_settings(row),
+            'overrides': {field: getattr(row, field) for field in policy_utils.SETTINGS_FIELDS},
+            'version': row.version,
+        })
+    return results
+
+
+def validate_settings(settings, name):
+    """Validate a full replacement document, returning only the known fields."""
+    if not isinstance(settings, dict):
+        raise ValueError(f"'{name}' must be an object")
+    fields = {}
+    for field in SITE_LISTS:
+        if field in settings:
+            fields[field] = validate_string_list(settings[field], f'{name}.{field}')
+    if 'categories' in settings:
+        categories = settings['categories']
+        if not isinstance(categories, dict):
+            raise ValueError(f"'{name}.categories' must be an object of keyword lists")
+        fields['categories'] = {
+            category: validate_string_list(keywords, f'{name}.categories.{category}')
+            for category, keywords in categories.items()
+        }
+    return fields
+
+
+def update_settings(user_ids, patch=None, settings=None, per_user=None):
+    """
+    Change the settings of many users at once.
+
+    Exactly one of the change documents is expected:
+        patch: Incremental changes applied to every user in one UPDATE statement
+        settings: Columns replaced with the same values for every user in one UPDATE statement
+        per_user: {user_id: {columns}} written with a single bulk_update
+
+    Returns:
+        list: One result dict per requested user ID
+
+    Raises:
+        ValueError: If the change document is missing or malformed
+    """
+    if sum(doc is not None for doc in (patch, settings, per_user)) != 1:
+        raise ValueError("Exactly one of 'patch', 'settings' or 'per_user' is required")
+
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = UserSettings.objects.filter(user_id__in=user_ids)
+        existing = set(queryset.select_for_update().values_list('user_id', flat=True))
+
+        if per_user is not None:
+            if not isinstance(per_user, dict):
+                raise ValueError("'per_user' must be an object keyed by user ID")
+            changes = {user_id: validate_settings(doc, f'per_user.{user_id}') for user_id, doc in per_user.items()}
+            rows = [row for row in queryset if row.user_id in changes]
+            fields = set()
+            for row in rows:
+                for field, value in changes[row.user_id].items():
+                    setattr(row, field, value)
+                    fields.add(field)
+                row.version = F('version') + 1
+                row.updated_at = now
+            if rows and fields:
+                UserSettings.objects.bulk_update(rows, [*fields, 'version', 'updated_at'])
+        else:
+            updates = build_patch_updates(patch) if patch is not None else validate_settings(settings, 'settings')
+            if updates:
+                queryset.update(**updates, version=F('version') + 1, updated_at=now)
+
+        versions = dict(queryset.values_list('user_id', 'version'))
+
+    results = []
+    for user_id in user_ids:
+        if user_id not in existing:
+            results.append(_not_found(user_id))
+        elif per_user is not None and user_id not in per_user:
+            results.append({'user_id': user_id, 'status': 'skipped', 'version': versions[user_id]})
+        else:
+            results.append({'user_id': user_id, 'status': 'success', 'version': versions[user_id]})
+    return results
@@ -1,13 +1,30 @@
+import asyncio
 import json
+import time
+import zlib
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.layers import get_channel_layer
 from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings as server_settings
+from django.db import DatabaseError
+from django.db.models import prefetch_related_objects
 from .models import UserSettings
+from .notifications import bind_server_loop, user_group, policy_group, timed_group_send
+from .heartbeats import arecord_heartbeat
+from .logging_utils import log_event
+from . import admission, metrics, policy_artifacts, policy_utils, presence, telemetry
 import logging
 
-# Configure logging
+# Level and output come from settings.LOGGING; per-message events are sampled there
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Message types clients may send; anything else is counted as 'other' in /metrics
+CLIENT_MESSAGE_TYPES = ('admin_connect', 'user_status', 'settings_change', 'ping', 'pong', 'telemetry', 'fleet_subscribe')
+
+# Close code for connections turned away by admission control (application range; like HTTP 429)
+CLOSE_TRY_AGAIN_LATER = 4029
+
 
 class StatusConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -15,63 +32,117 @@ class StatusConsumer(AsyncWebsocketConsumer):
         # Store client info
         self.client_ip = self.scope['client'][0]
         self.client_port = self.scope['client'][1]
+        self.client_address = f"{self.client_ip}:{self.client_port}"
+        self.user_id = None
+        self.policy_ids = set()
+        self.is_admin = False
+        self.fleet_subscribed = False
+        self.last_pong = time.monotonic()
+        self.ping_task = None
+        self.admitted = False
+        self.handshake_timer = None
+        self.zlib_frames = False  # Settings pushes as zlib-compressed binary frames
+        # Background threads deliver group messages through this loop
+        bind_server_loop(asyncio.get_running_loop())
+
+        # Admission control, before any database work
+        retry_after = admission.admit_websocket(self.client_ip)
         
         # Accept the connection
         await self.accept()
+        if retry_after:
+            # Accepted only to tell the client when to come back
+            await self.send_message({'type': 'retry_later', 'retry_after': int(admission.retry_after_header(retry_after))})
+            await self.close(code=CLOSE_TRY_AGAIN_LATER)
+            log_event(logger, logging.INFO, 'ws_rejected', client=self.client_address, retry_after=round(retry_after, 1))
+            return
+        self.admitted = True
+        # The registration slot taken by admit_websocket is freed once the client registers
+        self.handshake_timer = asyncio.get_running_loop().call_later(
+            server_settings.WS_HANDSHAKE_TIMEOUT, self.end_handshake
+        )
+        metrics.websocket_connections.inc()
+        metrics.websocket_connections_total.inc()
         
         # Add to the general status group
         await self.channel_layer.group_add("status_updates", self.channel_name)
         
-        logger.info(f"WebSocket Connection: Client={self.client_ip}:{self.client_port}, Channel={self.channel_name}")
-        logger.debug(f"Connection Headers: {dict(self.scope['headers'])}")
+        log_event(logger, logging.INFO, 'ws_connect', client=self.client_address, channel=self.channel_name)
+        if server_settings.WS_LOG_PAYLOADS:
+            log_event(logger, logging.DEBUG, 'ws_headers', client=self.client_address, headers=dict(self.scope['headers']))
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if not self.admitted:
+            return
+        self.end_handshake()
+        metrics.websocket_connections.dec()
         # Remove from the status group
         await self.channel_layer.group_discard("status_updates", self.channel_name)
-        logger.info(f"WebSocket Disconnected: Client={self.client_ip}:{self.client_port}, Code={close_code}")
+        if self.ping_task:
+            self.ping_task.cancel()
+        if self.is_admin:
+            await self.channel_layer.group_discard(presence.ADMIN_GROUP, self.channel_name)
+        if self.fleet_subscribed:
+            telemetry.subscribe(-1)
+            await self.channel_layer.group_discard(telemetry.FLEET_GROUP, self.channel_name)
+        await self.leave_user_groups()
+        log_event(logger, logging.INFO, 'ws_disconnect', client=self.client_address, user=self.user_id, code=close_code)
 
     async def receive(self, text_data):
         """Handle received messages"""
         try:
             data = json.loads(text_data)
             message_type = data.get('type', '')
-            logger.info(f"WebSocket Message Received: Type={message_type}, From={self.client_ip}:{self.client_port}")
-            logger.debug(f"Message Content: {data}")
+            metrics.websocket_messages.inc(
+                direction='in', type=message_type if message_type in CLIENT_MESSAGE_TYPES else 'other'
+            )
+            log_event(logger, logging.INFO, 'ws_message', client=self.client_address, type=message_type)
+            if server_settings.WS_LOG_PAYLOADS:
+                log_event(logger, logging.DEBUG, 'ws_payload', client=self.client_address, payload=data)
             
             if message_type == 'admin_connect':
                 # Admin connected, store admin status
                 self.is_admin = True
-                logger.info(f"Admin Connected: {self.client_ip}:{self.client_port}")
-                await self.send(text_data=json.dumps({
+                log_event(logger, logging.INFO, 'ws_admin_connect', client=self.client_address)
+                # Join before taking the snapshot so no presence event falls in between
+                await self.channel_layer.group_add(presence.ADMIN_GROUP, self.channel_name)
+                await self.send_message({
                     'type': 'admin_connected',
                     'message': 'Admin connection confirmed'
-                }))
+                })
+                # Clients that page through /user-ips/ themselves can opt out of the full snapshot
+                if data.get('presence_snapshot', True):
+                    await self.send_message({
+                        'type': 'presence_snapshot',
+                        'online_users': await database_sync_to_async(presence.get_presence_snapshot)()
+                    })
+                self.end_handshake()
                 
             elif message_type == 'user_status':
-                # Broadcast user status update to admin
+                # Register the user's presence; admins are told only when the user comes online
                 user_id = data.get('user_id')
                 status = data.get('status')
-                logger.info(f"User Status Update: User={user_id}, Status={status}")
-                await self.channel_layer.group_send(
-                    "status_updates",
-                    {
-                        "type": "status_update",
-                        "message": {
-                            "type": "user_status",
-                            "user_id": user_id,
-                            "status": status
-                        }
-                    }
-                )
+                log_event(logger, logging.INFO, 'ws_user_status', client=self.client_address, user=user_id, status=status)
+                # Clients without permessage-deflate (QWebSocket) can ask for compressed settings frames
+                self.zlib_frames = data.get('frames') == 'zlib'
+                if user_id and user_id != self.user_id:
+                    await self.join_user_groups(user_id)
+                    await self.publish_presence(await database_sync_to_async(presence.user_connected)(user_id))
+                    self.last_pong = time.monotonic()
+                    if self.ping_task is None:
+                        self.ping_task = asyncio.create_task(self.ping_loop())
+                    # Reconnecting clients send the settings version they have
+                    if 'settings_version' in data:
+                        await self.resume_settings(data['settings_version'])
+                self.end_handshake()
                 
             elif message_type == 'settings_change':
                 # Broadcast settings change to all connected clients
                 user_id = data.get('user_id')
                 settings = data.get('settings')
-                logger.info(f"Settings Change: User={user_id}")
-                logger.debug(f"New Settings: {settings}")
-                await self.channel_layer.group_send(
+                log_event(logger, logging.INFO, 'ws_settings_change', client=self.client_address, user=user_id)
+                await self.group_send(
                     "status_updates",
                     {
                         "type": "status_update",
@@ -83,43 +154,179 @@ class StatusConsumer(AsyncWebsocketConsumer):
                     }
                 )
                 
+            elif message_type == 'telemetry':
+                # Periodic proxy counters of this connection's user; no reply, to keep them cheap
+                if not self.user_id:
+                    return
+                try:
+                    accepted = telemetry.fleet.record(self.user_id, data.get('counters'))
+                    metrics.telemetry_snapshots.inc(result='accepted' if accepted else 'throttled')
+                except telemetry.InvalidSnapshot as e:
+                    metrics.telemetry_snapshots.inc(result='invalid')
+                    await self.send_message({'type': 'error', 'message': str(e)})
+
+            elif message_type == 'fleet_subscribe':
+                # Admins get the fleet summary now and every FLEET_PUSH_INTERVAL seconds
+                if not self.is_admin:
+                    await self.send_message({'type': 'error', 'message': 'Send admin_connect first'})
+                    return
+                if not self.fleet_subscribed:
+                    self.fleet_subscribed = True
+                    telemetry.subscribe(1)
+                    await self.channel_layer.group_add(telemetry.FLEET_GROUP, self.channel_name)
+                await self.send_message({'type': 'fleet', 'fleet': await sync_to_async(telemetry.fleet.summary)()})
+
             elif message_type == 'ping':
-                # Handle ping message
-                logger.debug(f"Ping received from {self.client_ip}:{self.client_port}")
                 # Echo back a pong message
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'pong',
                     'timestamp': data.get('timestamp')
-                }))
+                })
                 
             elif message_type == 'pong':
-                # Handle pong response
-                logger.debug(f"Pong received from {self.client_ip}:{self.client_port}")
-                # No action needed, just log it
+                # Client is alive
+                self.last_pong = time.monotonic()
+                if self.user_id:
+                    await arecord_heartbeat(self.user_id)
                 
             else:
-                logger.warning(f"Unknown message type received: {message_type}")
-                await self.send(text_data=json.dumps({
+                log_event(logger, logging.WARNING, 'ws_unknown_type', client=self.client_address, type=message_type)
+                await self.send_message({
                     'type': 'error',
                     'message': f'Unknown message type: {message_type}'
-                }))
+                })
                 
         except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON received: {text_data}")
-            await self.send(text_data=json.dumps({
+            log_event(logger, logging.WARNING, 'ws_invalid_json', client=self.client_address, size=len(text_data or ''))
+            await self.send_message({
                 'type': 'error',
                 'message': 'Invalid JSON format'
-            }))
+            })
         except Exception as e:
-            logger.error(f"Error in WebSocket receive: {str(e)}", exc_info=True)
-            await self.send(text_data=json.dumps({
+            log_event(logger, logging.ERROR, 'ws_receive_error', exc_info=True, client=self.client_address)
+            await self.send_message({
                 'type': 'error',
                 'message': 'Internal server error'
-            }))
+            })
+
+    def end_handshake(self):
+        """Free the connection's registration slot (see admission.admit_websocket); later calls do nothing."""
+        if self.handshake_timer is not None:
+            self.handshake_timer.cancel()
+            self.handshake_timer = None
+            admission.ws_handshakes.release()
+
+    async def send_message(self, message):
+        """Send a JSON message to the client, counting it by type for /metrics"""
+        metrics.websocket_messages.inc(direction='out', type=message.get('type', 'unknown'))
+        await self.send(text_data=json.dumps(message))
+
+    async def send_settings(self, settings):
+        """Push the user's effective settings, as a zlib-compressed binary frame if the client asked for it"""
+        message = {'type': 'settings_change', 'user_id': self.user_id, 'settings': settings}
+        if not self.zlib_frames:
+            await self.send_message(message)
+            return
+        metrics.websocket_messages.inc(direction='out', type='settings_change')
+        await self.send(bytes_data=zlib.compress(json.dumps(message).encode(), server_settings.WS_FRAME_COMPRESSION_LEVEL))
+
+    async def group_send(self, group, message):
+        await timed_group_send(self.channel_layer, group, message)
 
     async def status_update(self, event):
         """Handle status updates to be sent to clients"""
         message = event['message']
-        logger.info(f"Broadcasting Status Update: Type={message.get('type')}")
-        logger.debug(f"Update Content: {message}")
-        await self.send(text_data=json.dumps(message))
+        log_event(logger, logging.INFO, 'ws_send', client=self.client_address, type=message.get('type'))
+        await self.send_message(message)
+
+    async def presence_update(self, event):
+        """Forward a presence join/leave event to an admin connection"""
+        await self.send_message(event['message'])
+
+    async def fleet_update(self, event):
+        """Forward a periodic fleet summary to a subscribed admin connection"""
+        await self.send_message({'type': 'fleet', 'fleet': event['fleet']})
+
+    async def publish_presence(self, event):
+        if event:
+            await self.group_send(presence.ADMIN_GROUP, {'type': 'presence_update', 'message': event})
+
+    async def ping_loop(self):
+        """Ping the client periodically and close the connection if it stops answering"""
+        interval = server_settings.WS_PING_INTERVAL
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_pong > server_settings.ONLINE_TIMEOUT_SECONDS:
+                log_event(logger, logging.INFO, 'ws_pong_timeout', client=self.client_address, user=self.user_id)
+                await self.close()
+                return
+            await self.send_message({'type': 'ping', 'timestamp': time.time()})
+
+    async def settings_refresh(self, event):
+        """Push the user's current effective settings after their settings or one of their policies changed"""
+        if not self.user_id:
+            return
+        settings, policy_ids = await self.load_effective_settings(self.user_id)
+        await self.sync_policy_groups(policy_ids)
+        log_event(logger, logging.INFO, 'ws_settings_push', user=self.user_id, settings_version=settings.get('settings_version'))
+        await self.send_settings(settings)
+
+    async def resume_settings(self, settings_version):
+        """Push the user's settings only if they changed since the version the client has (None: it has none)"""
+        settings, policy_ids = await self.load_effective_settings(self.user_id)
+        await self.sync_policy_groups(policy_ids)
+        if settings.get('settings_version') == settings_version:
+            metrics.websocket_resumes.inc(result='current')
+            await self.send_message({'type': 'resumed', 'settings_version': settings_version})
+            return
+        metrics.websocket_resumes.inc(result='pushed')
+        log_event(logger, logging.INFO, 'ws_settings_resume', user=self.user_id, client_version=settings_version,
+                  settings_version=settings.get('settings_version'))
+        await self.send_settings(settings)
+
+    async def script_result(self, event):
+        """Forward a finished script job to the user who started it"""
+        await self.send_message({'type': 'script_result', 'job': event['job']})
+
+    async def script_output(self, event):
+        """Forward new output of a running streaming script job"""
+        await self.send_message({'type': 'script_output', 'job_id': event['job_id'], 'frames': event['frames']})
+
+    async def join_user_groups(self, user_id):
+        """Subscribe this connection to its user's group and the groups of the user's policies"""
+        await self.leave_user_groups()
+        self.user_id = user_id
+        await self.channel_layer.group_add(user_group(user_id), self.channel_name)
+        await self.sync_policy_groups(await database_sync_to_async(policy_utils.get_user_policy_ids)(user_id))
+
+    async def leave_user_groups(self):
+        if self.user_id:
+            await self.channel_layer.group_discard(user_group(self.user_id), self.channel_name)
+            await self.publish_presence(await database_sync_to_async(presence.user_disconnected)(self.user_id))
+        await self.sync_policy_groups([])
+        self.user_id = None
+
+    async def sync_policy_groups(self, policy_ids):
+        """Join/leave policy groups so they match the user's current policies"""
+        policy_ids = set(policy_ids)
+        for policy_id in self.policy_ids - policy_ids:
+            await self.channel_layer.group_discard(policy_group(policy_id), self.channel_name)
+        for policy_id in policy_ids - self.policy_ids:
+            await self.channel_layer.group_add(policy_group(policy_id), self.channel_name)
+        self.policy_ids = policy_ids
+
+    @database_sync_to_async
+    def load_effective_settings(self, user_id):
+        user_settings = UserSettings.get_user_settings(user_id)
+        prefetch_related_objects([user_settings], 'policies')
+        policy_ids = [policy.id for policy in user_settings.policies.all()]
+        effective = policy_utils.get_effective_settings(user_settings)
+        try:
+            effective['artifact'] = policy_artifacts.artifact_info(effective)
+        except DatabaseError:
+            # Like the HTTP view: clients fall back to the lists in the settings
+            logger.warning("Could not compile policy artifact for %s", user_id, exc_info=True)
+            effective['artifact'] = None
+        return effective, policy_ids
@@ -0,0 +1,6 @@
+"""
+PostgreSQL backend with a bounded, process-wide connection pool.
+
+Use it as ENGINE 'script_server.db_pool'; pool options go in the
+database's 'POOL' dict (see settings.py).
+"""
@@ -0,0 +1,53 @@
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from .pool import PooledConnection, PoolTimeout, get_pool
+
+# Defaults for the 'POOL' dict of a database using this backend
+POOL_DEFAULTS = {
+    'max_size': 20,  # Upper bound on open connections per process
+    'timeout': 10,  # Seconds to wait for a free connection before failing
+    'max_idle': 300,  # Seconds an unused connection is kept open
+    'max_lifetime': 3600,  # Seconds before a connection is replaced
+    'check_interval': 30,  # Idle connections older than this are pinged before reuse
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL wrapper that borrows connections from a process-wide pool.
+
+    Opening a connection takes one from the pool and closing it (end of request,
+    close_old_connections, connection.close()) returns it, so connections
+    survive across requests and threads without per-thread persistent
+    connections, which Django does not support under ASGI.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool_entry = None
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, {**POOL_DEFAULTS, **self.settings_dict.get('POOL', {})})
+
+    def get_new_connection(self, conn_params):
+        def connect():
+            connection = super(DatabaseWrapper, self).get_new_connection(conn_params)
+            return PooledConnection(connection, self.isolation_level)
+
+        try:
+            entry = self.pool.acquire(connect)
+        except PoolTimeout as e:
+            raise OperationalError(str(e)) from e
+        self._pool_entry = entry
+        self.isolation_level = entry.isolation_level
+        return entry.connection
+
+    def _close(self):
+        entry, self._pool_entry = self._pool_entry, None
+        if self.connection is None:
+            return
+        if entry is None or entry.connection is not self.connection:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.release(entry)
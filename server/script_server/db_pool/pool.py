@@ -0,0 +1,200 @@
+"""
+Thread-safe bounded pool of psycopg2 connections.
+
+Django keeps one connection per thread. Under ASGI every request and every
+database_sync_to_async call may run in a different thread, so without a
+pool each of them opens (and closes) its own connection to Postgres. The
+pool hands idle connections to whichever thread asks next and caps the
+total, making callers wait (up to ``timeout``) when all are in use.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the pool timeout."""
+
+
+class PooledConnection:
+    """A raw connection plus the bookkeeping the pool needs."""
+
+    def __init__(self, connection, isolation_level):
+        self.connection = connection
+        self.isolation_level = isolation_level
+        self.created_at = time.monotonic()
+        self.released_at = self.created_at
+
+
+class ConnectionPool:
+    def __init__(self, alias, max_size=20, timeout=10, max_idle=300, max_lifetime=3600, check_interval=30):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self._idle = []  # Most recently released last, so hot connections are reused first
+        self._size = 0  # Open connections, idle or in use
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._counters = {
+            'acquired': 0,
+            'created': 0,
+            'closed': 0,
+            'timeouts': 0,
+            'failed_checks': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def acquire(self, connect):
+        """
+        Take an idle connection or open a new one with ``connect()``.
+
+        Args:
+            connect: Callable returning a new PooledConnection
+
+        Raises:
+            PoolTimeout: If the pool stayed exhausted for ``timeout`` seconds
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            entry = None
+            create = False
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"No database connection available for '{self.alias}' "
+                            f"within {self.timeout}s (pool size {self.max_size})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._condition.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    entry = connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+                self._count('created')
+            elif not self._is_healthy(entry):
+                self._discard(entry)
+                continue
+
+            waited = time.monotonic() - start
+            with self._condition:
+                self._counters['acquired'] += 1
+                self._counters['wait_seconds_total'] += waited
+                self._counters['wait_seconds_max'] = max(self._counters['wait_seconds_max'], waited)
+            return entry
+
+    def release(self, entry):
+        """Give a connection back; broken or expired connections are closed instead."""
+        if not self._is_reusable(entry):
+            self._discard(entry)
+            return
+        entry.released_at = time.monotonic()
+        with self._condition:
+            self._idle.append(entry)
+            self._condition.notify()
+
+    def _is_reusable(self, entry):
+        connection = entry.connection
+        if connection.closed:
+            return False
+        if time.monotonic() - entry.created_at > self.max_lifetime:
+            return False
+        try:
+            # Never hand out a connection with an open or failed transaction
+            if connection.get_transaction_status() != 0:  # psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _is_healthy(self, entry):
+        """Check an idle connection before reuse; only pings connections idle for a while."""
+        now = time.monotonic()
+        if entry.connection.closed or now - entry.released_at > self.max_idle or now - entry.created_at > self.max_lifetime:
+            return False
+        if now - entry.released_at < self.check_interval:
+            return True
+        try:
+            with entry.connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if entry.connection.get_transaction_status() != 0:
+                entry.connection.rollback()
+            return True
+        except Exception:
+            self._count('failed_checks')
+            logger.warning("Dropping broken pooled connection for '%s'", self.alias)
+            return False
+
+    def _discard(self, entry):
+        if entry is not None:
+            try:
+                entry.connection.close()
+            except Exception:
+                pass
+            self._count('closed')
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _count(self, name):
+        with self._condition:
+            self._counters[name] += 1
+
+    def close_idle(self):
+        """Close all idle connections (e.g. at shutdown or after a failover)."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        """Current pool usage and lifetime counters."""
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                **self._counters,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options):
+    """Return the process-wide pool of a database alias, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(alias, **options)
+        return pool
+
+
+def pool_stats():
+    """Stats of every pool in this process, keyed by database alias."""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
@@ -0,0 +1,259 @@
+"""
+Block/allow events reported by client proxies.
+
+Clients upload events in batches (POST /api/events/batch/). Each batch is
+written with a single COPY into ``block_events``, a table partitioned by day
+on ``occurred_at``. Partitions are created on demand and ahead of time, and
+partitions older than EVENT_RETENTION_DAYS are dropped as a whole instead of
+deleting rows.
+
+Every batch carries a client-generated ``batch_id``. The ID is stored in the
+same transaction as the events, so a client that retries a batch after a
+timeout never stores its events twice.
+
+The same transaction also adds the batch to the rollup tables (per user,
+hour, action and category, and per host, day and action) that the reports
+read, so reports never scan raw events.
+"""
+import collections
+import csv
+import io
+import logging
+import threading
+import zlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+from .background import PeriodicTask
+from .models import BlockEvent, DomainDaily, UserCategoryHourly
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'block_events_'
+ACTIONS = ('blocked', 'allowed')
+COPY_COLUMNS = ('occurred_at', 'received_at', 'user_id', 'action', 'reason', 'host', 'category', 'batch_id')
+
+# Partitions known to exist in this process; avoids a DDL statement per batch
+_known_partitions = set()
+_partitions_lock = threading.Lock()
+
+
+class InvalidBatch(ValueError):
+    """The batch is malformed as a whole; retrying it cannot succeed."""
+
+
+class BatchTooLarge(InvalidBatch):
+    """The batch exceeds EVENT_BATCH_MAX_EVENTS or EVENT_BATCH_MAX_BYTES."""
+
+
+def decode_body(body, content_encoding, max_bytes):
+    """Return the request body, gunzipped if needed, without inflating more than max_bytes."""
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        data = body
+    elif encoding == 'gzip':
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        try:
+            data = decompressor.decompress(body, max_bytes + 1)
+        except zlib.error as e:
+            raise InvalidBatch(f"Invalid gzip body: {e}") from e
+    else:
+        raise InvalidBatch(f"Unsupported Content-Encoding: {encoding}")
+    if len(data) > max_bytes:
+        raise BatchTooLarge(f"Batch larger than {max_bytes} bytes")
+    return data
+
+
+def partition_name(day):
+    return f'{PARTITION_PREFIX}{day:%Y%m%d}'
+
+
+def _alias():
+    return router.db_for_write(BlockEvent)
+
+
+def ensure_partitions(days):
+    """Create the daily partitions for the given dates if they do not exist yet."""
+    missing = sorted(day for day in set(days) if day not in _known_partitions)
+    if not missing:
+        return
+    with _partitions_lock, transaction.atomic(using=_alias()), connections[_alias()].cursor() as cursor:
+        # Serialize partition DDL between server processes; concurrent CREATE ... IF NOT EXISTS can still collide
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('block_events_partitions'))")
+        for day in missing:
+            start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {partition_name(day)}
+                PARTITION OF block_events FOR VALUES FROM (%s) TO (%s)
+                """,
+                (start, start + timedelta(days=1))
+            )
+    _known_partitions.update(missing)
+
+
+def drop_expired_partitions(retention_days):
+    """
+    Drop the partitions holding only events older than retention_days.
+
+    Expired batch IDs and rollups are deleted in batches by the maintenance
+    scheduler (see maintenance.py).
+
+    Returns:
+        list: Names of the dropped partitions
+    """
+    cutoff = timezone.now().date() - timedelta(days=retention_days)
+    dropped = []
+    with transaction.atomic(using=_alias()), connections[_alias()].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'block_events'::regclass
+            """
+        )
+        for (name,) in cursor.fetchall():
+            try:
+                day = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()
+            except ValueError:
+                continue  # Not one of ours
+            if day < cutoff:
+                cursor.execute(f'DROP TABLE {name}')
+                dropped.append(name)
+                _known_partitions.discard(day)
+    if dropped:
+        logger.info("Dropped expired event partitions: %s", ', '.join(sorted(dropped)))
+    return dropped
+
+
+def maintain_partitions(retention_days=None):
+    """Create the next EVENT_PARTITIONS_AHEAD days of partitions and drop expired ones."""
+    today = timezone.now().date()
+    ensure_partitions(today + timedelta(days=i) for i in range(settings.EVENT_PARTITIONS_AHEAD + 1))
+    return drop_expired_partitions(settings.EVENT_RETENTION_DAYS if retention_days is None else retention_days)
+
+
+def _parse_time(value):
+    # Clients send epoch seconds; ISO 8601 is accepted too
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value)
+        # In UTC, like the partition and rollup boundaries derived from it
+        return parsed.astimezone(dt_timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=dt_timezone.utc)
+    raise ValueError("Invalid timestamp")
+
+
+def _text(value, max_length):
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str) or len(value) > max_length:
+        raise ValueError("Invalid text field")
+    return value
+
+
+def parse_events(events, now):
+    """
+    Validate raw events and turn them into COPY rows.
+
+    Events that are malformed or fall outside the retention window (or more
+    than a day in the future) are skipped and counted, so one bad event does
+    not make the client retry the whole batch.
+
+    Returns:
+        tuple: (rows, rejected count)
+    """
+    if not isinstance(events, list):
+        raise InvalidBatch("'events' must be a list")
+    oldest = now - timedelta(days=settings.EVENT_RETENTION_DAYS)
+    newest = now + timedelta(days=1)
+    rows = []
+    rejected = 0
+    for event in events:
+        try:
+            occurred_at = _parse_time(event['ts'])
+            action = event['action']
+            host = _text(event['host'], 2048)
+            if action not in ACTIONS or host is None or not oldest <= occurred_at <= newest:
+                raise ValueError("Invalid event")
+            rows.append((occurred_at, action, _text(event.get('reason'), 16) or '', host,
+                         _text(event.get('category'), 255)))
+        except (KeyError, TypeError, ValueError, OverflowError, OSError):
+            rejected += 1
+    return rows, rejected
+
+
+def _add_counts(cursor, table, key_columns, counts):
+    """Add counts to rollup rows in one statement, creating missing rows."""
+    if not counts:
+        return
+    # Sorted, so concurrent batches lock shared rows in the same order and cannot deadlock
+    keys = sorted(counts)
+    row = '(' + ', '.join(['%s'] * (len(key_columns) + 1)) + ')'
+    columns = ', '.join(key_columns)
+    cursor.execute(
+        f"""
+        INSERT INTO {table} ({columns}, count) VALUES {', '.join([row] * len(keys))}
+        ON CONFLICT ({columns}) DO UPDATE SET count = {table}.count + EXCLUDED.count
+        """,
+        [value for key in keys for value in (*key, counts[key])]
+    )
+
+
+def _update_rollups(cursor, user_id, rows):
+    by_category = collections.Counter()
+    by_domain = collections.Counter()
+    for occurred_at, action, reason, host, category in rows:
+        by_category[(user_id, occurred_at.replace(minute=0, second=0, microsecond=0), action, category or '')] += 1
+        by_domain[(host, occurred_at.date(), action)] += 1
+    _add_counts(cursor, UserCategoryHourly._meta.db_table, ('user_id', 'hour', 'action', 'category'), by_category)
+    _add_counts(cursor, DomainDaily._meta.db_table, ('host', 'day', 'action'), by_domain)
+
+
+def ingest_batch(user_id, batch_id, events):
+    """
+    Store a batch of events with one COPY, at most once per batch_id.
+
+    Returns:
+        dict: accepted and rejected event counts and whether the batch was a duplicate
+    """
+    now = timezone.now()
+    rows, rejected = parse_events(events, now)
+    result = {'accepted': 0, 'rejected': rejected, 'duplicate': False}
+    ensure_partitions(occurred_at.date() for occurred_at, *_ in rows)
+
+    alias = _alias()
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO event_batches (batch_id, user_id, event_count, received_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (batch_id) DO NOTHING
+            RETURNING batch_id
+            """,
+            (batch_id, user_id, len(rows), now)
+        )
+        if cursor.fetchone() is None:
+            result['duplicate'] = True
+            return result
+        if rows:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            received_at = now.isoformat()
+            for occurred_at, action, reason, host, category in rows:
+                # An unquoted empty field is NULL in CSV COPY (except for reason, see FORCE_NOT_NULL)
+                writer.writerow((occurred_at.isoformat(), received_at, user_id, action, reason, host, category, batch_id))
+            buffer.seek(0)
+            # Django's cursor wrapper has no COPY support; use the psycopg2 cursor underneath
+            cursor.cursor.copy_expert(
+                f"COPY block_events ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (reason))",
+                buffer
+            )
+            # Last: rollup rows are shared between users, keep their locks short
+            _update_rollups(cursor, user_id, rows)
+    result['accepted'] = len(rows)
+    return result
+
+
+partition_maintainer = PeriodicTask('event-partitions', settings.EVENT_PARTITION_MAINTENANCE_INTERVAL, maintain_partitions)
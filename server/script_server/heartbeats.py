@@ -0,0 +1,74 @@
+"""
+Write-behind buffer for client heartbeats.
+
+Heartbeats only need to move ``last_heartbeat`` forward, so instead of one
+write per request they are collected in memory and flushed for all users
+in a single upsert every few seconds.
+"""
+import atexit
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .background import PeriodicTask
+from .models import UserStatus
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatCoalescer:
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def record(self, user_id, timestamp=None):
+        """Remember the latest heartbeat of a user until the next flush."""
+        with self._lock:
+            self._pending[user_id] = timestamp or timezone.now()
+            if self._task is None:
+                self._task = PeriodicTask('heartbeat-flush', self.interval, self.flush)
+                self._task.start()
+                atexit.register(self.flush)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write all buffered heartbeats in one statement and return how many were written."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            UserStatus.record_heartbeats(batch)
+        except Exception:
+            logger.exception("Failed to flush %d heartbeats", len(batch))
+            # Put them back unless a newer heartbeat arrived meanwhile
+            with self._lock:
+                for user_id, timestamp in batch.items():
+                    self._pending.setdefault(user_id, timestamp)
+            return 0
+        return len(batch)
+
+
+coalescer = HeartbeatCoalescer(settings.HEARTBEAT_FLUSH_INTERVAL)
+
+
+def record_heartbeat(user_id):
+    """Record a heartbeat, buffered if HEARTBEAT_FLUSH_INTERVAL is set, otherwise written immediately."""
+    if coalescer.interval > 0:
+        coalescer.record(user_id)
+    else:
+        UserStatus.record_heartbeats({user_id: timezone.now()})
+
+
+async def arecord_heartbeat(user_id):
+    """Async version of record_heartbeat(); buffering needs no database access, so it stays on the event loop."""
+    if coalescer.interval > 0:
+        coalescer.record(user_id)
+    else:
+        await sync_to_async(UserStatus.record_heartbeats)({user_id: timezone.now()})
@@ -0,0 +1,117 @@
+"""
+Non-blocking, structured logging for the server.
+
+Records are put on an in-memory queue by QueueListenerHandler and written
+by a background thread, so a slow terminal or disk never stalls the event
+loop. SamplingFilter drops a share of high-volume events (per WebSocket
+frame) before they are queued. Events carry structured fields that
+StructuredFormatter renders as ``key=value`` text or JSON lines.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+def log_event(logger, level, event, exc_info=False, **fields):
+    """Log an event name with structured fields; nothing is formatted if the level is disabled."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={'event': event, 'fields': fields})
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a share of the records of selected events.
+
+    Args:
+        rates (dict): event name -> share of records to keep (0..1); other events are always kept
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None), 1.0)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render a record with its structured fields as ``key=value`` text or as one JSON object per line."""
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = dict(getattr(record, 'fields', {}))
+        if hasattr(record, 'sample_rate'):
+            fields['sample_rate'] = record.sample_rate
+        if self.json_lines:
+            entry = {
+                'ts': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                entry['exc_info'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        text = ' '.join(
+            [self.formatTime(record), record.levelname, record.name, record.getMessage()]
+            + [f"{key}={value}" for key, value in fields.items()]
+        )
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    QueueHandler that owns its QueueListener and output handler, so it can be
+    configured from settings.LOGGING (dictConfig) in one entry.
+
+    Args:
+        json_lines (bool): Write JSON lines instead of key=value text
+        stream: Output stream (defaults to stderr)
+        maxsize (int): Queue bound; records are dropped rather than blocking when it is full
+    """
+
+    def __init__(self, json_lines=False, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(StructuredFormatter(json_lines=json_lines))
+        self.listener = QueueListener(self.queue, output, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.stop_listener)
+
+    def prepare(self, record):
+        # The queue stays in this process, so skip QueueHandler's eager formatting (which
+        # would run on the event loop); the listener thread formats the record instead
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop_listener(self):
+        """Flush queued records and stop the writer thread; safe to call more than once."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self.stop_listener()
+        super().close()
@@ -0,0 +1,214 @@
+"""
+Background maintenance: batched deletes of expired and stale rows.
+
+Cleanup jobs run as tasks on an asyncio loop in a thread of their own,
+started with the ASGI app, so nothing is cleaned up on request paths. A run
+deletes at most MAINTENANCE_MAX_BATCHES batches of MAINTENANCE_BATCH_SIZE
+rows, each in its own short statement, pausing MAINTENANCE_BATCH_PAUSE
+seconds in between: locks are held briefly, autovacuum keeps up with the
+dead rows, and the jobs share a single database connection. Rows left over
+are deleted on the next run.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, connections, router
+from django.utils import timezone
+from . import metrics
+from .models import DomainDaily, EventBatch, PolicyArtifact, UserCategoryHourly, UserIP, UserStatus
+
+logger = logging.getLogger(__name__)
+
+
+def batched_delete(table, condition, params, batch_size, alias='default'):
+    """
+    Delete up to batch_size rows of table matching condition in one statement.
+
+    Rows locked by other transactions are skipped instead of waited for.
+
+    Returns:
+        int: Number of deleted rows
+    """
+    table = connection.ops.quote_name(table)
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {table} WHERE ctid = ANY(ARRAY(
+                SELECT ctid FROM {table} WHERE {condition} LIMIT %s FOR UPDATE SKIP LOCKED
+            ))
+            """,
+            [*params, batch_size]
+        )
+        return cursor.rowcount
+
+
+def _delete(model, condition, params, batch_size):
+    return batched_delete(model._meta.db_table, condition, params, batch_size, alias=router.db_for_write(model))
+
+
+def delete_expired_2fa_codes(batch_size):
+    """Expired admin panel login codes; the panel itself only deletes a user's codes when they log in."""
+    with connections['default'].cursor() as cursor:
+        # The table is created with the admin panel's users table, not by a migration
+        cursor.execute("SELECT to_regclass('two_factor_codes') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return 0
+    return batched_delete('two_factor_codes', 'expiry < NOW()', [], batch_size)
+
+
+def delete_stale_addresses(batch_size):
+    """Registered addresses of devices that have not registered for DEVICE_RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=settings.DEVICE_RETENTION_DAYS)
+    return _delete(UserIP, 'last_updated < %s', [cutoff], batch_size)
+
+
+def delete_stale_statuses(batch_size):
+    """Presence rows of users offline for DEVICE_RETENTION_DAYS; the next connection recreates them."""
+    cutoff = timezone.now() - timedelta(days=settings.DEVICE_RETENTION_DAYS)
+    return _delete(UserStatus, 'NOT is_online AND last_heartbeat < %s', [cutoff], batch_size)
+
+
+def delete_expired_event_batches(batch_size):
+    """IDs of event batches older than EVENT_RETENTION_DAYS, whose events are gone with their partition."""
+    cutoff = timezone.now() - timedelta(days=settings.EVENT_RETENTION_DAYS)
+    return _delete(EventBatch, 'received_at < %s', [cutoff], batch_size)
+
+
+def delete_expired_rollups(batch_size):
+    """Report rollups older than EVENT_ROLLUP_RETENTION_DAYS, hourly ones first."""
+    cutoff = timezone.now() - timedelta(days=settings.EVENT_ROLLUP_RETENTION_DAYS)
+    deleted = _delete(UserCategoryHourly, 'hour < %s', [cutoff], batch_size)
+    if deleted < batch_size:
+        deleted += _delete(DomainDaily, 'day < %s', [cutoff.date()], batch_size - deleted)
+    return deleted
+
+
+def delete_unused_artifacts(batch_size):
+    """
+    Policy artifacts no settings request has resolved to for
+    POLICY_ARTIFACT_RETENTION_DAYS (e.g. those of replaced policy versions).
+    """
+    cutoff = timezone.localdate() - timedelta(days=settings.POLICY_ARTIFACT_RETENTION_DAYS)
+    return _delete(PolicyArtifact, 'used_on < %s', [cutoff], batch_size)
+
+
+class MaintenanceJob:
+    """
+    A cleanup job.
+
+    Args:
+        name (str): Name in logs and metrics
+        delete_batch: Function deleting up to batch_size rows: delete_batch(batch_size) -> rows deleted
+        enabled (bool): Whether the scheduler runs the job
+    """
+
+    def __init__(self, name, delete_batch, enabled=True):
+        self.name = name
+        self.delete_batch = delete_batch
+        self.enabled = enabled
+
+
+def _close_connection():
+    # Runs in the executor thread, whose connection it closes
+    connection.close()
+
+
+class MaintenanceScheduler:
+    """
+    Run cleanup jobs every ``interval`` seconds on a daemon thread's event loop.
+
+    Args:
+        jobs (list): MaintenanceJob instances
+        interval (float): Seconds between runs of each job (0 disables the scheduler)
+        batch_size (int): Rows deleted per statement
+        max_batches (int): Statements per job run
+        pause (float): Seconds between statements
+    """
+
+    def __init__(self, jobs, interval, batch_size, max_batches, pause):
+        self.jobs = {job.name: job for job in jobs}
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pause = pause
+        # One thread for all database work: jobs never use more than one connection
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='maintenance-db')
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the thread once; later calls are no-ops."""
+        with self._lock:
+            if self._thread is None and self.interval > 0:
+                self._thread = threading.Thread(target=asyncio.run, args=(self._main(),), name='maintenance', daemon=True)
+                self._thread.start()
+
+    async def _main(self):
+        jobs = [job for job in self.jobs.values() if job.enabled]
+        await asyncio.gather(*(self._schedule(job, index / len(jobs)) for index, job in enumerate(jobs)))
+
+    async def _schedule(self, job, offset):
+        # Offset the first runs so the jobs do not all start at once
+        await asyncio.sleep(self.interval * (1 + offset))
+        while True:
+            started = time.monotonic()
+            await self.run_job(job)
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    async def run_job(self, job, max_batches=None):
+        """
+        Run one job: delete batches until fewer than a full batch is left or
+        max_batches (default: the scheduler's) have run.
+
+        Returns:
+            int: Number of deleted rows
+        """
+        loop = asyncio.get_running_loop()
+        max_batches = self.max_batches if max_batches is None else max_batches
+        started = time.perf_counter()
+        deleted = 0
+        result = 'done'
+        try:
+            for batch in range(max_batches):
+                if batch:
+                    await asyncio.sleep(self.pause)
+                count = await loop.run_in_executor(self._executor, job.delete_batch, self.batch_size)
+                deleted += count
+                if count < self.batch_size:
+                    break
+            else:
+                result = 'partial'  # More rows are left for the next run
+        except Exception:
+            result = 'failed'
+            logger.exception("Maintenance job %s failed", job.name)
+        finally:
+            await loop.run_in_executor(self._executor, _close_connection)
+        duration = time.perf_counter() - started
+        metrics.maintenance_runs.inc(job=job.name, result=result)
+        metrics.maintenance_run_duration.observe(duration, job=job.name)
+        metrics.maintenance_rows_deleted.inc(deleted, job=job.name)
+        if result != 'failed':
+            metrics.maintenance_last_success.set(time.time(), job=job.name)
+        if deleted:
+            logger.info("Maintenance job %s deleted %d rows in %.2fs (%s)", job.name, deleted, duration, result)
+        return deleted
+
+
+maintenance_scheduler = MaintenanceScheduler(
+    [
+        MaintenanceJob('two-factor-codes', delete_expired_2fa_codes),
+        MaintenanceJob('user-ips', delete_stale_addresses, enabled=settings.DEVICE_RETENTION_DAYS > 0),
+        MaintenanceJob('user-statuses', delete_stale_statuses, enabled=settings.DEVICE_RETENTION_DAYS > 0),
+        MaintenanceJob('event-batches', delete_expired_event_batches),
+        MaintenanceJob('event-rollups', delete_expired_rollups),
+        MaintenanceJob('policy-artifacts', delete_unused_artifacts),
+    ],
+    interval=settings.MAINTENANCE_INTERVAL,
+    batch_size=settings.MAINTENANCE_BATCH_SIZE,
+    max_batches=settings.MAINTENANCE_MAX_BATCHES,
+    pause=settings.MAINTENANCE_BATCH_PAUSE,
+)
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from script_server import events
+
+
+class Command(BaseCommand):
+    help = "Create upcoming block event partitions and drop the ones past EVENT_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.EVENT_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        dropped = events.maintain_partitions(options['retention_days'])
+        self.stdout.write(f"Partitions ensured for {settings.EVENT_PARTITIONS_AHEAD} days ahead; "
+                          f"dropped {len(dropped)}: {', '.join(dropped) or '-'}")
@@ -0,0 +1,23 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from script_server.maintenance import maintenance_scheduler
+
+
+class Command(BaseCommand):
+    help = "Run the background maintenance jobs once, e.g. from cron when MAINTENANCE_INTERVAL is 0"
+
+    def add_arguments(self, parser):
+        parser.add_argument('jobs', nargs='*', help=f"Jobs to run (default all): {', '.join(maintenance_scheduler.jobs)}")
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Statements per job (default MAINTENANCE_MAX_BATCHES)")
+
+    def handle(self, *args, **options):
+        unknown = set(options['jobs']) - set(maintenance_scheduler.jobs)
+        if unknown:
+            raise CommandError(f"Unknown jobs: {', '.join(sorted(unknown))}")
+        for name in options['jobs'] or maintenance_scheduler.jobs:
+            job = maintenance_scheduler.jobs[name]
+            if not job.enabled and not options['jobs']:
+                continue
+            deleted = asyncio.run(maintenance_scheduler.run_job(job, options['max_batches']))
+            self.stdout.write(f"{name}: deleted {deleted} rows")
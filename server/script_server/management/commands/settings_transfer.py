@@ -0,0 +1,58 @@
+import gzip
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from script_server import settings_transfer
+
+
+def _open(path, mode):
+    # '-' is stdin/stdout; a .gz name means gzip
+    if path == '-':
+        return (sys.stdin if 'r' in mode else sys.stdout).buffer
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+
+class Command(BaseCommand):
+    help = "Export all policies and user settings as NDJSON, or import such a file"
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest='action', required=True)
+        export = subcommands.add_parser('export', help="Write the export to a file (.gz to compress) or stdout")
+        export.add_argument('path', nargs='?', default='-')
+        import_ = subcommands.add_parser('import', help="Import a file written by export (.gz or plain)")
+        import_.add_argument('path')
+        import_.add_argument('--batch-size', type=int, default=settings_transfer.IMPORT_BATCH_SIZE)
+        import_.add_argument('--dry-run', action='store_true', help="Validate only")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'export':
+            self.export(options['path'])
+        else:
+            self.import_(options['path'], options['batch_size'], options['dry_run'])
+
+    def export(self, path):
+        users = total = 0
+        with _open(path, 'wb') as output:
+            for chunk in settings_transfer.export_chunks():
+                if total == 0:
+                    total = json.loads(chunk.partition('\n')[0])['users']
+                else:
+                    users += chunk.count('\n')
+                    self.stderr.write(f"\rExported {users}/{total} users", ending='')
+                output.write(chunk.encode())
+        self.stderr.write(f"\rExported {users} users")
+
+    def import_(self, path, batch_size, dry_run):
+        try:
+            stream = _open(path, 'rb')
+        except OSError as e:
+            raise CommandError(str(e))
+        with stream:
+            for update in settings_transfer.SettingsImporter(stream, batch_size=batch_size, dry_run=dry_run).run():
+                self.stderr.write(f"\rLine {update['lines']}: {update['users']} users, {update['policies']} policies, "
+                                  f"{update['errors']} errors", ending='')
+        self.stderr.write('')
+        for error in update['error_details']:
+            self.stderr.write(f"Line {error['line']}: {error['message']}")
+        self.stdout.write(f"{'Validated' if dry_run else 'Imported'} {update['users']} users and "
+                          f"{update['policies']} policies; {update['errors']} invalid lines skipped")
@@ -0,0 +1,216 @@
+"""
+In-process metrics exported in the Prometheus text format at /metrics.
+
+A deliberately small registry (counters, gauges, histograms with labels) so
+the server does not need prometheus_client. Values are per process; when
+running several workers, scrape each of them.
+"""
+import bisect
+import threading
+
+# Seconds; fine-grained at the low end where the hot endpoints should be
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Seconds; script jobs run from well under a second up to SCRIPT_TIMEOUT
+JOB_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable that updates gauges right before each scrape."""
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status')))
+http_request_queries = registry.register(Histogram(
+    'http_request_db_queries', 'Database queries per HTTP request', ('route',), buckets=QUERY_COUNT_BUCKETS))
+http_request_query_duration = registry.register(Histogram(
+    'http_request_db_seconds', 'Time spent in database queries per HTTP request', ('route',)))
+websocket_connections = registry.register(Gauge(
+    'websocket_connections', 'Open WebSocket connections'))
+websocket_connections_total = registry.register(Counter(
+    'websocket_connections_total', 'Accepted WebSocket connections'))
+websocket_resumes = registry.register(Counter(
+    'websocket_resumes_total', 'Reconnected user clients by whether their settings were current or pushed again', ('result',)))
+websocket_messages = registry.register(Counter(
+    'websocket_messages_total', 'WebSocket messages by direction and type', ('direction', 'type')))
+group_send_duration = registry.register(Histogram(
+    'channel_group_send_seconds', 'Duration of channel layer group_send calls by group kind', ('group',)))
+db_pool = registry.register(Gauge(
+    'db_pool_connections', 'Database pool connections by state', ('alias', 'state')))
+db_pool_events = registry.register(Gauge(
+    'db_pool_events', 'Database pool lifetime counters (acquired, created, timeouts, ...)', ('alias', 'event')))
+script_jobs = registry.register(Gauge(
+    'script_jobs', 'Script jobs waiting in the queue or running', ('state',)))
+script_jobs_total = registry.register(Counter(
+    'script_jobs_total', 'Finished script jobs by final status', ('status',)))
+script_job_wait = registry.register(Histogram(
+    'script_job_wait_seconds', 'Time script jobs spent in the queue before starting', buckets=JOB_BUCKETS))
+script_job_duration = registry.register(Histogram(
+    'script_job_duration_seconds', 'Script job run time by final status', ('status',), buckets=JOB_BUCKETS))
+script_warm_worker_recycles = registry.register(Counter(
+    'script_warm_worker_recycles_total', 'Warm script workers replaced, by reason (runs, memory, died, error)', ('reason',)))
+
+events_ingested = registry.register(Counter(
+    'block_events_ingested_total', 'Uploaded block events by result (accepted, rejected, duplicate)', ('result',)))
+event_batches = registry.register(Counter(
+    'block_event_batches_total', 'Uploaded block event batches by result', ('result',)))
+telemetry_snapshots = registry.register(Counter(
+    'telemetry_snapshots_total', 'Client telemetry snapshots by result (accepted, throttled, invalid)', ('result',)))
+telemetry_devices = registry.register(Gauge(
+    'telemetry_devices', 'Devices in the in-memory fleet view'))
+policy_artifact_compiles = registry.register(Counter(
+    'policy_artifact_compiles_total', 'Effective settings compiled into policy artifacts'))
+admission_rejections = registry.register(Counter(
+    'admission_rejections_total', 'Requests and WebSocket connections turned away, by scope and limit (client, global, concurrency)',
+    ('scope', 'limit')))
+admission_handshakes = registry.register(Gauge(
+    'admission_websocket_handshakes', 'WebSocket connections accepted but not registered yet'))
+maintenance_runs = registry.register(Counter(
+    'maintenance_runs_total', 'Maintenance job runs by result (done, partial, failed)', ('job', 'result')))
+maintenance_run_duration = registry.register(Histogram(
+    'maintenance_run_seconds', 'Maintenance job run time, pauses included', ('job',), buckets=JOB_BUCKETS))
+maintenance_rows_deleted = registry.register(Counter(
+    'maintenance_rows_deleted_total', 'Rows deleted by maintenance jobs', ('job',)))
+maintenance_last_success = registry.register(Gauge(
+    'maintenance_last_success_timestamp_seconds', 'Unix time of the last maintenance job run without errors', ('job',)))
+
+
+def group_kind(group):
+    """Collapse a group name to its kind (user, policy, admins, ...) to keep label cardinality low."""
+    return group.split('_', 1)[0]
+
+
+def _collect_db_pool():
+    from .db_pool.pool import pool_stats
+    for alias, stats in pool_stats().items():
+        for state in ('size', 'idle', 'in_use', 'waiting', 'max_size'):
+            db_pool.set(stats[state], alias=alias, state=state)
+        for event in ('acquired', 'created', 'closed', 'timeouts', 'failed_checks', 'wait_seconds_total', 'wait_seconds_max'):
+            db_pool_events.set(stats[event], alias=alias, event=event)
+
+
+def _collect_telemetry():
+    from .telemetry import fleet
+    telemetry_devices.set(fleet.device_count)
+
+
+def _collect_admission():
+    from .admission import ws_handshakes
+    admission_handshakes.set(ws_handshakes.in_progress)
+
+
+registry.add_collector(_collect_db_pool)
+registry.add_collector(_collect_telemetry)
+registry.add_collector(_collect_admission)
@@ -0,0 +1,188 @@
+"""
+Request instrumentation: latency, database query count/time per route and an
+optional slow request log with the SQL that ran. Also returns the request's
+database connections to the pool when the response is ready, and compresses
+responses.
+"""
+import contextvars
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.backends.signals import connection_created
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # Optional: responses are gzip-compressed only
+    brotli = None
+
+slow_request_logger = logging.getLogger('script_server.slow_requests')
+
+# Statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+# Brotli quality for responses: 5 compresses settings JSON better than gzip at a similar speed
+BROTLI_QUALITY = 5
+
+re_accepts_br = _lazy_re_compile(r"\bbr\b")
+
+# Query stats of the current request; contextvars follow the request into sync_to_async threads
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self, capture_sql):
+        self.queries = 0
+        self.seconds = 0.0
+        self.capture_sql = capture_sql
+        self.statements = []
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.seconds += elapsed
+        if stats.capture_sql and len(stats.statements) < MAX_LOGGED_QUERIES:
+            stats.statements.append((elapsed, sql))
+
+
+def _install_query_hook(sender, connection, **kwargs):
+    # The wrapper object outlives reconnects, so install the hook only once per wrapper
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_hook)
+
+
+class MetricsMiddleware:
+    """Record latency and database usage per route for /metrics."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token, start = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, start = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    def _start(self):
+        stats = RequestStats(capture_sql=settings.SLOW_REQUEST_SECONDS > 0)
+        return stats, _request_stats.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, start):
+        elapsed = time.perf_counter() - start
+        # The URL pattern, not the path, so IDs in URLs don't explode the label cardinality
+        route = request.resolver_match.route if request.resolver_match else 'unmatched'
+        metrics.http_request_duration.observe(
+            elapsed, method=request.method, route=route, status=response.status_code
+        )
+        metrics.http_request_queries.observe(stats.queries, route=route)
+        metrics.http_request_query_duration.observe(stats.seconds, route=route)
+
+        if 0 < settings.SLOW_REQUEST_SECONDS <= elapsed:
+            statements = '\n'.join(f"  {seconds * 1000:.1f}ms {sql}" for seconds, sql in stats.statements)
+            slow_request_logger.warning(
+                "Slow request %s %s (%s): %.3fs, %d queries in %.3fs\n%s",
+                request.method, request.path, route, elapsed, stats.queries, stats.seconds, statements
+            )
+
+
+class ReleaseConnectionsMiddleware:
+    """
+    Close the request's database connections (returning them to the pool) as
+    soon as the response is ready.
+
+    Django 5.0 does this from response.close() at request_finished, but the
+    ASGI handler cancels that step when the client disconnects right after the
+    response, as daphne reports once a response is complete. The connection of
+    the request's sync thread was then never returned and the pool ran dry.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        close_old_connections()
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        stats = _request_stats.get()
+        # Connections are per thread: close them in the request's sync thread, skipping requests without queries
+        if stats is None or stats.queries:
+            await sync_to_async(close_old_connections)()
+        return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress responses with brotli if the brotli package is installed and the
+    client accepts it, otherwise with gzip.
+
+    Streaming responses are left alone: they are NDJSON progress and output
+    streams whose lines must reach the client as they are written, and the
+    settings export compresses itself.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        if (
+            brotli is None or len(response.content) < 200 or response.has_header('Content-Encoding')
+            or not re_accepts_br.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # Like GZipMiddleware: the encoded body is no longer byte-identical to what a strong ETag promises
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-19 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0005_alter_userstatus_user_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersettings',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-19 16:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0007_policy'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userstatus',
+            name='last_heartbeat',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
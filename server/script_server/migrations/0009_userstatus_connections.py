@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-19 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0008_userstatus_last_heartbeat_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstatus',
+            name='connections',
+            field=models.PositiveIntegerField(db_default=models.Value(0), default=0),
+        ),
+    ]
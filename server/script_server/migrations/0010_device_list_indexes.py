@@ -0,0 +1,35 @@
+# Generated by Django 5.0 on 2026-10-19 17:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0009_userstatus_connections'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userstatus',
+            name='last_heartbeat',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='userip',
+            index=models.Index(fields=['last_updated', 'user_id'], name='userip_updated_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userip',
+            index=models.Index(fields=['user_id'], name='userip_user_id_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='userip',
+            index=models.Index(fields=['ip_address'], name='userip_ip_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='userstatus',
+            index=models.Index(fields=['last_heartbeat', 'user_id'], name='userstatus_heartbeat_user_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0 on 2026-10-19 18:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0010_device_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventBatch',
+            fields=[
+                ('batch_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=255)),
+                ('event_count', models.PositiveIntegerField()),
+                ('received_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'event_batches',
+            },
+        ),
+        migrations.CreateModel(
+            name='BlockEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('occurred_at', models.DateTimeField()),
+                ('received_at', models.DateTimeField()),
+                ('user_id', models.CharField(max_length=255)),
+                ('action', models.CharField(max_length=16)),
+                ('reason', models.CharField(max_length=16)),
+                ('host', models.TextField()),
+                ('category', models.TextField(null=True)),
+                ('batch_id', models.UUIDField()),
+            ],
+            options={
+                'db_table': 'block_events',
+                'managed': False,
+            },
+        ),
+        # Partitioned by day on occurred_at: retention drops whole partitions instead of deleting rows.
+        # Partitions are created ahead of time by script_server.events.ensure_partitions.
+        migrations.RunSQL(
+            sql="""
+                CREATE TABLE block_events (
+                    id bigserial NOT NULL,
+                    occurred_at timestamptz NOT NULL,
+                    received_at timestamptz NOT NULL,
+                    user_id varchar(255) NOT NULL,
+                    action varchar(16) NOT NULL,
+                    reason varchar(16) NOT NULL,
+                    host text NOT NULL,
+                    category text NULL,
+                    batch_id uuid NOT NULL,
+                    PRIMARY KEY (id, occurred_at)
+                ) PARTITION BY RANGE (occurred_at);
+                CREATE INDEX block_events_user_occurred_idx ON block_events (user_id, occurred_at);
+            """,
+            reverse_sql="DROP TABLE block_events;",
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.0 on 2026-10-19 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0011_block_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCategoryHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255)),
+                ('hour', models.DateTimeField()),
+                ('action', models.CharField(max_length=16)),
+                ('category', models.TextField(default='')),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'event_rollup_user_hourly',
+            },
+        ),
+        migrations.CreateModel(
+            name='DomainDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.TextField()),
+                ('day', models.DateField()),
+                ('action', models.CharField(max_length=16)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'event_rollup_domain_daily',
+                'indexes': [models.Index(fields=['day', 'action'], name='rollup_domain_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='domaindaily',
+            constraint=models.UniqueConstraint(fields=('host', 'day', 'action'), name='rollup_domain_day_key'),
+        ),
+        migrations.AddIndex(
+            model_name='usercategoryhourly',
+            index=models.Index(fields=['hour', 'action'], name='rollup_user_hour_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='usercategoryhourly',
+            constraint=models.UniqueConstraint(fields=('user_id', 'hour', 'action', 'category'), name='rollup_user_hour_key'),
+        ),
+        # Roll up the events stored before this migration; later events are rolled up on ingest
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO event_rollup_user_hourly (user_id, hour, action, category, count)
+                SELECT user_id, date_trunc('hour', occurred_at), action, coalesce(category, ''), count(*)
+                FROM block_events GROUP BY 1, 2, 3, 4;
+                INSERT INTO event_rollup_domain_daily (host, day, action, count)
+                SELECT host, (occurred_at AT TIME ZONE 'UTC')::date, action, count(*)
+                FROM block_events GROUP BY 1, 2, 3;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
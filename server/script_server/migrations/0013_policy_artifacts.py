@@ -0,0 +1,26 @@
+# Generated by Django 5.0 on 2026-10-19 18:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0012_event_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyArtifact',
+            fields=[
+                ('artifact_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('source_digest', models.CharField(max_length=64, unique=True)),
+                ('data', models.BinaryField()),
+                ('used_on', models.DateField(db_index=True, default=django.utils.timezone.localdate)),
+            ],
+            options={
+                'db_table': 'policy_artifacts',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0 on 2026-10-19 18:30
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_server', '0013_policy_artifacts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usersettings',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['blocked_sites'], name='usersettings_blocked_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='usersettings',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['excluded_sites'], name='usersettings_excluded_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='usersettings',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['categories'], name='usersettings_categories_gin'),
+        ),
+    ]
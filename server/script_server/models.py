@@ -1,6 +1,51 @@
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import connection, connections, models, router, transaction
 from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+
+# System defaults used for the shared default policy
+DEFAULT_SETTINGS = {
+    'blocked_sites': [
+        'web.telegram.org',
+        'example.com'
+    ],
+    'excluded_sites': [
+        'facebook.com',
+        'twitter.com'
+    ],
+    'categories': {
+        'explicit_language_and_profanity': [
+            'curse', 'swear', 'offensive', 'slurs', 'profanity'
+        ],
+        'violence_and_gore': [
+            'violence', 'gore', 'graphic', 'brutal'
+        ],
+        'hate_speech_and_discrimination': [
+            'racist', 'sexist', 'homophobic', 'extremist', 'hate'
+        ],
+        'illegal_activities': [
+            'drugs', 'hacking', 'weapons', 'illegal'
+        ],
+        'bullying_and_harassment': [
+            'bullying', 'harassment', 'harmful'
+        ],
+        'dangerous_or_risky_behavior': [
+            'self-harm', 'stunts', 'dangerous', 'risky'
+        ],
+        'explicit_religious_or_political_propaganda': [
+            'religious', 'political', 'extreme', 'divisive'
+        ],
+        'addictive_or_distracting_content': [
+            'addictive', 'games', 'social media', 'distracting'
+        ],
+        'gambling_and_betting': [
+            'betting', 'gambling', 'casino', 'lottery'
+        ]
+    }
+}
+
+DEFAULT_POLICY_NAME = 'default'
 
 class UserIP(models.Model):
     user_id = models.CharField(max_length=100, unique=True)
@@ -8,23 +53,187 @@ class UserIP(models.Model):
     port = models.IntegerField(default=8081)
     last_updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of /user-ips/
+            models.Index(fields=['last_updated', 'user_id'], name='userip_updated_user_idx'),
+            # Prefix search (LIKE 'abc%') regardless of the database collation
+            models.Index(fields=['user_id'], name='userip_user_id_prefix_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['ip_address'], name='userip_ip_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
     def __str__(self):
         return f"{self.user_id} - {self.ip_address}:{self.port}"
 
+    @classmethod
+    def upsert(cls, user_id, ip_address, port=8081):
+        """Insert or update a user's address with a single INSERT ... ON CONFLICT DO UPDATE."""
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, ip_address, port, last_updated)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (user_id) DO UPDATE
+                SET ip_address = EXCLUDED.ip_address, port = EXCLUDED.port, last_updated = EXCLUDED.last_updated
+                """,
+                (user_id, ip_address, port, timezone.now())
+            )
+
+    @classmethod
+    async def aupsert(cls, user_id, ip_address, port=8081):
+        """Async version of upsert() (raw cursors have no async API yet)."""
+        await sync_to_async(cls.upsert)(user_id, ip_address, port)
+
 class UserStatus(models.Model):
     user_id = models.CharField(max_length=100, unique=True)
     last_heartbeat = models.DateTimeField(default=timezone.now)
     is_online = models.BooleanField(default=True)
+    connections = models.PositiveIntegerField(default=0, db_default=0)  # Open WebSocket connections across all server workers
+
+    class Meta:
+        indexes = [
+            # Online threshold filter and keyset pagination of /online-users/
+            models.Index(fields=['last_heartbeat', 'user_id'], name='userstatus_heartbeat_user_idx'),
+        ]
 
     def update_heartbeat(self):
         self.last_heartbeat = timezone.now()
         self.is_online = True
-        self.save()
+        self.save(update_fields=['last_heartbeat', 'is_online'])
+
+    @classmethod
+    def record_heartbeats(cls, heartbeats):
+        """
+        Upsert the last heartbeat of many users in one statement.
+
+        Args:
+            heartbeats (dict): user_id -> heartbeat datetime
+        """
+        if not heartbeats:
+            return
+        table = connection.ops.quote_name(cls._meta.db_table)
+        values = ', '.join(['(%s, %s, true)'] * len(heartbeats))
+        params = [value for heartbeat in heartbeats.items() for value in heartbeat]
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            # GREATEST keeps a late flush from moving a heartbeat backwards
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, last_heartbeat, is_online)
+                VALUES {values}
+                ON CONFLICT (user_id) DO UPDATE
+                SET last_heartbeat = GREATEST({table}.last_heartbeat, EXCLUDED.last_heartbeat), is_online = true
+                """,
+                params
+            )
+
+    @classmethod
+    def online_users(cls, timeout_seconds):
+        """
+        Users with a heartbeat within the last timeout_seconds (read-only, uses the last_heartbeat index).
+
+        Users whose last connection closed cleanly are excluded right away through is_online.
+        """
+        threshold = timezone.now() - timezone.timedelta(seconds=timeout_seconds)
+        return cls.objects.filter(last_heartbeat__gte=threshold, is_online=True)
+
+    @classmethod
+    def connect(cls, user_id):
+        """
+        Count a new WebSocket connection of the user and mark them online.
+
+        Returns:
+            int: The user's open connections, including this one
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, last_heartbeat, is_online, connections)
+                VALUES (%s, %s, true, 1)
+                ON CONFLICT (user_id) DO UPDATE
+                SET last_heartbeat = EXCLUDED.last_heartbeat, is_online = true, connections = {table}.connections + 1
+                RETURNING connections
+                """,
+                (user_id, timezone.now())
+            )
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def disconnect(cls, user_id):
+        """
+        Count a closed WebSocket connection; the user goes offline with their last one.
+
+        Returns:
+            int: The user's remaining open connections
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET connections = GREATEST(connections - 1, 0), is_online = connections > 1
+                WHERE user_id = %s
+                RETURNING connections
+                """,
+                (user_id,)
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
 
     @classmethod
     def mark_offline_inactive_users(cls, timeout_minutes=5):
+        """
+        Persist is_online = false for users that timed out; only rows still marked online are touched.
+
+        Connection counts are reset as well, since a timed out user's connections
+        belonged to a worker that went away without closing them.
+
+        Returns:
+            list: IDs of the users that went offline
+        """
         timeout = timezone.now() - timezone.timedelta(minutes=timeout_minutes)
-        cls.objects.filter(last_heartbeat__lt=timeout).update(is_online=False)
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET is_online = false, connections = 0
+                WHERE last_heartbeat < %s AND is_online
+                RETURNING user_id
+                """,
+                (timeout,)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+class Policy(models.Model):
+    """Shared filtering rules that many users can reference."""
+    name = models.CharField(max_length=255, unique=True)
+    blocked_sites = ArrayField(models.TextField(), default=list)
+    excluded_sites = ArrayField(models.TextField(), default=list)
+    categories = models.JSONField(default=dict)
+    version = models.PositiveIntegerField(default=1)  # Bumped on every change, part of the effective settings cache key
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'policies'
+
+    def __str__(self):
+        return f"Policy {self.name} (v{self.version})"
+
+    @classmethod
+    def get_default_policy(cls):
+        """Fetch the default policy, creating it from DEFAULT_SETTINGS if needed."""
+        policy, created = cls.objects.get_or_create(
+            name=DEFAULT_POLICY_NAME,
+            defaults={
+                'blocked_sites': DEFAULT_SETTINGS['blocked_sites'],
+                'excluded_sites': DEFAULT_SETTINGS['excluded_sites'],
+                'categories': DEFAULT_SETTINGS['categories'],
+            }
+        )
+        return policy
 
 class UserSettings(models.Model):
     id = models.AutoField(primary_key=True)
@@ -32,11 +241,20 @@ class UserSettings(models.Model):
     blocked_sites = ArrayField(models.TextField(), default=list)  # Use ArrayField for TEXT[]
     excluded_sites = ArrayField(models.TextField(), default=list)  # Use ArrayField for TEXT[]
     categories = models.JSONField(default=dict)  # Use Django's built-in JSONField
+    version = models.PositiveIntegerField(default=1)  # Bumped on every change, used for optimistic concurrency
+    policies = models.ManyToManyField(Policy, blank=True, related_name='users')  # Shared rules; the columns above are per-user overrides
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'user_settings'
+        indexes = [
+            # Reverse lookups for rule search: which users list a site (@>, &&) or a keyword (@>, @?)
+            GinIndex(fields=['blocked_sites'], name='usersettings_blocked_gin'),
+            GinIndex(fields=['excluded_sites'], name='usersettings_excluded_gin'),
+            # jsonb_ops rather than jsonb_path_ops: it also indexes values, so a keyword is found in any category
+            GinIndex(fields=['categories'], name='usersettings_categories_gin'),
+        ]
 
     def __str__(self):
         return f"Settings for user {self.user_id}"
@@ -45,48 +263,19 @@ class UserSettings(models.Model):
     def create_user_settings(cls, user_id, default_settings=None):
         """
         Create new user settings with default values.
-        If default_settings is not provided, use system defaults.
+        If default_settings is not provided, the user is attached to the
+        default policy and starts with empty per-user overrides.
         """
         if default_settings is None:
-            default_settings = {
-                'blocked_sites': [
-                    'web.telegram.org',
-                    'example.com'
-                ],
-                'excluded_sites': [
-                    'facebook.com',
-                    'twitter.com'
-                ],
-                'categories': {
-                    'explicit_language_and_profanity': [
-                        'curse', 'swear', 'offensive', 'slurs', 'profanity'
-                    ],
-                    'violence_and_gore': [
-                        'violence', 'gore', 'graphic', 'brutal'
-                    ],
-                    'hate_speech_and_discrimination': [
-                        'racist', 'sexist', 'homophobic', 'extremist', 'hate'
-                    ],
-                    'illegal_activities': [
-                        'drugs', 'hacking', 'weapons', 'illegal'
-                    ],
-                    'bullying_and_harassment': [
-                        'bullying', 'harassment', 'harmful'
-                    ],
-                    'dangerous_or_risky_behavior': [
-                        'self-harm', 'stunts', 'dangerous', 'risky'
-                    ],
-                    'explicit_religious_or_political_propaganda': [
-                        'religious', 'political', 'extreme', 'divisive'
-                    ],
-                    'addictive_or_distracting_content': [
-                        'addictive', 'games', 'social media', 'distracting'
-                    ],
-                    'gambling_and_betting': [
-                        'betting', 'gambling', 'casino', 'lottery'
-                    ]
-                }
-            }
+            # New users get the shared default policy instead of a private copy of it
+            try:
+                with transaction.atomic():
+                    settings = cls.objects.create(user_id=user_id)
+                    settings.policies.add(Policy.get_default_policy())
+                return settings
+            except Exception as e:
+                print(f"Error creating user settings: {str(e)}")
+                return None
         
         try:
             settings = cls.objects.create(
@@ -111,6 +300,14 @@ class UserSettings(models.Model):
         except cls.DoesNotExist:
             return cls.create_user_settings(user_id)
 
+    @classmethod
+    async def aget_user_settings(cls, user_id):
+        """Async version of get_user_settings()."""
+        try:
+            return await cls.objects.aget(user_id=user_id)
+        except cls.DoesNotExist:
+            return await sync_to_async(cls.create_user_settings)(user_id)
+
     def get_blocked_sites(self):
         """Get blocked sites as a Python list."""
         return self.blocked_sites if self.blocked_sites is not None else []
@@ -118,7 +315,7 @@ class UserSettings(models.Model):
     def set_blocked_sites(self, sites):
         """Set blocked sites from a Python list."""
         self.blocked_sites = sites
-        self.save()
+        self.save_settings_fields(['blocked_sites'])
 
     def get_excluded_sites(self):
         """Get excluded sites as a Python list."""
@@ -127,7 +324,7 @@ class UserSettings(models.Model):
     def set_excluded_sites(self, sites):
         """Set excluded sites from a Python list."""
         self.excluded_sites = sites
-        self.save()
+        self.save_settings_fields(['excluded_sites'])
 
     def get_categories(self):
         """Get categories as a Python dict."""
@@ -136,17 +333,97 @@ class UserSettings(models.Model):
     def set_categories(self, categories):
         """Set categories from a Python dict."""
         self.categories = categories
-        self.save()
+        self.save_settings_fields(['categories'])
 
     def update_settings(self, **kwargs):
-        """Update user settings with provided values."""
-        if 'blocked_sites' in kwargs:
-            self.blocked_sites = kwargs.pop('blocked_sites')
-        if 'excluded_sites' in kwargs:
-            self.excluded_sites = kwargs.pop('excluded_sites')
-        if 'categories' in kwargs:
-            self.categories = kwargs.pop('categories')
+        """Update user settings with provided values, writing only the changed columns."""
+        changed = []
         for key, value in kwargs.items():
-            if hasattr(self, key):
+            if key in ('id', 'user_id', 'version', 'created_at', 'updated_at') or not hasattr(self, key):
+                continue
+            if getattr(self, key) != value:
                 setattr(self, key, value)
-        self.save()
+                changed.append(key)
+        if changed:
+            self.save_settings_fields(changed)
+
+    def save_settings_fields(self, fields):
+        """Persist only the given columns and bump the version."""
+        self.version = models.F('version') + 1
+        self.save(update_fields=[*fields, 'version', 'updated_at'])
+        self.refresh_from_db(fields=['version'])
+
+class BlockEvent(models.Model):
+    """
+    A block/allow decision reported by a client proxy.
+
+    The table is partitioned by day on occurred_at and written with COPY
+    (see events.py), so it is created by a migration and not managed here.
+    """
+    id = models.BigAutoField(primary_key=True)
+    occurred_at = models.DateTimeField()
+    received_at = models.DateTimeField()
+    user_id = models.CharField(max_length=255)
+    action = models.CharField(max_length=16)  # 'blocked' or 'allowed'
+    reason = models.CharField(max_length=16)  # 'site', 'category' or 'excluded'
+    host = models.TextField()
+    category = models.TextField(null=True)
+    batch_id = models.UUIDField()
+
+    class Meta:
+        managed = False
+        db_table = 'block_events'
+
+class EventBatch(models.Model):
+    """Batches already ingested, so that a client retrying a batch does not store its events twice."""
+    batch_id = models.UUIDField(primary_key=True)
+    user_id = models.CharField(max_length=255)
+    event_count = models.PositiveIntegerField()
+    received_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'event_batches'
+
+class UserCategoryHourly(models.Model):
+    """Event counts per user, hour, action and category, maintained on ingest (see events.py)."""
+    user_id = models.CharField(max_length=255)
+    hour = models.DateTimeField()
+    action = models.CharField(max_length=16)
+    category = models.TextField(default='')  # '' for events without a category (blocked site, allowed page)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'event_rollup_user_hourly'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'hour', 'action', 'category'], name='rollup_user_hour_key'),
+        ]
+        indexes = [
+            # Reports over all users scan a time range
+            models.Index(fields=['hour', 'action'], name='rollup_user_hour_idx'),
+        ]
+
+class DomainDaily(models.Model):
+    """Event counts per host, day and action, maintained on ingest (see events.py)."""
+    host = models.TextField()
+    day = models.DateField()
+    action = models.CharField(max_length=16)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'event_rollup_domain_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['host', 'day', 'action'], name='rollup_domain_day_key'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'action'], name='rollup_domain_day_idx'),
+        ]
+
+class PolicyArtifact(models.Model):
+    """Effective settings compiled for client proxies, stored once per distinct content (see policy_artifacts.py)."""
+    artifact_id = models.CharField(max_length=64, primary_key=True)  # SHA-256 of the packed body
+    source_digest = models.CharField(max_length=64, unique=True)  # SHA-256 of the settings it was compiled from
+    data = models.BinaryField()
+    used_on = models.DateField(default=timezone.localdate, db_index=True)  # Refreshed at most daily
+
+    class Meta:
+        db_table = 'policy_artifacts'
@@ -0,0 +1,101 @@
+"""
+Server-side pushes to connected WebSocket clients.
+
+Every client joins a group for its user ID and one group per policy it
+uses (see consumers.StatusConsumer), so a change reaches exactly the
+affected clients with a single group_send.
+"""
+import asyncio
+import re
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from . import metrics
+
+# Channel layer group names only allow ASCII alphanumerics, hyphens, underscores and periods
+_INVALID_GROUP_CHARS = re.compile(r'[^0-9A-Za-z._-]')
+
+
+def user_group(user_id):
+    """Group name for all connections of one user."""
+    return f"user_{_INVALID_GROUP_CHARS.sub('_', str(user_id))}"[:99]
+
+
+def policy_group(policy_id):
+    """Group name for all connections of users that reference a policy."""
+    return f"policy_{policy_id}"
+
+
+async def timed_group_send(channel_layer, group, message):
+    """group_send that records its fan-out duration for /metrics."""
+    start = time.perf_counter()
+    await channel_layer.group_send(group, message)
+    metrics.group_send_duration.observe(time.perf_counter() - start, group=metrics.group_kind(group))
+
+
+# Event loop the WebSocket consumers run on, recorded by StatusConsumer.connect
+_server_loop = None
+
+
+def bind_server_loop(loop):
+    global _server_loop
+    _server_loop = loop
+
+
+def run_on_server_loop(coroutine_function, *args):
+    """
+    Run a channel layer coroutine from synchronous code and wait for it.
+
+    The in-memory channel layer's queues belong to the consumers' event loop:
+    a send from a plain background thread (job workers, periodic tasks) on a
+    private loop would not wake the consumers until something else does. So
+    run on the server loop when there is one and this is not its thread.
+    """
+    loop = _server_loop
+    try:
+        current = asyncio.get_running_loop()
+    except RuntimeError:
+        current = None
+    if loop is not None and loop.is_running() and current is not loop:
+        return asyncio.run_coroutine_threadsafe(coroutine_function(*args), loop).result()
+    return async_to_sync(coroutine_function)(*args)
+
+
+def _group_send(group, message):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    run_on_server_loop(timed_group_send, channel_layer, group, message)
+
+
+def notify_user_settings_changed(user_id):
+    """Ask the user's connections to push their current effective settings."""
+    _group_send(user_group(user_id), {'type': 'settings_refresh'})
+
+
+def notify_users_settings_changed(user_ids):
+    """Send one refresh message per affected user, all from a single event loop hop."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not user_ids:
+        return
+
+    async def send_all():
+        for user_id in user_ids:
+            await timed_group_send(channel_layer, user_group(user_id), {'type': 'settings_refresh'})
+
+    run_on_server_loop(send_all)
+
+
+def notify_policy_changed(policy_id):
+    """Ask every connection using the policy to push its new effective settings."""
+    _group_send(policy_group(policy_id), {'type': 'settings_refresh', 'policy_id': policy_id})
+
+
+def notify_script_result(user_id, job):
+    """Push a finished script job to the connections of the user who started it."""
+    _group_send(user_group(user_id), {'type': 'script_result', 'job': job})
+
+
+def notify_script_output(user_id, job_id, frames):
+    """Push new output of a running streaming script job to the user who started it."""
+    _group_send(user_group(user_id), {'type': 'script_output', 'job_id': job_id, 'frames': frames})
@@ -0,0 +1,127 @@
+"""
+Keyset pagination and list filters for the device list endpoints.
+
+Pages are ordered by (timestamp, user_id) and a cursor holds the last row's
+key, so fetching the next page is an index range scan no matter how deep
+the client has scrolled (unlike OFFSET, which rereads every skipped row).
+Requests without 'limit' or 'cursor' get the whole list in one response,
+as they did before the endpoints were paginated.
+"""
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(timestamp, user_id):
+    raw = json.dumps([timestamp.isoformat(), user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Raises:
+        ValueError: If the cursor was not produced by encode_cursor
+    """
+    try:
+        timestamp, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = parse_datetime(timestamp)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if timestamp is None or not isinstance(user_id, str):
+        raise ValueError("Invalid cursor")
+    return timestamp, user_id
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("'limit' must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def parse_fields(value, allowed):
+    """Parse a comma separated field selection; user_id is always included."""
+    if not value:
+        return list(allowed)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return list(dict.fromkeys(['user_id', *fields]))
+
+
+def parse_since(value):
+    if not value:
+        return None
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError("'updated_since' must be an ISO 8601 datetime")
+    return since
+
+
+def _page_query(queryset, order_field, params, allowed_fields):
+    """Build the query for one page; returns (queryset, limit or None for the whole list, fields)."""
+    paged = params.get('limit') not in (None, '') or bool(params.get('cursor'))
+    limit = parse_limit(params.get('limit')) if paged else None
+    fields = parse_fields(params.get('fields'), allowed_fields)
+
+    cursor = params.get('cursor')
+    if cursor:
+        timestamp, user_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{order_field}__gt': timestamp}) | Q(**{order_field: timestamp, 'user_id__gt': user_id})
+        )
+
+    columns = dict.fromkeys([*fields, order_field])
+    query = queryset.order_by(order_field, 'user_id').values(*columns)
+    if limit is not None:
+        # Fetch one extra row to know whether there is a next page
+        query = query[:limit + 1]
+    return query, limit, fields
+
+
+def _page_result(rows, order_field, limit, fields):
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][order_field], rows[-1]['user_id'])
+    if order_field not in fields:
+        for row in rows:
+            del row[order_field]
+    return rows, next_cursor
+
+
+def paginate(queryset, order_field, params, allowed_fields):
+    """
+    Return one page of a queryset ordered by (order_field, user_id), or all
+    of it if params have neither limit nor cursor.
+
+    Args:
+        queryset: Already filtered queryset
+        order_field (str): Timestamp column the pages are ordered by
+        params: Query parameters (cursor, limit, fields)
+        allowed_fields (tuple): Fields a client may select
+
+    Returns:
+        tuple: (list of row dicts, next cursor or None)
+
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    query, limit, fields = _page_query(queryset, order_field, params, allowed_fields)
+    return _page_result(list(query), order_field, limit, fields)
+
+
+async def apaginate(queryset, order_field, params, allowed_fields):
+    """Async version of paginate() for async views."""
+    query, limit, fields = _page_query(queryset, order_field, params, allowed_fields)
+    return _page_result([row async for row in query], order_field, limit, fields)
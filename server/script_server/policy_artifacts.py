@@ -0,0 +1,126 @@
+"""
+Effective settings compiled once for client proxies.
+
+Every proxy used to turn the same JSON settings into keyword regexes itself,
+once per page it checked. Users sharing a policy get identical settings, so
+the server compiles them once into an artifact and every proxy downloads the
+result:
+
+    b'EFPA' | format version (1 byte) | SHA-256 of body (32 bytes) | body
+
+The body is zlib-compressed JSON with the site lists and a single regex over
+all category keywords, with one named group per category (c0, c1, ...).
+Regex objects cannot be shipped between Python processes, so proxies still
+call re.compile on it, but only once per artifact.
+
+Artifacts are addressed by the hex SHA-256 of their body (the artifact ID),
+so a given URL always returns the same bytes and can be cached forever.
+"""
+import hashlib
+import json
+import re
+import zlib
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.urls import reverse
+from django.utils import timezone
+from . import metrics
+from .models import PolicyArtifact
+
+MAGIC = b'EFPA'
+FORMAT_VERSION = 1
+
+# Settings digest -> artifact ID; both are immutable, so this never goes stale
+ARTIFACT_CACHE_TIMEOUT = 60 * 60
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def source_digest(effective):
+    """Digest of the settings an artifact is compiled from, including the format version."""
+    source = {field: effective.get(field) for field in ('blocked_sites', 'excluded_sites', 'categories')}
+    return hashlib.sha256(bytes([FORMAT_VERSION]) + _canonical(source)).hexdigest()
+
+
+def compile_policy(effective):
+    """
+    Compile effective settings into the artifact body.
+
+    Each category matches like the proxy always did: any keyword as a whole
+    word, ignoring case. Empty keywords and categories without keywords are
+    left out.
+    """
+    categories = []
+    groups = []
+    for category, keywords in (effective.get('categories') or {}).items():
+        keywords = [keyword for keyword in dict.fromkeys(keywords or []) if keyword]
+        if not keywords:
+            continue
+        groups.append(rf"(?P<c{len(categories)}>\b(?:{'|'.join(map(re.escape, keywords))})\b)")
+        categories.append(category)
+    return {
+        'format': FORMAT_VERSION,
+        'blocked_sites': list(dict.fromkeys(effective.get('blocked_sites') or [])),
+        'excluded_sites': list(dict.fromkeys(effective.get('excluded_sites') or [])),
+        'categories': categories,
+        'content_pattern': '|'.join(groups) or None,
+    }
+
+
+def pack(compiled):
+    """Return (artifact ID, artifact bytes) for a compiled policy."""
+    body = zlib.compress(_canonical(compiled), 9)
+    digest = hashlib.sha256(body)
+    return digest.hexdigest(), MAGIC + bytes([FORMAT_VERSION]) + digest.digest() + body
+
+
+def get_artifact_id(effective):
+    """
+    ID of the artifact for these effective settings, compiling and storing it
+    the first time any user has them.
+    """
+    digest = source_digest(effective)
+    cache_key = f"policy-artifact-source:{digest}"
+    artifact_id = cache.get(cache_key)
+    if artifact_id is None:
+        today = timezone.localdate()
+        stored = PolicyArtifact.objects.filter(source_digest=digest).values_list('artifact_id', 'used_on').first()
+        if stored is not None:
+            artifact_id, used_on = stored
+            # Cache misses happen about once per ARTIFACT_CACHE_TIMEOUT, which keeps this write rare
+            if used_on < today:
+                PolicyArtifact.objects.filter(artifact_id=artifact_id).update(used_on=today)
+    if artifact_id is None:
+        artifact_id, data = pack(compile_policy(effective))
+        metrics.policy_artifact_compiles.inc()
+        try:
+            PolicyArtifact.objects.get_or_create(
+                artifact_id=artifact_id, defaults={'source_digest': digest, 'data': data}
+            )
+        except IntegrityError:
+            # Another process stored it first
+            artifact_id = PolicyArtifact.objects.values_list('artifact_id', flat=True).get(source_digest=digest)
+    cache.set(cache_key, artifact_id, ARTIFACT_CACHE_TIMEOUT)
+    return artifact_id
+
+
+def artifact_info(effective):
+    """The 'artifact' entry of a settings response: its ID and download URL."""
+    artifact_id = get_artifact_id(effective)
+    return {'id': artifact_id, 'url': reverse('policy_artifact', args=[artifact_id])}
+
+
+def get_artifact(artifact_id):
+    """Artifact bytes, or None if there is no such artifact."""
+    cache_key = f"policy-artifact:{artifact_id}"
+    data = cache.get(cache_key)
+    if data is None:
+        data = PolicyArtifact.objects.filter(artifact_id=artifact_id).values_list('data', flat=True).first()
+        if data is None:
+            return None
+        data = bytes(data)
+        cache.set(cache_key, data, ARTIFACT_CACHE_TIMEOUT)
+    return data
+
@@ -0,0 +1,134 @@
+from django.core.cache import cache
+from django.db import transaction
+from .models import Policy, UserSettings
+from .settings_utils import build_patch_updates, versioned_update, get_user_settings
+
+# Resolved policy sets are immutable per (policy, version) key, so they can be cached for long
+POLICY_CACHE_TIMEOUT = 60 * 60
+
+SETTINGS_FIELDS = ('blocked_sites', 'excluded_sites', 'categories')
+
+
+def _as_settings(source):
+    """Return the settings fields of a model instance or dict as a dict."""
+    if isinstance(source, dict):
+        return source
+    return {field: getattr(source, field) for field in SETTINGS_FIELDS}
+
+
+def merge_settings(sources):
+    """
+    Merge settings in order: site lists and category keywords are unioned,
+    keeping the first occurrence of every entry.
+    """
+    blocked_sites = {}
+    excluded_sites = {}
+    categories = {}
+    for source in map(_as_settings, sources):
+        blocked_sites.update(dict.fromkeys(source.get('blocked_sites') or []))
+        excluded_sites.update(dict.fromkeys(source.get('excluded_sites') or []))
+        for category, keywords in (source.get('categories') or {}).items():
+            categories.setdefault(category, {}).update(dict.fromkeys(keywords or []))
+    return {
+        'blocked_sites': list(blocked_sites),
+        'excluded_sites': list(excluded_sites),
+        'categories': {category: list(keywords) for category, keywords in categories.items()},
+    }
+
+
+def policy_set_key(policies):
+    """Identify a set of policies at their current versions, e.g. '1v3-4v1'."""
+    return '-'.join(f"{policy.id}v{policy.version}" for policy in sorted(policies, key=lambda p: p.id)) or 'none'
+
+
+def resolve_policies(policies):
+    """Merge a set of policies, computing each (policy set, version) combination only once."""
+    cache_key = f"policy-set:{policy_set_key(policies)}"
+    merged = cache.get(cache_key)
+    if merged is None:
+        merged = merge_settings(sorted(policies, key=lambda p: p.id))
+        cache.set(cache_key, merged, POLICY_CACHE_TIMEOUT)
+    return merged
+
+
+def get_effective_settings(user_settings):
+    """
+    Resolve what a user is actually filtered by: their policies plus their own overrides.
+
+    Returns:
+        dict: blocked_sites, excluded_sites, categories and a settings_version
+              string that changes whenever any of the inputs change
+    """
+    policies = list(user_settings.policies.all())
+    effective = resolve_policies(policies)
+    overrides = _as_settings(user_settings)
+    if any(overrides.values()):
+        effective = merge_settings([effective, overrides])
+    return {
+        **effective,
+        'settings_version': f"{user_settings.version}.{policy_set_key(policies)}",
+    }
+
+
+def get_user_policy_ids(user_id):
+    """IDs of the policies a user references (empty if the user has no settings yet)."""
+    return list(Policy.objects.filter(users__user_id=user_id).values_list('id', flat=True))
+
+
+def set_user_policies(user_id, policy_ids):
+    """
+    Replace the set of policies a user references.
+
+    Raises:
+        Policy.DoesNotExist: If any of the IDs is unknown
+    """
+    policies = list(Policy.objects.filter(pk__in=policy_ids))
+    if len(policies) != len(set(policy_ids)):
+        raise Policy.DoesNotExist("Unknown policy ID")
+    user_settings = get_user_settings(user_id)
+    with transaction.atomic():
+        user_settings.policies.set(policies)
+        # Bump the version so cached effective settings and clients see the change
+        versioned_update(UserSettings.objects.filter(pk=user_settings.pk), {})
+    return policies
+
+
+def policy_to_dict(policy):
+    """Serialize a policy for the API."""
+    return {
+        'id': policy.id,
+        'name': policy.name,
+        'blocked_sites': policy.blocked_sites,
+        'excluded_sites': policy.excluded_sites,
+        'categories': policy.categories,
+        'version': policy.version,
+        'user_count': getattr(policy, 'user_count', None),
+    }
+
+
+def create_policy(name, blocked_sites=None, excluded_sites=None, categories=None):
+    """Create a new shared policy."""
+    return Policy.objects.create(
+        name=name,
+        blocked_sites=blocked_sites or [],
+        excluded_sites=excluded_sites or [],
+        categories=categories or {},
+    )
+
+
+def patch_policy(policy_id, changes, expected_version=None):
+    """
+    Apply an incremental change (same format as user settings patches) to a policy.
+
+    Returns:
+        int: The new policy version
+
+    Raises:
+        Policy.DoesNotExist: If the policy does not exist
+        SettingsVersionConflict: If expected_version is stale
+        ValueError: If the patch document is malformed
+    """
+    version = versioned_update(Policy.objects.filter(pk=policy_id), build_patch_updates(changes), expected_version)
+    if version is None:
+        raise Policy.DoesNotExist(f"Policy {policy_id} not found")
+    return version
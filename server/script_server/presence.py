@@ -0,0 +1,98 @@
+"""
+Presence registry for connected clients.
+
+StatusConsumer counts each user's WebSocket connections in the user_status
+table, which all server workers share, and keeps last_heartbeat fresh from
+ping/pong. Admin connections join ADMIN_GROUP and receive one 'presence'
+event per join/leave instead of polling for the full list.
+"""
+import logging
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+from .background import PeriodicTask
+from .models import UserIP, UserStatus
+from .notifications import run_on_server_loop, timed_group_send
+
+logger = logging.getLogger(__name__)
+
+ADMIN_GROUP = 'admins'
+
+
+def presence_event(user_id, status, address=None):
+    """Build the message admins receive when a user comes online or goes offline."""
+    address = address or {}
+    return {
+        'type': 'presence',
+        'user_id': user_id,
+        'status': status,
+        'ip_address': address.get('ip_address'),
+        'port': address.get('port'),
+        'timestamp': timezone.now().isoformat(),
+    }
+
+
+def _address(user_id):
+    return UserIP.objects.filter(user_id=user_id).values('ip_address', 'port').first()
+
+
+def user_connected(user_id):
+    """Register a WebSocket connection; returns the join event if this is the user's first one."""
+    if UserStatus.connect(user_id) == 1:
+        return presence_event(user_id, 'online', _address(user_id))
+    return None
+
+
+def user_disconnected(user_id):
+    """Unregister a WebSocket connection; returns the leave event if it was the user's last one."""
+    if UserStatus.disconnect(user_id) == 0:
+        return presence_event(user_id, 'offline')
+    return None
+
+
+def get_presence_snapshot():
+    """All online users with their registered addresses, in two queries."""
+    statuses = list(
+        UserStatus.online_users(settings.ONLINE_TIMEOUT_SECONDS)
+        .order_by('user_id')
+        .values('user_id', 'last_heartbeat')
+    )
+    addresses = {
+        row['user_id']: row
+        for row in UserIP.objects.filter(user_id__in=[status['user_id'] for status in statuses])
+        .values('user_id', 'ip_address', 'port')
+    }
+    return [
+        {
+            'user_id': status['user_id'],
+            'last_heartbeat': status['last_heartbeat'].isoformat(),
+            'ip_address': addresses.get(status['user_id'], {}).get('ip_address'),
+            'port': addresses.get(status['user_id'], {}).get('port'),
+        }
+        for status in statuses
+    ]
+
+
+def publish_presence(events):
+    """Send presence events to admins from synchronous code."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not events:
+        return
+
+    async def send_all():
+        for event in events:
+            await timed_group_send(channel_layer, ADMIN_GROUP, {'type': 'presence_update', 'message': event})
+
+    run_on_server_loop(send_all)
+
+
+def sweep_offline_users():
+    """Persist is_online = false for users whose heartbeat is older than ONLINE_TIMEOUT_SECONDS and tell admins."""
+    user_ids = UserStatus.mark_offline_inactive_users(timeout_minutes=settings.ONLINE_TIMEOUT_SECONDS / 60)
+    if user_ids:
+        logger.info("Presence sweep marked %d users offline", len(user_ids))
+        publish_presence([presence_event(user_id, 'offline') for user_id in user_ids])
+    return user_ids
+
+
+presence_sweeper = PeriodicTask('presence-sweep', settings.PRESENCE_SWEEP_INTERVAL, sweep_offline_users)
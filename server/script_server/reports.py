@@ -0,0 +1,121 @@
+"""
+Filtering activity reports for the admin dashboard.
+
+Reports only read the rollup tables maintained on ingest (see events.py),
+so their cost depends on the number of users, hosts and hours in the range,
+not on the number of raw events.
+"""
+from datetime import timedelta, timezone as dt_timezone
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .events import ACTIONS
+from .models import DomainDaily, UserCategoryHourly, UserSettings
+
+DEFAULT_RANGE_DAYS = 7
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 500
+
+
+def _parse_time(params, name, default):
+    value = params.get(name)
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"'{name}' must be an ISO 8601 datetime")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+def parse_report_params(params):
+    """
+    Parse the parameters shared by all reports.
+
+    Query parameters: since, until (ISO 8601, default the last 7 days),
+    action (blocked or allowed, default blocked), limit
+
+    Returns:
+        dict: since, until, action and limit
+
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    until = _parse_time(params, 'until', timezone.now())
+    since = _parse_time(params, 'since', until - timedelta(days=DEFAULT_RANGE_DAYS))
+    if since >= until:
+        raise ValueError("'since' must be before 'until'")
+    action = params.get('action') or 'blocked'
+    if action not in ACTIONS:
+        raise ValueError(f"'action' must be one of: {', '.join(ACTIONS)}")
+    try:
+        limit = int(params.get('limit') or DEFAULT_LIMIT)
+    except ValueError:
+        raise ValueError("'limit' must be an integer")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"'limit' must be between 1 and {MAX_LIMIT}")
+    return {'since': since, 'until': until, 'action': action, 'limit': limit}
+
+
+def _user_rollups(params, options):
+    """Hourly rollup rows in the range, narrowed to a user, a class (policy) or a user ID prefix."""
+    # Hour buckets are counted if they start inside the range
+    queryset = UserCategoryHourly.objects.filter(
+        hour__gte=options['since'], hour__lt=options['until'], action=options['action']
+    )
+    if params.get('user_id'):
+        queryset = queryset.filter(user_id=params['user_id'])
+    if params.get('user_id_prefix'):
+        queryset = queryset.filter(user_id__startswith=params['user_id_prefix'])
+    if params.get('policy_id'):
+        try:
+            policy_id = int(params['policy_id'])
+        except ValueError:
+            raise ValueError("'policy_id' must be an integer")
+        queryset = queryset.filter(
+            user_id__in=UserSettings.objects.filter(policies__id=policy_id).values('user_id')
+        )
+    return queryset
+
+
+def _first_day_from(moment):
+    """The first (UTC) day starting at or after moment."""
+    moment = moment.astimezone(dt_timezone.utc)
+    day = moment.date()
+    return day if moment == moment.replace(hour=0, minute=0, second=0, microsecond=0) else day + timedelta(days=1)
+
+
+def _top(queryset, field, limit):
+    rows = queryset.values(field).annotate(count=Sum('count')).order_by('-count', field)[:limit]
+    return [{field: row[field], 'count': row['count']} for row in rows]
+
+
+def top_categories(params):
+    """
+    Event counts per category, largest first. Blocked sites and allowed
+    pages have no category and are reported as category null.
+    """
+    options = parse_report_params(params)
+    results = _top(_user_rollups(params, options), 'category', options['limit'])
+    for row in results:
+        row['category'] = row['category'] or None
+    return options, results
+
+
+def top_users(params):
+    """Event counts per user, largest first."""
+    options = parse_report_params(params)
+    return options, _top(_user_rollups(params, options), 'user_id', options['limit'])
+
+
+def top_domains(params):
+    """
+    Event counts per host over all users, largest first. Days are counted
+    if they start inside the range.
+    """
+    options = parse_report_params(params)
+    queryset = DomainDaily.objects.filter(
+        day__gte=_first_day_from(options['since']),
+        day__lt=_first_day_from(options['until']),
+        action=options['action'],
+    )
+    return options, _top(queryset, 'host', options['limit'])
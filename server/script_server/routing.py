@@ -1,6 +1,48 @@
+from django.conf import settings
 from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/status/$', consumers.StatusConsumer.as_asgi()),
 ]
+
+
+def _accept_deflate(offers):
+    from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            # No context takeover: zlib state is dropped after each message instead of holding
+            # about 256 KB per idle connection; settings frames compress well on their own
+            return PerMessageDeflateOfferAccept(
+                offer, request_no_context_takeover=offer.accept_no_context_takeover, no_context_takeover=True
+            )
+    return None
+
+
+def enable_permessage_deflate():
+    """
+    Negotiate permessage-deflate (RFC 7692) with WebSocket clients that offer it.
+
+    Compression is done by the server, not the consumers, and daphne has no
+    option for it: replace its WebSocket factory with one that accepts the
+    offer. Must run before daphne starts listening, i.e. when the ASGI
+    application is imported. Does nothing under other servers.
+    """
+    if not settings.WS_PERMESSAGE_DEFLATE:
+        return
+    try:
+        from daphne import server
+        from daphne.ws_protocol import WebSocketFactory
+    except ImportError:
+        return
+    if getattr(server.WebSocketFactory, 'permessage_deflate', False):
+        return
+
+    class DeflateWebSocketFactory(WebSocketFactory):
+        permessage_deflate = True
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.setProtocolOptions(perMessageCompressionAccept=_accept_deflate)
+
+    server.WebSocketFactory = DeflateWebSocketFactory
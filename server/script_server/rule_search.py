@@ -0,0 +1,129 @@
+"""
+Reverse lookups over filtering rules: which policies and users block or
+exclude a site, or filter on a keyword.
+
+User overrides are searched through the GIN indexes on user_settings, and
+users inheriting a rule from a policy through the policy membership table,
+so a search reads only matching rows however many users there are.
+Policies are few and are scanned directly.
+"""
+import json
+from django.db.models import BooleanField, Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from .models import Policy, UserSettings
+from .pagination import parse_limit
+
+SITE_FIELDS = ('blocked_sites', 'excluded_sites')
+FIELDS = (*SITE_FIELDS, 'categories')
+MATCHES = ('domain', 'exact')
+
+
+def parse_search_params(params):
+    """
+    Parse and validate search parameters.
+
+    Query parameters: field (blocked_sites, excluded_sites or categories), q
+    (a site or a keyword), category (optional, narrows a keyword search),
+    match (domain or exact, for sites), limit, after (last user_id of the
+    previous page)
+
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    field = params.get('field') or 'blocked_sites'
+    if field not in FIELDS:
+        raise ValueError(f"'field' must be one of: {', '.join(FIELDS)}")
+    query = (params.get('q') or '').strip()
+    if not query:
+        raise ValueError("'q' is required")
+    match = params.get('match') or 'domain'
+    if match not in MATCHES:
+        raise ValueError(f"'match' must be one of: {', '.join(MATCHES)}")
+    return {
+        'field': field,
+        'q': query,
+        'category': params.get('category') or None,
+        'match': match,
+        'limit': parse_limit(params.get('limit')),
+        'after': params.get('after') or None,
+    }
+
+
+def domain_candidates(host):
+    """
+    Site entries that apply to host: the host itself and its parent domains,
+    e.g. m.youtube.com -> m.youtube.com, youtube.com, com.
+    """
+    labels = host.lower().strip('.').split('.')
+    return ['.'.join(labels[i:]) for i in range(len(labels))]
+
+
+def _rule_filter(model, options):
+    """Condition on the model's own rule columns (a policy's rules or a user's overrides)."""
+    field = options['field']
+    if field in SITE_FIELDS:
+        if options['match'] == 'exact':
+            return Q(**{f'{field}__contains': [options['q']]})
+        return Q(**{f'{field}__overlap': domain_candidates(options['q'])})
+    if options['category']:
+        return Q(categories__contains={options['category']: [options['q']]})
+    # Any category: jsonpath existence (@?), answered by the jsonb_ops GIN index
+    path = f'$.*[*] ? (@ == {json.dumps(options["q"])})'
+    return Q(RawSQL(f'"{model._meta.db_table}"."categories" @? %s::jsonpath', (path,), output_field=BooleanField()))
+
+
+def search_rules(params):
+    """
+    Policies and users a rule applies to.
+
+    Users are listed by user_id, a page at a time, with whether they have the
+    rule as their own override and which of the matching policies they have.
+
+    Returns:
+        tuple: (options, result dict with policies, users and next_after)
+    """
+    options = parse_search_params(params)
+    policies = list(
+        Policy.objects.filter(_rule_filter(Policy, options))
+        .order_by('name')
+        .values('id', 'name', 'version')
+    )
+    policy_ids = [policy['id'] for policy in policies]
+
+    # Two branches, each cut to one page before they are merged
+    page_size = options['limit'] + 1
+    after = Q(user_id__gt=options['after']) if options['after'] else Q()
+    branches = UserSettings.objects.filter(_rule_filter(UserSettings, options), after)
+    # Same order as user_id, but no index provides it: otherwise, for rare rules and small pages, the
+    # planner walks the user_id index filtering every row instead of using the GIN index
+    unindexed_order = RawSQL(f'"{UserSettings._meta.db_table}"."user_id" || \'\'', ())
+    branches = branches.order_by(unindexed_order).values_list('user_id', flat=True)[:page_size]
+    if policy_ids:
+        # EXISTS rather than a join: no duplicates to remove, so the user_id order comes from the index
+        membership = UserSettings.policies.through.objects.filter(usersettings_id=OuterRef('pk'), policy_id__in=policy_ids)
+        by_policy = UserSettings.objects.filter(after, Exists(membership))
+        branches = branches.union(by_policy.order_by('user_id').values_list('user_id', flat=True)[:page_size])
+    user_ids = list(branches.order_by('user_id')[:page_size]) if policy_ids else list(branches)
+    has_more = len(user_ids) > options['limit']
+    user_ids = user_ids[:options['limit']]
+
+    overrides = set(
+        UserSettings.objects.filter(_rule_filter(UserSettings, options), user_id__in=user_ids)
+        .values_list('user_id', flat=True)
+    )
+    via_policies = {}
+    if policy_ids:
+        memberships = UserSettings.policies.through.objects.filter(
+            usersettings__user_id__in=user_ids, policy_id__in=policy_ids
+        ).values_list('usersettings__user_id', 'policy_id')
+        for user_id, policy_id in memberships:
+            via_policies.setdefault(user_id, []).append(policy_id)
+
+    return options, {
+        'policies': policies,
+        'users': [
+            {'user_id': user_id, 'override': user_id in overrides, 'policy_ids': sorted(via_policies.get(user_id, []))}
+            for user_id in user_ids
+        ],
+        'next_after': user_ids[-1] if has_more else None,
+    }
@@ -52,6 +52,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so latency covers the whole middleware stack
+    'script_server.middleware.MetricsMiddleware',
+    # Inside MetricsMiddleware, whose query counts tell it whether a request used the database
+    'script_server.middleware.ReleaseConnectionsMiddleware',
+    # Before anything that reads or changes the response body
+    'script_server.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,15 +94,37 @@ ASGI_APPLICATION = 'script_server.asgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # Pooled PostgreSQL backend (see script_server/db_pool); DB_POOL_ENABLED=false uses Django's plain backend
+        'ENGINE': 'script_server.db_pool' if os.getenv('DB_POOL_ENABLED', 'true').lower() == 'true' else 'django.db.backends.postgresql',
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Connections are returned to the pool at the end of each request instead of being kept per thread
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+            'check_interval': float(os.getenv('DB_POOL_CHECK_INTERVAL', '30')),
+        },
     }
 }
 
+# Optional read replica for lag-tolerant reads (device lists, settings GETs), see script_server/db_router.py
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['script_server.db_router.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -141,6 +169,137 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Seconds heartbeats are buffered in memory before being written in one batch (0 writes every heartbeat)
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv('HEARTBEAT_FLUSH_INTERVAL', '5'))
+
+# Users without a heartbeat for this many seconds are reported as offline
+ONLINE_TIMEOUT_SECONDS = float(os.getenv('ONLINE_TIMEOUT_SECONDS', '10'))
+
+# Seconds between background sweeps persisting is_online = false (0 disables the sweeper)
+PRESENCE_SWEEP_INTERVAL = float(os.getenv('PRESENCE_SWEEP_INTERVAL', '5'))
+
+# Admission control against reconnect storms (script_server/admission.py): token buckets written 'rate/burst'
+# (requests per second, and requests allowed at once), per client (bearer token; address for WebSockets) and,
+# with _GLOBAL, over all clients of a server process. Requests over a limit get 429 with Retry-After, WebSocket
+# connections a 'retry_later' message and close code 4029. An empty value disables a limit.
+ADMISSION_REGISTER_IP = os.getenv('ADMISSION_REGISTER_IP', '0.2/3')
+ADMISSION_REGISTER_IP_GLOBAL = os.getenv('ADMISSION_REGISTER_IP_GLOBAL', '100/300')
+ADMISSION_USER_SETTINGS = os.getenv('ADMISSION_USER_SETTINGS', '1/10')
+ADMISSION_USER_SETTINGS_GLOBAL = os.getenv('ADMISSION_USER_SETTINGS_GLOBAL', '200/500')
+# Per address: clients behind one NAT share it
+ADMISSION_WS_CONNECT = os.getenv('ADMISSION_WS_CONNECT', '5/100')
+ADMISSION_WS_CONNECT_GLOBAL = os.getenv('ADMISSION_WS_CONNECT_GLOBAL', '100/300')
+# Clients tracked per limit; the least recently seen are forgotten first
+ADMISSION_MAX_CLIENTS = int(os.getenv('ADMISSION_MAX_CLIENTS', '10000'))
+# WebSocket connections still registering (from accept to their first user_status or admin_connect message,
+# for at most WS_HANDSHAKE_TIMEOUT seconds) at once; more are turned away like rate limited ones (0 = no limit)
+WS_MAX_CONCURRENT_HANDSHAKES = int(os.getenv('WS_MAX_CONCURRENT_HANDSHAKES', '200'))
+WS_HANDSHAKE_TIMEOUT = float(os.getenv('WS_HANDSHAKE_TIMEOUT', '10'))
+
+# WebSocket compression: permessage-deflate for clients that offer it (when served by daphne), and the zlib level of
+# settings pushes sent as binary frames to clients that ask for them instead (user_gui.py)
+WS_PERMESSAGE_DEFLATE = os.getenv('WS_PERMESSAGE_DEFLATE', 'true').lower() == 'true'
+WS_FRAME_COMPRESSION_LEVEL = int(os.getenv('WS_FRAME_COMPRESSION_LEVEL', '6'))
+
+# Seconds between server pings on user WebSocket connections; each pong refreshes the user's heartbeat.
+# Keep PING + HEARTBEAT_FLUSH intervals below ONLINE_TIMEOUT_SECONDS.
+WS_PING_INTERVAL = float(os.getenv('WS_PING_INTERVAL', '3'))
+
+# Requests slower than this many seconds are logged with their SQL (0 disables the slow request log)
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', '0'))
+
+# Script execution (/api/execute/): jobs run in background worker threads, each in its own process
+SCRIPT_WORKERS = int(os.getenv('SCRIPT_WORKERS', '2'))
+# Jobs allowed to wait for a worker; further submissions are rejected with 503
+SCRIPT_QUEUE_SIZE = int(os.getenv('SCRIPT_QUEUE_SIZE', '20'))
+# Wall-clock seconds before a running script is killed
+SCRIPT_TIMEOUT = float(os.getenv('SCRIPT_TIMEOUT', '30'))
+# CPU seconds and address space (MB) limits of a script process (0 = no limit; not enforced on Windows)
+SCRIPT_CPU_SECONDS = int(os.getenv('SCRIPT_CPU_SECONDS', '30'))
+SCRIPT_MEMORY_MB = int(os.getenv('SCRIPT_MEMORY_MB', '512'))
+# Seconds finished jobs are kept for polling
+SCRIPT_RESULT_TTL = float(os.getenv('SCRIPT_RESULT_TTL', '600'))
+# Output kept per job (bytes); more is dropped and the job is marked truncated (0 = no cap)
+SCRIPT_MAX_OUTPUT_BYTES = int(os.getenv('SCRIPT_MAX_OUTPUT_BYTES', str(1024 * 1024)))
+# Seconds between pushes of new output for streaming jobs (WebSocket and /api/execute/<id>/stream/)
+SCRIPT_STREAM_INTERVAL = float(os.getenv('SCRIPT_STREAM_INTERVAL', '0.2'))
+# 'subprocess' starts a new interpreter per job; 'warm' forks jobs from pre-started interpreters (POSIX only)
+SCRIPT_BACKEND = os.getenv('SCRIPT_BACKEND', 'subprocess')
+# Warm backend: jobs per worker interpreter and its memory (MB) before it is replaced, modules it imports up front
+SCRIPT_WARM_MAX_RUNS = int(os.getenv('SCRIPT_WARM_MAX_RUNS', '200'))
+SCRIPT_WARM_MAX_RSS_MB = int(os.getenv('SCRIPT_WARM_MAX_RSS_MB', '200'))
+SCRIPT_PRELOAD = [name.strip() for name in os.getenv('SCRIPT_PRELOAD', 'json,re,datetime,pathlib').split(',') if name.strip()]
+
+# Block events uploaded by client proxies (/api/events/batch/): days kept before their partition is dropped
+EVENT_RETENTION_DAYS = int(os.getenv('EVENT_RETENTION_DAYS', '30'))
+# Days the hourly/daily rollups behind /api/reports/ are kept
+EVENT_ROLLUP_RETENTION_DAYS = int(os.getenv('EVENT_ROLLUP_RETENTION_DAYS', '365'))
+# Daily partitions created ahead of time, and seconds between partition maintenance runs (0 disables it)
+EVENT_PARTITIONS_AHEAD = int(os.getenv('EVENT_PARTITIONS_AHEAD', '3'))
+EVENT_PARTITION_MAINTENANCE_INTERVAL = float(os.getenv('EVENT_PARTITION_MAINTENANCE_INTERVAL', '3600'))
+# Largest accepted batch, in events and in (decompressed) bytes; larger batches are rejected with 413
+EVENT_BATCH_MAX_EVENTS = int(os.getenv('EVENT_BATCH_MAX_EVENTS', '5000'))
+EVENT_BATCH_MAX_BYTES = int(os.getenv('EVENT_BATCH_MAX_BYTES', str(4 * 1024 * 1024)))
+
+# Days a compiled policy artifact is kept after the last settings request that used it
+POLICY_ARTIFACT_RETENTION_DAYS = int(os.getenv('POLICY_ARTIFACT_RETENTION_DAYS', '30'))
+
+# Background maintenance (script_server/maintenance.py): seconds between runs of each cleanup job (0 disables them),
+# rows deleted per statement, statements per run, and seconds of pause between statements
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '300'))
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', '1000'))
+MAINTENANCE_MAX_BATCHES = int(os.getenv('MAINTENANCE_MAX_BATCHES', '100'))
+MAINTENANCE_BATCH_PAUSE = float(os.getenv('MAINTENANCE_BATCH_PAUSE', '0.1'))
+# Days a device's registered address and offline status are kept after it was last seen (0 keeps them forever)
+DEVICE_RETENTION_DAYS = int(os.getenv('DEVICE_RETENTION_DAYS', '90'))
+
+# Fleet view of client proxy telemetry (/fleet/): devices kept, seconds of history per device,
+# and the minimum seconds between a device's snapshots (sooner ones are dropped)
+TELEMETRY_MAX_DEVICES = int(os.getenv('TELEMETRY_MAX_DEVICES', '5000'))
+TELEMETRY_WINDOW_SECONDS = float(os.getenv('TELEMETRY_WINDOW_SECONDS', '300'))
+TELEMETRY_MIN_INTERVAL = float(os.getenv('TELEMETRY_MIN_INTERVAL', '5'))
+# Seconds between fleet summaries pushed to subscribed admins (0 disables the pushes)
+FLEET_PUSH_INTERVAL = float(os.getenv('FLEET_PUSH_INTERVAL', '5'))
+
+# Logging: server logs are queued and written by a background thread (see script_server/logging_utils.py)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_JSON = os.getenv('LOG_JSON', 'false').lower() == 'true'
+
+# Share of per-message WebSocket log events that are kept (connects/disconnects and errors are always logged)
+WS_LOG_SAMPLE_RATE = float(os.getenv('WS_LOG_SAMPLE_RATE', '0.01'))
+
+# Include full WebSocket payloads and headers in DEBUG logs
+WS_LOG_PAYLOADS = os.getenv('WS_LOG_PAYLOADS', 'false').lower() == 'true'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'script_server.logging_utils.SamplingFilter',
+            'rates': {
+                'ws_message': WS_LOG_SAMPLE_RATE,
+                'ws_send': WS_LOG_SAMPLE_RATE,
+                'ws_settings_push': WS_LOG_SAMPLE_RATE,
+            },
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'script_server.logging_utils.QueueListenerHandler',
+            'json_lines': LOG_JSON,
+            'filters': ['sampling'],
+        },
+    },
+    'loggers': {
+        'script_server': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
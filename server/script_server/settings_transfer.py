@@ -0,0 +1,244 @@
+"""
+Bulk export and import of all policies and user settings as NDJSON.
+
+One JSON object per line, policies before the users that reference them:
+
+    {"type": "header", "format": 1, "exported_at": "...", "policies": 2, "users": 100000}
+    {"type": "policy", "name": "default", "blocked_sites": [...], "excluded_sites": [...], "categories": {...}}
+    {"type": "user", "user_id": "...", "blocked_sites": [...], ..., "policies": ["default"]}
+
+Users reference policies by name, so a file can be imported into another
+server. Both directions work a chunk at a time, so memory stays bounded
+however many users there are. The export reads users in user_id order with
+keyset queries instead of holding a cursor (and a pooled connection) open for
+the whole download; a user changed during the export is written as it was
+when its chunk was read.
+"""
+import json
+from django.db import connection, transaction
+from django.utils import timezone
+from .batch_utils import validate_settings
+from .models import Policy, UserSettings
+from .notifications import notify_policy_changed, notify_users_settings_changed
+from .settings_utils import SITE_LISTS, validate_string_list
+
+FORMAT_VERSION = 1
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 1000
+MAX_LINE_BYTES = 1024 * 1024
+# Errors listed in the import progress; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+SETTINGS_COLUMNS = (*SITE_LISTS, 'categories')
+Membership = UserSettings.policies.through
+
+
+def _line(document):
+    return json.dumps(document, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+def export_chunks(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the export as text chunks of up to chunk_size lines each."""
+    policies = list(Policy.objects.order_by('id').values('id', 'name', *SETTINGS_COLUMNS, 'version'))
+    policy_names = {policy.pop('id'): policy['name'] for policy in policies}
+    yield _line({
+        'type': 'header',
+        'format': FORMAT_VERSION,
+        'exported_at': timezone.now().isoformat(),
+        'policies': len(policies),
+        # For progress only: users created during the export are included too
+        'users': UserSettings.objects.count(),
+    }) + ''.join(_line({'type': 'policy', **policy}) for policy in policies)
+
+    last_user_id = None
+    while True:
+        queryset = UserSettings.objects.order_by('user_id')
+        if last_user_id is not None:
+            queryset = queryset.filter(user_id__gt=last_user_id)
+        rows = list(queryset.values('id', 'user_id', *SETTINGS_COLUMNS, 'version')[:chunk_size])
+        if not rows:
+            return
+        memberships = {}
+        for settings_id, policy_id in Membership.objects.filter(
+            usersettings_id__in=[row['id'] for row in rows]
+        ).order_by('policy_id').values_list('usersettings_id', 'policy_id'):
+            memberships.setdefault(settings_id, []).append(policy_names.get(policy_id))
+        yield ''.join(
+            _line({'type': 'user', **{k: v for k, v in row.items() if k != 'id'}, 'policies': memberships.get(row['id'], [])})
+            for row in rows
+        )
+        last_user_id = rows[-1]['user_id']
+
+
+def _read_lines(stream):
+    """Yield (line number, line bytes or None if too long) without reading more than MAX_LINE_BYTES at once."""
+    number = 0
+    while True:
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > MAX_LINE_BYTES and not line.endswith(b'\n'):
+            # Skip the rest of the line
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(MAX_LINE_BYTES)
+            yield number, None
+            continue
+        yield number, line
+
+
+class SettingsImporter:
+    """
+    Validate and upsert an NDJSON export, a batch at a time.
+
+    Users are created or have their overrides replaced; their policy
+    memberships are replaced if the line has a 'policies' list. Policies are
+    created or replaced by name. Invalid lines are skipped and reported, they
+    do not stop the import.
+
+    Args:
+        stream: Binary file-like object with the NDJSON lines
+        batch_size (int): Users written per transaction
+        dry_run (bool): Validate only
+    """
+
+    def __init__(self, stream, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.policy_ids = dict(Policy.objects.values_list('name', 'id'))
+        self.lines = 0
+        self.users = 0
+        self.policies = 0
+        self.error_count = 0
+        self.errors = []
+
+    def progress(self, kind='progress'):
+        return {
+            'type': kind,
+            'lines': self.lines,
+            'users': self.users,
+            'policies': self.policies,
+            'errors': self.error_count,
+        }
+
+    def _error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'message': message})
+
+    def run(self):
+        """Import everything, yielding a progress dict after every batch and a final 'done' dict."""
+        batch = []
+        for line_number, line in _read_lines(self.stream):
+            self.lines = line_number
+            if line is None:
+                self._error(line_number, f"Line longer than {MAX_LINE_BYTES} bytes")
+                continue
+            if not line.strip():
+                continue
+            try:
+                document = json.loads(line)
+                if not isinstance(document, dict):
+                    raise ValueError("Each line must be a JSON object")
+                kind = document.get('type')
+                if kind == 'user':
+                    batch.append(self._parse_user(document))
+                elif kind == 'policy':
+                    # Users after this line may reference the policy
+                    if batch:
+                        self._write_users(batch)
+                        batch = []
+                    self._write_policy(self._parse_policy(document))
+                elif kind == 'header':
+                    if document.get('format') != FORMAT_VERSION:
+                        raise ValueError(f"Unsupported export format: {document.get('format')!r}")
+                else:
+                    raise ValueError(f"Unknown line type: {kind!r}")
+            except ValueError as e:  # Includes JSON errors
+                self._error(line_number, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self._write_users(batch)
+                batch = []
+                yield self.progress()
+        if batch:
+            self._write_users(batch)
+        yield {**self.progress('done'), 'dry_run': self.dry_run, 'error_details': self.errors}
+
+    def _parse_user(self, document):
+        user_id = document.get('user_id')
+        if not isinstance(user_id, str) or not user_id or len(user_id) > 255:
+            raise ValueError("'user_id' must be a non-empty string of at most 255 characters")
+        fields = validate_settings({column: document.get(column) or ([] if column in SITE_LISTS else {})
+                                    for column in SETTINGS_COLUMNS}, user_id)
+        policy_ids = None
+        if 'policies' in document:
+            names = validate_string_list(document['policies'], f'{user_id}.policies')
+            unknown = [name for name in names if name not in self.policy_ids]
+            if unknown:
+                raise ValueError(f"Unknown policies: {', '.join(unknown)}")
+            policy_ids = [self.policy_ids[name] for name in names]
+        return user_id, fields, policy_ids
+
+    def _parse_policy(self, document):
+        name = document.get('name')
+        if not isinstance(name, str) or not name or len(name) > 255:
+            raise ValueError("'name' must be a non-empty string of at most 255 characters")
+        return name, validate_settings({column: document.get(column) or ([] if column in SITE_LISTS else {})
+                                        for column in SETTINGS_COLUMNS}, name)
+
+    def _write_policy(self, policy):
+        name, fields = policy
+        self.policies += 1
+        if self.dry_run:
+            self.policy_ids.setdefault(name, None)
+            return
+        with transaction.atomic():
+            policy, created = Policy.objects.select_for_update().get_or_create(name=name, defaults=fields)
+            if not created:
+                for field, value in fields.items():
+                    setattr(policy, field, value)
+                policy.version += 1
+                policy.save()
+        self.policy_ids[name] = policy.id
+        if not created:
+            notify_policy_changed(policy.id)
+
+    def _write_users(self, batch):
+        # A user listed twice in one batch: the last line wins
+        batch = list({user_id: (user_id, fields, policy_ids) for user_id, fields, policy_ids in batch}.values())
+        self.users += len(batch)
+        if self.dry_run:
+            return
+        now = timezone.now()
+        # Sorted, so concurrent imports lock rows in the same order
+        batch.sort(key=lambda item: item[0])
+        row = '(%s, %s::text[], %s::text[], %s::jsonb, 1, %s, %s)'
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {UserSettings._meta.db_table}
+                    (user_id, blocked_sites, excluded_sites, categories, version, created_at, updated_at)
+                VALUES {', '.join([row] * len(batch))}
+                ON CONFLICT (user_id) DO UPDATE SET
+                    blocked_sites = EXCLUDED.blocked_sites,
+                    excluded_sites = EXCLUDED.excluded_sites,
+                    categories = EXCLUDED.categories,
+                    version = {UserSettings._meta.db_table}.version + 1,
+                    updated_at = EXCLUDED.updated_at
+                RETURNING user_id, id
+                """,
+                [value for user_id, fields, _ in batch for value in (
+                    user_id, fields['blocked_sites'], fields['excluded_sites'], json.dumps(fields['categories']), now, now
+                )]
+            )
+            ids = dict(cursor.fetchall())
+            memberships = {ids[user_id]: policy_ids for user_id, _, policy_ids in batch if policy_ids is not None}
+            if memberships:
+                Membership.objects.filter(usersettings_id__in=list(memberships)).delete()
+                Membership.objects.bulk_create([
+                    Membership(usersettings_id=settings_id, policy_id=policy_id)
+                    for settings_id, policy_ids in memberships.items() for policy_id in policy_ids
+                ])
+        notify_users_settings_changed([user_id for user_id, _, _ in batch])
@@ -1,5 +1,168 @@
+from django.db import transaction
+from django.db.models import F, Func, TextField, JSONField, Value
+from django.contrib.postgres.fields import ArrayField
+from django.utils import timezone
 from .models import UserSettings
 
+SITE_LISTS = ('blocked_sites', 'excluded_sites')
+
+
+class SettingsVersionConflict(Exception):
+    """Raised when a conditional update finds that the settings were changed by someone else."""
+
+    def __init__(self, current_version):
+        super().__init__(f"Settings were modified concurrently (current version: {current_version})")
+        self.current_version = current_version
+
+
+class ArrayAppendMissing(Func):
+    """
+    SQL expression appending the values a TEXT[] column does not hold yet.
+
+    The new values keep their order and existing entries are left in place,
+    so adding an already present site is a no-op.
+    """
+    output_field = ArrayField(TextField())
+
+    def __init__(self, expression, values):
+        super().__init__(expression, Value(list(values), output_field=ArrayField(TextField())))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        array_sql, array_params = compiler.compile(self.source_expressions[0])
+        values_sql, values_params = compiler.compile(self.source_expressions[1])
+        sql = (
+            f"array_cat({array_sql}, ARRAY("
+            f"SELECT v FROM unnest({values_sql}::text[]) WITH ORDINALITY AS t(v, i) "
+            f"WHERE NOT v = ANY({array_sql}) ORDER BY i))"
+        )
+        return sql, (*array_params, *values_params, *array_params)
+
+
+def _array_remove(expression, values):
+    """Wrap expression in one array_remove() call per value."""
+    for value in values:
+        expression = Func(expression, Value(value), function='array_remove', output_field=ArrayField(TextField()))
+    return expression
+
+
+def _jsonb_set(expression, key, value):
+    """Set a single top-level key of a JSONB expression."""
+    return Func(
+        expression,
+        Value([key], output_field=ArrayField(TextField())),
+        Value(value, output_field=JSONField()),
+        function='jsonb_set',
+        output_field=JSONField(),
+    )
+
+
+def _jsonb_delete_keys(expression, keys):
+    """Remove top-level keys from a JSONB expression with the ``-`` operator."""
+    return Func(
+        expression,
+        Value(list(keys), output_field=ArrayField(TextField())),
+        template='(%(expressions)s::text[])',
+        arg_joiner=' - ',
+        output_field=JSONField(),
+    )
+
+
+def validate_string_list(value, name):
+    """Validate that value is a list of strings and drop duplicates, keeping order."""
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"'{name}' must be a list of strings")
+    return list(dict.fromkeys(value))
+
+
+def build_patch_updates(changes):
+    """
+    Translate a settings patch into column update expressions.
+
+    Args:
+        changes (dict): Patch document, e.g.
+            {
+                "blocked_sites": {"add": [...], "remove": [...]},
+                "excluded_sites": {"add": [...], "remove": [...]},
+                "categories": {"set": {"name": [keywords]}, "remove": [names]}
+            }
+
+    Returns:
+        dict: Column name -> SQL expression, suitable for QuerySet.update()
+
+    Raises:
+        ValueError: If the patch document is malformed
+    """
+    if not isinstance(changes, dict):
+        raise ValueError("Patch must be a JSON object")
+
+    updates = {}
+    for field in SITE_LISTS:
+        ops = changes.get(field)
+        if ops is None:
+            continue
+        if not isinstance(ops, dict):
+            raise ValueError(f"'{field}' must be an object with 'add' and/or 'remove' lists")
+        expression = F(field)
+        to_remove = validate_string_list(ops.get('remove', []), f'{field}.remove')
+        to_add = validate_string_list(ops.get('add', []), f'{field}.add')
+        if to_remove:
+            expression = _array_remove(expression, to_remove)
+        if to_add:
+            expression = ArrayAppendMissing(expression, to_add)
+        if to_remove or to_add:
+            updates[field] = expression
+
+    ops = changes.get('categories')
+    if ops is not None:
+        if not isinstance(ops, dict):
+            raise ValueError("'categories' must be an object with 'set' and/or 'remove'")
+        expression = F('categories')
+        to_remove = validate_string_list(ops.get('remove', []), 'categories.remove')
+        to_set = ops.get('set', {})
+        if not isinstance(to_set, dict):
+            raise ValueError("'categories.set' must be an object of keyword lists")
+        if to_remove:
+            expression = _jsonb_delete_keys(expression, to_remove)
+        for category, keywords in to_set.items():
+            expression = _jsonb_set(expression, category, validate_string_list(keywords, f'categories.set.{category}'))
+        if to_remove or to_set:
+            updates['categories'] = expression
+
+    return updates
+
+
+def versioned_update(queryset, updates, expected_version=None):
+    """
+    Run a single UPDATE on a one-row queryset of a versioned model, bumping its version.
+
+    Returns:
+        int: The new version, or None if the row does not exist
+
+    Raises:
+        SettingsVersionConflict: If expected_version no longer matches
+    """
+    target = queryset
+    if expected_version is not None:
+        target = target.filter(version=expected_version)
+    with transaction.atomic():
+        updated = target.update(**updates, version=F('version') + 1, updated_at=timezone.now())
+        current = queryset.values_list('version', flat=True).first()
+    if current is not None and not updated:
+        raise SettingsVersionConflict(current)
+    return current
+
+
+def _apply_updates(user_id, updates, expected_version=None):
+    """Update one user's settings row, creating it with the defaults first if it does not exist."""
+    version = versioned_update(UserSettings.objects.filter(user_id=user_id), updates, expected_version)
+    if version is None:
+        get_user_settings(user_id)
+        version = versioned_update(UserSettings.objects.filter(user_id=user_id), updates)
+    if version is None:
+        raise UserSettings.DoesNotExist(f"Could not create settings for user {user_id}")
+    return version
+
+
 def get_user_settings(user_id):
     """
     Retrieve user settings from the database.
@@ -7,52 +170,70 @@ def get_user_settings(user_id):
     """
     return UserSettings.get_user_settings(user_id)
 
-def update_user_settings(user_id, **settings):
+def update_user_settings(user_id, expected_version=None, **settings):
     """
     Update user settings in the database.
-    
+
+    Only the columns whose values actually differ are written.
+
     Args:
         user_id (str): The unique identifier for the user
+        expected_version (int): If given, only update when the stored version still matches
         **settings: Keyword arguments containing settings to update
                    (blocked_sites, excluded_sites, categories)
+
+    Returns:
+        int: The settings version after the update
+
+    Raises:
+        SettingsVersionConflict: If expected_version is stale
     """
     user_settings = get_user_settings(user_id)
-    user_settings.update_settings(**settings)
-    return user_settings
+    if expected_version is not None and user_settings.version != expected_version:
+        raise SettingsVersionConflict(user_settings.version)
+
+    changed = {
+        field: value for field, value in settings.items()
+        if field in (*SITE_LISTS, 'categories') and getattr(user_settings, field) != value
+    }
+    if not changed:
+        return user_settings.version
+    return _apply_updates(user_id, changed, expected_version=expected_version)
+
+def patch_user_settings(user_id, changes, expected_version=None):
+    """
+    Apply incremental changes to the user's settings in one UPDATE statement.
+
+    The lists are modified in SQL (array_append/array_remove/jsonb_set), so the
+    cost does not depend on the size of the stored lists.
+
+    Returns:
+        int: The settings version after the update
+    """
+    updates = build_patch_updates(changes)
+    if not updates:
+        current_version = get_user_settings(user_id).version
+        if expected_version is not None and current_version != expected_version:
+            raise SettingsVersionConflict(current_version)
+        return current_version
+    return _apply_updates(user_id, updates, expected_version=expected_version)
 
 def add_blocked_site(user_id, site):
     """Add a site to the user's blocked sites list."""
-    user_settings = get_user_settings(user_id)
-    blocked_sites = user_settings.get_blocked_sites()
-    if site not in blocked_sites:
-        blocked_sites.append(site)
-        user_settings.set_blocked_sites(blocked_sites)
+    return patch_user_settings(user_id, {'blocked_sites': {'add': [site]}})
 
 def remove_blocked_site(user_id, site):
     """Remove a site from the user's blocked sites list."""
-    user_settings = get_user_settings(user_id)
-    blocked_sites = user_settings.get_blocked_sites()
-    if site in blocked_sites:
-        blocked_sites.remove(site)
-        user_settings.set_blocked_sites(blocked_sites)
+    return patch_user_settings(user_id, {'blocked_sites': {'remove': [site]}})
 
 def add_excluded_site(user_id, site):
     """Add a site to the user's excluded sites list."""
-    user_settings = get_user_settings(user_id)
-    excluded_sites = user_settings.get_excluded_sites()
-    if site not in excluded_sites:
-        excluded_sites.append(site)
-        user_settings.set_excluded_sites(excluded_sites)
+    return patch_user_settings(user_id, {'excluded_sites': {'add': [site]}})
 
 def remove_excluded_site(user_id, site):
     """Remove a site from the user's excluded sites list."""
-    user_settings = get_user_settings(user_id)
-    excluded_sites = user_settings.get_excluded_sites()
-    if site in excluded_sites:
-        excluded_sites.remove(site)
-        user_settings.set_excluded_sites(excluded_sites)
+    return patch_user_settings(user_id, {'excluded_sites': {'remove': [site]}})
 
 def update_categories(user_id, categories):
     """Update the user's filtered categories."""
-    user_settings = get_user_settings(user_id)
-    user_settings.update_settings(categories=categories)
+    return update_user_settings(user_id, categories=categories)
@@ -0,0 +1,242 @@
+"""
+Fleet view of client proxy telemetry.
+
+Each user_gui sends a compact counter snapshot of its proxy over its
+WebSocket every few seconds ('telemetry' messages): flows and blocks per
+category since the proxy started, the latency the filter added since the
+previous snapshot, and the proxy's memory. The server keeps the recent
+snapshots of each device in memory, bounded in devices and per-device
+history, and derives rates and latencies over a rolling window from them.
+
+Admins read the aggregated view from /fleet/ or subscribe to 'fleet'
+pushes over their WebSocket. The view is per server process and is lost on
+restart; it is meant for spotting overloaded machines, not for reporting.
+"""
+import collections
+import logging
+import math
+import threading
+import time
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .background import PeriodicTask
+from .notifications import run_on_server_loop, timed_group_send
+
+logger = logging.getLogger(__name__)
+
+FLEET_GROUP = 'fleet'
+
+# Limits on what one snapshot may contain
+MAX_CATEGORIES = 64
+MAX_CATEGORY_LENGTH = 100
+
+
+class InvalidSnapshot(ValueError):
+    """The telemetry message is malformed."""
+
+
+def _number(value, name, allow_none=False):
+    if value is None and allow_none:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+        raise InvalidSnapshot(f"'{name}' must be a non-negative number")
+    return value
+
+
+def parse_snapshot(counters):
+    """Validate a client snapshot and keep only the known fields."""
+    if not isinstance(counters, dict):
+        raise InvalidSnapshot("'counters' must be an object")
+    blocked = counters.get('blocked') or {}
+    if not isinstance(blocked, dict) or len(blocked) > MAX_CATEGORIES:
+        raise InvalidSnapshot(f"'blocked' must be an object with at most {MAX_CATEGORIES} entries")
+    latency = counters.get('latency_ms') or {}
+    if not isinstance(latency, dict):
+        raise InvalidSnapshot("'latency_ms' must be an object")
+    snapshot = {
+        'started_at': _number(counters.get('started_at', 0), 'started_at'),
+        'flows': int(_number(counters.get('flows', 0), 'flows')),
+        'blocked': {},
+        'latency_samples': int(_number(latency.get('samples', 0), 'latency_ms.samples')),
+        'latency_mean': _number(latency.get('mean'), 'latency_ms.mean', allow_none=True),
+        'latency_p99': _number(latency.get('p99'), 'latency_ms.p99', allow_none=True),
+        'rss_kb': _number(counters.get('rss_kb'), 'rss_kb', allow_none=True),
+    }
+    for category, count in blocked.items():
+        if not isinstance(category, str) or len(category) > MAX_CATEGORY_LENGTH:
+            raise InvalidSnapshot("Invalid category name")
+        snapshot['blocked'][category] = int(_number(count, f'blocked.{category}'))
+    return snapshot
+
+
+def _delta(previous, current, value):
+    # Counters restart from zero when the proxy restarts
+    if current['started_at'] != previous['started_at'] or current[value] < previous[value]:
+        return current[value]
+    return current[value] - previous[value]
+
+
+def device_summary(user_id, samples, now, window):
+    """Rates and latency of one device over the samples received in the last `window` seconds."""
+    recent = [(received, snapshot) for received, snapshot in samples if now - received <= window]
+    if not recent:
+        return None
+    latest_received, latest = recent[-1]
+    flows = 0
+    blocked = collections.Counter()
+    for (_, previous), (_, current) in zip(recent, recent[1:]):
+        flows += _delta(previous, current, 'flows')
+        for category, count in current['blocked'].items():
+            earlier = previous['blocked'].get(category, 0)
+            restarted = current['started_at'] != previous['started_at'] or count < earlier
+            blocked[category] += count if restarted else count - earlier
+    span = latest_received - recent[0][0]
+    latency_samples = sum(snapshot['latency_samples'] for _, snapshot in recent if snapshot['latency_mean'] is not None)
+    return {
+        'user_id': user_id,
+        'last_seen_seconds': round(now - latest_received, 1),
+        # Rates need two snapshots
+        'flows_per_sec': round(flows / span, 2) if span > 0 else None,
+        'blocked': dict(blocked),
+        'latency_mean_ms': round(sum(
+            snapshot['latency_mean'] * snapshot['latency_samples']
+            for _, snapshot in recent if snapshot['latency_mean'] is not None
+        ) / latency_samples, 3) if latency_samples else None,
+        # Worst p99 of the snapshots in the window
+        'latency_p99_ms': max(
+            (snapshot['latency_p99'] for _, snapshot in recent if snapshot['latency_p99'] is not None), default=None
+        ),
+        'rss_kb': latest['rss_kb'],
+    }
+
+
+class FleetView:
+    """
+    Recent telemetry snapshots per device.
+
+    Args:
+        max_devices (int): Devices kept; the one that reported least recently is dropped first
+        window (float): Seconds of history kept per device
+        min_interval (float): Snapshots arriving sooner than this after the previous one are dropped
+    """
+
+    def __init__(self, max_devices, window, min_interval):
+        self.max_devices = max_devices
+        self.window = window
+        self.min_interval = min_interval
+        self._devices = collections.OrderedDict()  # user_id -> deque of (monotonic receive time, snapshot)
+        self._lock = threading.Lock()
+
+    def record(self, user_id, counters):
+        """
+        Store a snapshot from a device.
+
+        Returns:
+            bool: False if the snapshot was dropped for arriving too soon
+
+        Raises:
+            InvalidSnapshot: If the snapshot is malformed
+        """
+        snapshot = parse_snapshot(counters)
+        now = time.monotonic()
+        with self._lock:
+            samples = self._devices.get(user_id)
+            if samples and now - samples[-1][0] < self.min_interval:
+                return False
+            if samples is None:
+                # One snapshot per min_interval at most, so this bounds the history to the window
+                samples = collections.deque(maxlen=max(2, int(self.window / max(self.min_interval, 0.1)) + 1))
+                self._devices[user_id] = samples
+                while len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+            samples.append((now, snapshot))
+            self._devices.move_to_end(user_id)
+        return True
+
+    def _expire(self, now):
+        # Devices are ordered by their last snapshot, so stale ones are at the front
+        while self._devices:
+            user_id, samples = next(iter(self._devices.items()))
+            if now - samples[-1][0] <= self.window:
+                break
+            del self._devices[user_id]
+
+    def device(self, user_id, window=None):
+        """Summary of one device, or None if it has not reported within the window."""
+        now = time.monotonic()
+        with self._lock:
+            samples = list(self._devices.get(user_id, ()))
+        return device_summary(user_id, samples, now, min(window or self.window, self.window))
+
+    def summary(self, window=None, top=10):
+        """
+        Fleet totals and the devices with the highest latency, memory and traffic.
+
+        Args:
+            window (float): Seconds to aggregate over (at most the kept history)
+            top (int): Devices listed per ranking
+        """
+        window = min(window or self.window, self.window)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            devices = [(user_id, list(samples)) for user_id, samples in self._devices.items()]
+        summaries = [
+            summary for summary in (device_summary(user_id, samples, now, window) for user_id, samples in devices)
+            if summary is not None
+        ]
+
+        blocked = collections.Counter()
+        for summary in summaries:
+            blocked.update(summary['blocked'])
+        rss = [summary['rss_kb'] for summary in summaries if summary['rss_kb'] is not None]
+
+        def ranking(key):
+            ranked = sorted((summary for summary in summaries if summary[key] is not None), key=lambda s: s[key], reverse=True)
+            return ranked[:top]
+
+        return {
+            'window_seconds': window,
+            'devices': len(summaries),
+            'totals': {
+                'flows_per_sec': round(sum(summary['flows_per_sec'] or 0 for summary in summaries), 2),
+                'blocked': dict(blocked.most_common()),
+                'latency_p99_ms_max': max((s['latency_p99_ms'] for s in summaries if s['latency_p99_ms'] is not None), default=None),
+                'rss_kb_mean': round(sum(rss) / len(rss)) if rss else None,
+                'rss_kb_max': max(rss, default=None),
+            },
+            'top': {
+                'latency_p99_ms': ranking('latency_p99_ms'),
+                'rss_kb': ranking('rss_kb'),
+                'flows_per_sec': ranking('flows_per_sec'),
+            },
+        }
+
+    @property
+    def device_count(self):
+        return len(self._devices)
+
+
+fleet = FleetView(settings.TELEMETRY_MAX_DEVICES, settings.TELEMETRY_WINDOW_SECONDS, settings.TELEMETRY_MIN_INTERVAL)
+
+# Admin connections subscribed to 'fleet' pushes; nothing is computed while there are none
+_subscribers = 0
+_subscribers_lock = threading.Lock()
+
+
+def subscribe(delta):
+    global _subscribers
+    with _subscribers_lock:
+        _subscribers += delta
+
+
+def publish_fleet():
+    """Push the fleet summary to subscribed admins."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or _subscribers <= 0:
+        return
+    message = {'type': 'fleet_update', 'fleet': fleet.summary()}
+    run_on_server_loop(timed_group_send, channel_layer, FLEET_GROUP, message)
+
+
+fleet_publisher = PeriodicTask('fleet-push', settings.FLEET_PUSH_INTERVAL, publish_fleet)
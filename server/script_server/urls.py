@@ -6,9 +6,22 @@ from django.urls import include, path
 from . import views, admin_views
 
 script_executor_patterns = [
+    path('user-settings/batch/fetch/', views.batch_fetch_user_settings, name='batch_fetch_user_settings'),
+    path('user-settings/batch/update/', views.batch_update_user_settings, name='batch_update_user_settings'),
+    path('user-settings/bulk/export/', views.export_user_settings, name='export_user_settings'),
+    path('user-settings/bulk/import/', views.import_user_settings, name='import_user_settings'),
     path('user-settings/<str:user_id>/', views.user_settings, name='user_settings'),
+    path('user-settings/<str:user_id>/policies/', views.user_policies, name='user_policies'),
+    path('policies/', views.policies, name='policies'),
+    path('policies/<int:policy_id>/', views.policy_detail, name='policy_detail'),
+    path('policy-artifacts/<str:artifact_id>/', views.policy_artifact, name='policy_artifact'),
     path('register-ip/', views.register_ip, name='register_ip'),
     path('delete-ip/', views.delete_ip, name='delete_ip'),
+    path('events/batch/', views.ingest_events, name='ingest_events'),
+    path('reports/categories/', views.report_categories, name='report_categories'),
+    path('reports/users/', views.report_users, name='report_users'),
+    path('reports/domains/', views.report_domains, name='report_domains'),
+    path('rules/search/', views.search_rules, name='search_rules'),
 ]
 
 admin_patterns = [
@@ -19,8 +32,13 @@ admin_patterns = [
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(script_executor_patterns)),
+    path('api/', include('script_executor.urls')),
     path('api/admin/', include(admin_patterns)),
     path('heartbeat/', views.heartbeat, name='heartbeat'),
     path('online-users/', views.get_online_users, name='online_users'),
+    path('presence/', views.presence, name='presence'),
+    path('fleet/', views.fleet, name='fleet'),
+    path('db-pool/', views.db_pool_stats, name='db_pool_stats'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('user-ips/', views.get_user_ips, name='user_ips'),
 ]
\ No newline at end of file
@@ -1,21 +1,35 @@
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from .models import UserStatus, UserIP, UserSettings
+from django.db import DatabaseError, IntegrityError
+from django.db.models import Count, Q
+from django.db.models.query import aprefetch_related_objects
+from .models import UserStatus, UserIP, UserSettings, Policy
+from .settings_utils import SettingsVersionConflict, update_user_settings, patch_user_settings
+from . import batch_utils, events, metrics, policy_artifacts, policy_utils, reports, rule_search, settings_transfer, telemetry
+from .heartbeats import arecord_heartbeat
+from .presence import get_presence_snapshot
+from .pagination import apaginate, paginate, parse_since
+from .admission import rate_limited, register_ip_limiter, user_settings_limiter
+from .auth import check_admin, check_bearer
+from .db_router import read_from_replica, replica_reads
+from .db_pool.pool import pool_stats
+from .notifications import notify_user_settings_changed, notify_users_settings_changed, notify_policy_changed
+import gzip
 import json
+import logging
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
 
 @csrf_exempt
-def register_ip(request):
+@rate_limited(register_ip_limiter)
+async def register_ip(request):
     if request.method == 'POST':
         try:
-            # Get authorization header
-            auth_header = request.headers.get('Authorization', '')
-            if not auth_header.startswith('Bearer '):
-                return JsonResponse({'status': 'error', 'message': 'Invalid authorization header'}, status=401)
-            
-            # Extract token
-            token = auth_header.split(' ')[1]
-            
             # Parse request body
             data = json.loads(request.body)
             user_id = data.get('user_id')
@@ -23,14 +37,12 @@ def register_ip(request):
             port = data.get('port', 8081)
             
             # Validate token matches user_id
-            if not token or token != user_id:
-                return JsonResponse({'status': 'error', 'message': 'Invalid credentials'}, status=401)
+            error = check_bearer(request, user_id)
+            if error:
+                return error
             
-            # Update or create user IP
-            UserIP.objects.update_or_create(
-                user_id=user_id,
-                defaults={'ip_address': ip_address, 'port': port}
-            )
+            # Insert or update user IP in a single statement
+            await UserIP.aupsert(user_id, ip_address, port)
             return JsonResponse({'status': 'success'})
             
         except json.JSONDecodeError:
@@ -40,9 +52,32 @@ def register_ip(request):
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
 
+@read_from_replica
 def get_user_ips(request):
-    user_ips = UserIP.objects.all().values('user_id', 'ip_address', 'port', 'last_updated')
-    return JsonResponse({'user_ips': list(user_ips)})
+    """
+    List registered client addresses: all of them, or one keyset page at a time if cursor or limit is passed.
+
+    Query parameters: cursor, limit, fields (comma separated), q (user ID or IP prefix),
+    online (only users currently online), updated_since (ISO 8601)
+    """
+    queryset = UserIP.objects.all()
+    q = request.GET.get('q')
+    if q:
+        queryset = queryset.filter(Q(user_id__startswith=q) | Q(ip_address__startswith=q))
+    if request.GET.get('online') in ('1', 'true'):
+        queryset = queryset.filter(
+            user_id__in=UserStatus.online_users(settings.ONLINE_TIMEOUT_SECONDS).values('user_id')
+        )
+    try:
+        since = parse_since(request.GET.get('updated_since'))
+        if since:
+            queryset = queryset.filter(last_updated__gte=since)
+        user_ips, next_cursor = paginate(
+            queryset, 'last_updated', request.GET, ('user_id', 'ip_address', 'port', 'last_updated')
+        )
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'user_ips': user_ips, 'next_cursor': next_cursor})
 
 @csrf_exempt
 def delete_ip(request):
@@ -76,28 +111,20 @@ def delete_ip(request):
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
 
 @csrf_exempt
-def heartbeat(request):
+async def heartbeat(request):
     if request.method == 'POST':
         try:
-            # Get authorization header
-            auth_header = request.headers.get('Authorization', '')
-            if not auth_header.startswith('Bearer '):
-                return JsonResponse({'status': 'error', 'message': 'Invalid authorization header'}, status=401)
-            
-            # Extract token
-            token = auth_header.split(' ')[1]
-            
             # Parse request body
             data = json.loads(request.body)
             user_id = data.get('user_id')
             
             # Validate token matches user_id
-            if not token or token != user_id:
-                return JsonResponse({'status': 'error', 'message': 'Invalid credentials'}, status=401)
+            error = check_bearer(request, user_id)
+            if error:
+                return error
             
-            # Update or create user status
-            user_status, created = UserStatus.objects.get_or_create(user_id=user_id)
-            user_status.update_heartbeat()
+            # Buffered and written together with other users' heartbeats
+            await arecord_heartbeat(user_id)
             return JsonResponse({'status': 'success'})
             
         except json.JSONDecodeError:
@@ -107,121 +134,580 @@ def heartbeat(request):
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
 
-def get_online_users(request):
-    # Mark users as offline if they haven't sent a heartbeat in 10 seconds
-    UserStatus.mark_offline_inactive_users(timeout_minutes=0.167)  # 10 seconds = 0.167 minutes
-    
-    # Get all online users
-    online_users = UserStatus.objects.filter(is_online=True).values('user_id', 'last_heartbeat')
-    return JsonResponse({'online_users': list(online_users)})
+@read_from_replica
+async def get_online_users(request):
+    # Online status is derived from the heartbeat age, so this endpoint never writes;
+    # the presence sweeper persists is_online in the background.
+    # Paginated like /user-ips/ when cursor or limit is passed (also: fields, q, updated_since)
+    queryset = UserStatus.online_users(settings.ONLINE_TIMEOUT_SECONDS)
+    q = request.GET.get('q')
+    if q:
+        queryset = queryset.filter(user_id__startswith=q)
+    try:
+        since = parse_since(request.GET.get('updated_since'))
+        if since:
+            queryset = queryset.filter(last_heartbeat__gte=since)
+        online_users, next_cursor = await apaginate(
+            queryset, 'last_heartbeat', request.GET, ('user_id', 'last_heartbeat')
+        )
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'online_users': online_users, 'next_cursor': next_cursor})
+
+def metrics_view(request):
+    """Server metrics in the Prometheus text exposition format."""
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def db_pool_stats(request):
+    """Connection pool usage per database alias (size, in use, waiting, timeouts, wait times)."""
+    return JsonResponse({'pools': pool_stats()})
+
+@read_from_replica
+def presence(request):
+    """Snapshot of the presence registry; admins follow changes through 'presence' WebSocket events."""
+    return JsonResponse({'online_users': get_presence_snapshot(), 'timestamp': timezone.now().isoformat()})
+
+def fleet(request):
+    """
+    Aggregated telemetry of the client proxies over a rolling window.
+
+    Query parameters: window (seconds, at most TELEMETRY_WINDOW_SECONDS), top
+    (devices per ranking), user_id (a single device instead of the fleet)
+    """
+    error = check_admin(request.user)
+    if error:
+        return error
+    try:
+        window = float(request.GET.get('window') or settings.TELEMETRY_WINDOW_SECONDS)
+        top = int(request.GET.get('top') or 10)
+        if window <= 0 or not 1 <= top <= 1000:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': "'window' must be a positive number and 'top' between 1 and 1000"}, status=400)
+    user_id = request.GET.get('user_id')
+    if user_id:
+        device = telemetry.fleet.device(user_id, window)
+        if device is None:
+            return JsonResponse({'status': 'error', 'message': 'No recent telemetry from this device'}, status=404)
+        return JsonResponse(device)
+    return JsonResponse(telemetry.fleet.summary(window, top))
+
+def policy_artifact(request, artifact_id):
+    """
+    A compiled policy artifact (see policy_artifacts.py). The URL names the
+    content, so responses can be cached forever by clients and proxies.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'status': 'error', 'message': f'Method {request.method} not allowed'}, status=405)
+    etag = f'"{artifact_id}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return HttpResponseNotModified(headers={'ETag': etag})
+    data = policy_artifacts.get_artifact(artifact_id)
+    if data is None:
+        return JsonResponse({'status': 'error', 'message': 'Artifact not found'}, status=404)
+    return HttpResponse(data, content_type='application/octet-stream', headers={
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable',
+    })
 
 @csrf_exempt
-def user_settings(request, user_id):
+@rate_limited(user_settings_limiter)
+async def user_settings(request, user_id):
+    # Authentication only reads headers, so it is done once here for every method
+    error = check_bearer(request, user_id)
+    if error:
+        return error
+    
     if request.method == 'GET':
         try:
-            # Get authorization header
-            auth_header = request.headers.get('Authorization', '')
-            
-            if not auth_header.startswith('Bearer '):
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Invalid authorization header format. Expected: Bearer <token>'
-                }, status=401)
-            
-            # Extract token and verify it matches the URL user_id
-            token = auth_header.split(' ')[1]
-            if token != user_id:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Token does not match user ID'
-                }, status=401)
-            
-            # Get or create user settings
+            # Read from the replica if configured; a missing row is created on the primary
+            with replica_reads():
+                settings = await UserSettings.objects.filter(user_id=user_id).afirst()
+                if settings is not None:
+                    await aprefetch_related_objects([settings], 'policies')
+            if settings is None:
+                settings = await UserSettings.aget_user_settings(user_id)
+                await aprefetch_related_objects([settings], 'policies')
+            effective = policy_utils.get_effective_settings(settings)
             try:
-                settings = UserSettings.get_user_settings(user_id)
-                
-                response_data = {
-                    'status': 'success',
+                artifact = await sync_to_async(policy_artifacts.artifact_info)(effective)
+            except DatabaseError:
+                # Clients fall back to the lists below
+                logger.warning("Could not compile policy artifact for %s", user_id, exc_info=True)
+                artifact = None
+            
+            # Top-level lists are what the user is filtered by (policies + overrides)
+            return JsonResponse({
+                'status': 'success',
+                'blocked_sites': effective['blocked_sites'],
+                'excluded_sites': effective['excluded_sites'],
+                'categories': effective['categories'],
+                'settings_version': effective['settings_version'],
+                'artifact': artifact,
+                'version': settings.version,
+                'overrides': {
                     'blocked_sites': settings.get_blocked_sites(),
                     'excluded_sites': settings.get_excluded_sites(),
-                    'categories': settings.categories
-                }
-                return JsonResponse(response_data)
-                
-            except Exception as e:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Error getting settings: {str(e)}'
-                }, status=400)
-                
+                    'categories': settings.get_categories()
+                },
+                'policies': [
+                    {'id': policy.id, 'name': policy.name, 'version': policy.version}
+                    for policy in settings.policies.all()
+                ]
+            })
+            
         except Exception as e:
             return JsonResponse({
                 'status': 'error',
-                'message': str(e)
+                'message': f'Error getting settings: {str(e)}'
             }, status=400)
     
+    # Writes stay synchronous: they run in transactions and notify through async_to_sync
     elif request.method == 'POST':
+        return await sync_to_async(_replace_user_settings)(request, user_id)
+    
+    elif request.method == 'PATCH':
+        return await sync_to_async(_patch_user_settings)(request, user_id)
+    
+    return JsonResponse({
+        'status': 'error',
+        'message': f'Method {request.method} not allowed'
+    }, status=405)
+
+def _replace_user_settings(request, user_id):
+    # Parse request body
+    try:
+        data = json.loads(request.body)
+        blocked_sites = data.get('blocked_sites', [])
+        excluded_sites = data.get('excluded_sites', [])
+        categories = data.get('categories', {})
+        
+        # Write only the columns that changed; an optional version makes the save conditional
+        version = update_user_settings(
+            user_id,
+            expected_version=data.get('version'),
+            blocked_sites=blocked_sites,
+            excluded_sites=excluded_sites,
+            categories=categories
+        )
+        notify_user_settings_changed(user_id)
+        
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Settings updated successfully',
+            'version': version
+        })
+        
+    except SettingsVersionConflict as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Settings were changed by another editor, reload and try again',
+            'version': e.current_version
+        }, status=409)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid JSON data'
+        }, status=400)
+        
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Error updating settings: {str(e)}'
+        }, status=400)
+
+def _patch_user_settings(request, user_id):
+    # Parse patch document: {"version": n, "blocked_sites": {"add": [], "remove": []}, ...}
+    try:
+        data = json.loads(request.body)
+        version = patch_user_settings(user_id, data, expected_version=data.get('version'))
+        notify_user_settings_changed(user_id)
+        
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Settings updated successfully',
+            'version': version
+        })
+        
+    except SettingsVersionConflict as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Settings were changed by another editor, reload and try again',
+            'version': e.current_version
+        }, status=409)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid JSON data'
+        }, status=400)
+        
+    except ValueError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+        
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+
+
+@csrf_exempt
+def user_policies(request, user_id):
+    """List (GET, as the user) or replace (PUT, as an admin) the shared policies a user references."""
+    if request.method == 'GET':
+        error = check_bearer(request, user_id)
+        if error:
+            return error
+        return JsonResponse({'status': 'success', 'policy_ids': policy_utils.get_user_policy_ids(user_id)})
+    
+    if request.method == 'PUT':
+        # Detaching from a policy drops its rules, so users cannot change their own memberships
+        error = check_admin(request.user)
+        if error:
+            return error
         try:
-            # Get authorization header
-            auth_header = request.headers.get('Authorization', '')
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                return JsonResponse({'status': 'error', 'message': 'Expected a JSON object'}, status=400)
+            policy_ids = data.get('policy_ids')
+            if not isinstance(policy_ids, list) or not all(isinstance(pid, int) for pid in policy_ids):
+                return JsonResponse({'status': 'error', 'message': "'policy_ids' must be a list of integers"}, status=400)
             
-            if not auth_header.startswith('Bearer '):
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Invalid authorization header format. Expected: Bearer <token>'
-                }, status=401)
+            policy_utils.set_user_policies(user_id, policy_ids)
+            notify_user_settings_changed(user_id)
+            return JsonResponse({'status': 'success', 'policy_ids': policy_ids})
             
-            # Extract token and verify it matches the URL user_id
-            token = auth_header.split(' ')[1]
-            if token != user_id:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Token does not match user ID'
-                }, status=401)
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+        except Policy.DoesNotExist as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+        except Exception as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'status': 'error',
+        'message': f'Method {request.method} not allowed'
+    }, status=405)
+
+@csrf_exempt
+def policies(request):
+    """List (GET) or create (POST) shared policies."""
+    if request.method == 'GET':
+        queryset = Policy.objects.annotate(user_count=Count('users')).order_by('id')
+        return JsonResponse({'policies': [policy_utils.policy_to_dict(policy) for policy in queryset]})
+    
+    if request.method == 'POST':
+        error = check_admin(request.user)
+        if error:
+            return error
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                return JsonResponse({'status': 'error', 'message': 'Expected a JSON object'}, status=400)
+            name = data.get('name')
+            if not name:
+                return JsonResponse({'status': 'error', 'message': "'name' is required"}, status=400)
             
-            # Parse request body
-            try:
-                data = json.loads(request.body)
-                blocked_sites = data.get('blocked_sites', [])
-                excluded_sites = data.get('excluded_sites', [])
-                categories = data.get('categories', {})
-                
-                # Get existing settings or create new
-                try:
-                    settings = UserSettings.objects.get(user_id=user_id)
-                except UserSettings.DoesNotExist:
-                    settings = UserSettings(user_id=user_id)
-                
-                # Update settings
-                settings.blocked_sites = blocked_sites
-                settings.excluded_sites = excluded_sites
-                settings.categories = categories
-                settings.save()
-                
-                return JsonResponse({
-                    'status': 'success',
-                    'message': 'Settings updated successfully'
-                })
-                
-            except json.JSONDecodeError:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Invalid JSON data'
-                }, status=400)
-                
-            except Exception as e:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Error updating settings: {str(e)}'
-                }, status=400)
-                
+            policy = policy_utils.create_policy(
+                name,
+                blocked_sites=data.get('blocked_sites', []),
+                excluded_sites=data.get('excluded_sites', []),
+                categories=data.get('categories', {})
+            )
+            return JsonResponse({'status': 'success', 'policy': policy_utils.policy_to_dict(policy)}, status=201)
+            
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+        except IntegrityError:
+            return JsonResponse({'status': 'error', 'message': 'A policy with this name already exists'}, status=409)
         except Exception as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'status': 'error',
+        'message': f'Method {request.method} not allowed'
+    }, status=405)
+
+@csrf_exempt
+def policy_detail(request, policy_id):
+    """Fetch (GET) or incrementally change (PATCH) one policy; changes are pushed to its users."""
+    if request.method == 'GET':
+        policy = Policy.objects.filter(pk=policy_id).annotate(user_count=Count('users')).first()
+        if policy is None:
+            return JsonResponse({'status': 'error', 'message': 'Policy not found'}, status=404)
+        return JsonResponse({'status': 'success', 'policy': policy_utils.policy_to_dict(policy)})
+    
+    if request.method == 'PATCH':
+        error = check_admin(request.user)
+        if error:
+            return error
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                return JsonResponse({'status': 'error', 'message': 'Expected a JSON object'}, status=400)
+            version = policy_utils.patch_policy(policy_id, data, expected_version=data.get('version'))
+            # One group message reaches every connected user of this policy
+            notify_policy_changed(policy_id)
+            return JsonResponse({'status': 'success', 'version': version})
+            
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+        except Policy.DoesNotExist:
+            return JsonResponse({'status': 'error', 'message': 'Policy not found'}, status=404)
+        except SettingsVersionConflict as e:
             return JsonResponse({
                 'status': 'error',
-                'message': str(e)
-            }, status=400)
+                'message': 'Policy was changed by another editor, reload and try again',
+                'version': e.current_version
+            }, status=409)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
     
     return JsonResponse({
         'status': 'error',
         'message': f'Method {request.method} not allowed'
     }, status=405)
+
+@csrf_exempt
+@read_from_replica
+def batch_fetch_user_settings(request):
+    """Fetch settings for a list of users or a filter in one request."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    error = check_admin(request.user)
+    if error:
+        return error
+    
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            return JsonResponse({'status': 'error', 'message': 'Expected a JSON object'}, status=400)
+        user_ids = batch_utils.select_user_ids(data.get('user_ids'), data.get('filter'))
+        return JsonResponse({'status': 'success', 'results': batch_utils.fetch_settings(user_ids)})
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+@csrf_exempt
+def batch_update_user_settings(request):
+    """
+    Apply one change to many users' settings in one request.
+
+    Body: a selection ("user_ids" or "filter") and exactly one of
+    "patch", "settings" or "per_user". Every updated user gets a single
+    settings push, and the response reports the outcome per user.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    error = check_admin(request.user)
+    if error:
+        return error
+    
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            return JsonResponse({'status': 'error', 'message': 'Expected a JSON object'}, status=400)
+        per_user = data.get('per_user')
+        user_ids = data.get('user_ids')
+        if user_ids is None and data.get('filter') is None and isinstance(per_user, dict):
+            user_ids = list(per_user)
+        user_ids = batch_utils.select_user_ids(user_ids, data.get('filter'))
+        
+        results = batch_utils.update_settings(
+            user_ids,
+            patch=data.get('patch'),
+            settings=data.get('settings'),
+            per_user=per_user
+        )
+        notify_users_settings_changed([result['user_id'] for result in results if result['status'] == 'success'])
+        return JsonResponse({'status': 'success', 'results': results})
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+@csrf_exempt
+def ingest_events(request):
+    """
+    Store a batch of block/allow events from a client proxy.
+
+    Body (JSON, optionally with Content-Encoding: gzip):
+    {"user_id", "batch_id": UUID, "events": [{"ts", "action", "reason", "host", "category"}]}
+
+    200 means the batch is stored (or was already stored under this batch_id) and can be
+    discarded; 4xx means it can never be stored; 503 means retry the same batch later.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+
+    try:
+        data = json.loads(events.decode_body(
+            request.body, request.headers.get('Content-Encoding'), settings.EVENT_BATCH_MAX_BYTES
+        ))
+        if not isinstance(data, dict):
+            raise events.InvalidBatch('Expected a JSON object')
+        user_id = data.get('user_id')
+        error = check_bearer(request, user_id)
+        if error:
+            return error
+        batch_id = str(uuid.UUID(str(data.get('batch_id'))))
+        batch = data.get('events')
+        if isinstance(batch, list) and len(batch) > settings.EVENT_BATCH_MAX_EVENTS:
+            raise events.BatchTooLarge(f'Batch has more than {settings.EVENT_BATCH_MAX_EVENTS} events')
+        result = events.ingest_batch(user_id, batch_id, batch)
+    except events.BatchTooLarge as e:
+        metrics.event_batches.inc(result='too_large')
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=413)
+    except ValueError as e:
+        # events.InvalidBatch, json.JSONDecodeError, UnicodeDecodeError and a bad batch_id
+        metrics.event_batches.inc(result='invalid')
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    except DatabaseError:
+        logger.exception("Failed to store event batch")
+        metrics.event_batches.inc(result='error')
+        return JsonResponse({'status': 'error', 'message': 'Events could not be stored, retry later'},
+                            status=503, headers={'Retry-After': '10'})
+
+    metrics.event_batches.inc(result='duplicate' if result['duplicate'] else 'accepted')
+    metrics.events_ingested.inc(result['accepted'], result='accepted')
+    metrics.events_ingested.inc(result['rejected'], result='rejected')
+    if result['duplicate']:
+        metrics.events_ingested.inc(len(batch), result='duplicate')
+    return JsonResponse({'status': 'success', **result})
+
+
+def _report_response(request, report):
+    # Reports show per-student activity: admins only
+    error = check_admin(request.user)
+    if error:
+        return error
+    try:
+        options, results = report(request.GET)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({
+        'since': options['since'].isoformat(),
+        'until': options['until'].isoformat(),
+        'action': options['action'],
+        'results': results,
+    })
+
+@read_from_replica
+def report_categories(request):
+    """
+    Top categories from the hourly rollups.
+
+    Query parameters: since, until, action, limit, and one of user_id,
+    user_id_prefix or policy_id to report on a single user or a class
+    """
+    return _report_response(request, reports.top_categories)
+
+@read_from_replica
+def report_users(request):
+    """Users with the most events, from the hourly rollups (same parameters as report_categories)."""
+    return _report_response(request, reports.top_users)
+
+@read_from_replica
+def report_domains(request):
+    """Top hosts over all users from the daily rollups. Query parameters: since, until, action, limit"""
+    return _report_response(request, reports.top_domains)
+
+@read_from_replica
+def search_rules(request):
+    """
+    Policies and users that block or exclude a site, or filter on a keyword.
+
+    Query parameters: field (blocked_sites, excluded_sites, categories), q,
+    category, match (domain: q or a parent domain is listed; exact), limit,
+    after (next_after of the previous page)
+    """
+    error = check_admin(request.user)
+    if error:
+        return error
+    try:
+        options, result = rule_search.search_rules(request.GET)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({
+        'field': options['field'],
+        'q': options['q'],
+        'match': options['match'],
+        **result,
+    })
+
+async def _in_thread(generator):
+    """Drive a sync generator (which queries the database) from an async streaming response."""
+    # Without this Django would read a sync iterator to the end before sending anything
+    next_item = sync_to_async(next)
+    while True:
+        item = await next_item(generator, None)
+        if item is None:
+            return
+        yield item
+
+async def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+async def export_user_settings(request):
+    """
+    Stream every policy and user's settings as NDJSON (see settings_transfer.py),
+    gzip-compressed if the client accepts it.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'status': 'error', 'message': f'Method {request.method} not allowed'}, status=405)
+    error = check_admin(await request.auser())
+    if error:
+        return error
+    chunks = _in_thread(settings_transfer.export_chunks())
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = StreamingHttpResponse(_gzip(chunks) if compress else chunks, content_type='application/x-ndjson')
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    response['Content-Disposition'] = 'attachment; filename="user-settings.ndjson"'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@csrf_exempt
+async def import_user_settings(request):
+    """
+    Import an NDJSON export (optionally Content-Encoding: gzip), a batch at a time.
+
+    The response streams NDJSON progress lines while the import runs and ends
+    with a 'done' line listing the first invalid lines. ?dry_run=1 only validates.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': f'Method {request.method} not allowed'}, status=405)
+    error = check_admin(await request.auser())
+    if error:
+        return error
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding not in ('', 'identity', 'gzip'):
+        return JsonResponse({'status': 'error', 'message': f'Unsupported Content-Encoding: {encoding}'}, status=400)
+    # The request body is already spooled to a temporary file; it is read a line at a time from there
+    stream = gzip.GzipFile(fileobj=request, mode='rb') if encoding == 'gzip' else request
+    importer = await sync_to_async(settings_transfer.SettingsImporter)(
+        stream, dry_run=request.GET.get('dry_run', '').lower() in ('1', 'true')
+    )
+
+    def progress():
+        try:
+            for update in importer.run():
+                yield json.dumps(update) + '\n'
+        except (OSError, EOFError, zlib.error) as e:
+            # A damaged gzip stream; what was imported so far stays
+            yield json.dumps({**importer.progress('failed'), 'message': f'Invalid gzip body: {e}'}) + '\n'
+
+    return StreamingHttpResponse(_in_thread(progress()), content_type='application/x-ndjson')
@@ -6,7 +6,7 @@ build_exe_options = {
     "packages": [
         "json", "os", "sys", "uuid", "socket", "threading", "logging",
         "http.server", "datetime", "random", "string", "requests",
-        "dotenv", "psycopg2", "PyQt6", "email_utils",
+        "dotenv", "psycopg2", "PyQt6", "email_utils", "ws_reconnect",
         "mitmproxy", "mitmproxy.http", "mitmproxy.ctx", "urllib.parse",
         "re", "winreg"  # Added winreg for Windows registry operations
     ],
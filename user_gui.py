@@ -7,17 +7,21 @@ from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QTableWidget, QTableWidgetItem,
     QVBoxLayout, QPushButton, QWidget, QLineEdit, QMessageBox,
     QTabWidget, QStatusBar, QLabel, QHBoxLayout, QFormLayout,
-    QSystemTrayIcon, QMenu, QStyle, QDialog, QGridLayout, QDialogButtonBox
+    QSystemTrayIcon, QMenu, QStyle, QDialog, QGridLayout, QDialogButtonBox, QPlainTextEdit
 )
 from PyQt6.QtCore import Qt, QTimer, QUrl
-from PyQt6.QtGui import QIcon, QAction
-from PyQt6.QtNetwork import QNetworkProxy
+from PyQt6.QtGui import QIcon, QAction, QTextCursor
+from PyQt6.QtNetwork import QAbstractSocket, QNetworkProxy
 from PyQt6.QtWebSockets import QWebSocket
 from dotenv import load_dotenv
 from setup_proxy_and_mitm import launch_proxy, disable_windows_proxy
+from ws_reconnect import ReconnectManager
 import logging
+import random
 import socket
 import threading
+import time
+import zlib
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
 # Load environment variables
@@ -37,6 +41,14 @@ def get_local_ip():
     except:
         return "127.0.0.1"
 
+def retry_after_ms(retry_after, default=5):
+    """Milliseconds to wait for a server's Retry-After (seconds), plus up to a second of jitter."""
+    try:
+        seconds = max(float(retry_after), 0)
+    except (TypeError, ValueError):
+        seconds = default
+    return int((seconds + random.random()) * 1000)
+
 class StatusHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         if self.path == '/status':
@@ -249,6 +261,9 @@ class UserDashboardWindow(QMainWindow):
         self.blocked_sites = []
         self.excluded_sites = []
         self.categories = {}  # Add categories field
+        self.policy_file = 'policy.bin'
+        self.artifact_id = None  # Compiled policy in policy_file, see fetch_policy_artifact
+        self.settings_version = None  # Of the settings in use; sent on reconnect so only missed changes are pushed
         
         # Initialize admin password if not exists
         self.init_admin_password()
@@ -261,9 +276,11 @@ class UserDashboardWindow(QMainWindow):
         
         # Initialize WebSocket
         self.websocket = QWebSocket()
+        self.reconnect = ReconnectManager(self.connect_websocket)
         self.websocket.connected.connect(self.on_websocket_connected)
         self.websocket.disconnected.connect(self.on_websocket_disconnected)
         self.websocket.textMessageReceived.connect(self.on_websocket_message)
+        self.websocket.binaryMessageReceived.connect(self.on_websocket_binary_message)
         
         # Get WebSocket URL from server URL
         ws_url = self.server_url.replace('http://', 'ws://') + '/ws/status/'
@@ -286,6 +303,32 @@ class UserDashboardWindow(QMainWindow):
         # Connect to WebSocket after UI is set up
         self.connect_websocket()
 
+        # Forward the proxy's counters (written by block_sites.py) to the server's fleet view
+        self.proxy_stats_file = 'proxy_stats.json'
+        self.last_telemetry_ts = None
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.setInterval(int(float(os.getenv('TELEMETRY_INTERVAL', '10')) * 1000))
+        self.telemetry_timer.timeout.connect(self.send_telemetry)
+        self.telemetry_timer.start()
+
+    def send_telemetry(self):
+        """Send the latest proxy counter snapshot over the WebSocket, if it is fresh"""
+        if self.websocket.state() != QAbstractSocket.SocketState.ConnectedState:
+            return
+        try:
+            with open(self.proxy_stats_file, 'r') as f:
+                counters = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return  # Proxy not started yet
+        # A stale file means the proxy stopped; don't report it as running
+        if time.time() - counters.get('ts', 0) > 3 * max(counters.get('interval', 10), self.telemetry_timer.interval() / 1000):
+            return
+        # Latency covers the time between snapshots; sending one twice would count it twice
+        if counters.get('ts') == self.last_telemetry_ts:
+            return
+        self.last_telemetry_ts = counters.get('ts')
+        self.websocket.sendTextMessage(json.dumps({'type': 'telemetry', 'counters': counters}, separators=(',', ':')))
+
     def get_or_create_user_id(self):
         """Get existing user ID from .env file or create a new one."""
         env_path = '.env'
@@ -360,18 +403,30 @@ class UserDashboardWindow(QMainWindow):
     def on_websocket_connected(self):
         """Handle WebSocket connection"""
         self.connection_status.setText("WebSocket: Connected")
-        # Send initial user status
+        self.reconnect.connected()
+        # Send initial user status; the server pushes the settings only if they changed since settings_version.
+        # QWebSocket has no permessage-deflate, so settings pushes come as zlib-compressed binary frames
         self.websocket.sendTextMessage(json.dumps({
             'type': 'user_status',
             'user_id': self.user_id,
-            'status': 'online'
+            'status': 'online',
+            'settings_version': self.settings_version,
+            'frames': 'zlib'
         }))
 
     def on_websocket_disconnected(self):
         """Handle WebSocket disconnection"""
-        self.connection_status.setText("WebSocket: Disconnected")
-        # Try to reconnect after 5 seconds
-        QTimer.singleShot(5000, self.connect_websocket)
+        delay = self.reconnect.disconnected()
+        self.connection_status.setText(f"WebSocket: Disconnected, reconnecting in {delay:.0f}s")
+
+    def on_websocket_binary_message(self, data):
+        """Handle a zlib-compressed JSON message"""
+        try:
+            message = zlib.decompress(bytes(data)).decode()
+        except (zlib.error, UnicodeDecodeError) as e:
+            logging.error(f"Error decompressing WebSocket message: {e}")
+            return
+        self.on_websocket_message(message)
 
     def on_websocket_message(self, message):
         """Handle incoming WebSocket messages"""
@@ -401,6 +456,15 @@ class UserDashboardWindow(QMainWindow):
                     'type': 'pong',
                     'user_id': self.user_id
                 }))
+            elif message_type == 'script_output':
+                self.on_script_output(data)
+            elif message_type == 'script_result':
+                self.on_script_job_update(data.get('job', {}))
+            elif message_type == 'retry_later':
+                # Admission control: the server closes the connection right after this
+                self.reconnect.server_retry_after(data.get('retry_after'))
+            elif message_type == 'resumed':
+                logging.info("Reconnected, settings are up to date")
             elif message_type == 'admin_connected':
                 logging.info("Admin connection confirmed")
                 # Optionally refresh status or update UI
@@ -484,8 +548,28 @@ class UserDashboardWindow(QMainWindow):
         execute_button.clicked.connect(self.execute_script)
         script_layout.addWidget(execute_button)
         
+        self.cancel_script_button = QPushButton("Cancel")
+        self.cancel_script_button.setEnabled(False)
+        self.cancel_script_button.clicked.connect(self.cancel_script)
+        script_layout.addWidget(self.cancel_script_button)
+        
         script_group.setLayout(script_layout)
         layout.addWidget(script_group)
+        
+        self.script_status_label = QLabel("")
+        layout.addWidget(self.script_status_label)
+        
+        # Output is appended as the server streams it
+        self.script_output_view = QPlainTextEdit()
+        self.script_output_view.setReadOnly(True)
+        self.script_output_view.setMaximumBlockCount(10000)  # Bound memory for very long outputs
+        layout.addWidget(self.script_output_view)
+        
+        # Scripts run as server-side jobs; poll in case the WebSocket push is missed
+        self.script_job_id = None
+        self.script_poll_timer = QTimer(self)
+        self.script_poll_timer.setInterval(1000)
+        self.script_poll_timer.timeout.connect(self.poll_script_job)
 
         container.setLayout(layout)
         return container
@@ -529,6 +613,8 @@ class UserDashboardWindow(QMainWindow):
                 self.blocked_sites = data.get('blocked_sites', [])
                 self.excluded_sites = data.get('excluded_sites', [])
                 self.categories = data.get('categories', {})
+                self.artifact_id = self.fetch_policy_artifact(data.get('artifact'))
+                self.settings_version = data.get('settings_version')
                 
                 # Save settings to local file as backup
                 try:
@@ -536,7 +622,9 @@ class UserDashboardWindow(QMainWindow):
                         json.dump({
                             'blocked_sites': self.blocked_sites,
                             'excluded_sites': self.excluded_sites,
-                            'categories': self.categories
+                            'categories': self.categories,
+                            'artifact_id': self.artifact_id,
+                            'settings_version': self.settings_version
                         }, f, indent=4)
                     logging.info("Settings saved to local file")
                 except Exception as save_error:
@@ -554,6 +642,8 @@ class UserDashboardWindow(QMainWindow):
                     self.blocked_sites = data.get('blocked_sites', [])
                     self.excluded_sites = data.get('excluded_sites', [])
                     self.categories = data.get('categories', {})
+                    self.artifact_id = data.get('artifact_id')
+                    self.settings_version = data.get('settings_version')
                     # Mark settings as loaded to prevent duplicate requests
                     self.settings_loaded = True
                     return self.blocked_sites, self.excluded_sites
@@ -571,6 +661,8 @@ class UserDashboardWindow(QMainWindow):
                         self.blocked_sites = data.get('blocked_sites', [])
                         self.excluded_sites = data.get('excluded_sites', [])
                         self.categories = data.get('categories', {})
+                        self.artifact_id = data.get('artifact_id')
+                        self.settings_version = data.get('settings_version')
                         # Mark settings as loaded to prevent duplicate requests
                         self.settings_loaded = True
                         return self.blocked_sites, self.excluded_sites
@@ -583,25 +675,119 @@ class UserDashboardWindow(QMainWindow):
         if not all([self.server_url_input.text().strip(), self.api_key_input.text().strip(), self.script_name_input.text().strip()]):
             QMessageBox.warning(self, "Input Error", "Please fill in all fields")
             return
+        if self.script_job_id:
+            QMessageBox.warning(self, "Script Running", "Wait for the current script to finish or cancel it")
+            return
 
         try:
             headers = {"Authorization": f"Bearer {self.api_key}"}
-            payload = {"script": self.script_name_input.text().strip()}
+            payload = {"script": self.script_name_input.text().strip(), "stream": "true"}
             
+            # The server queues the script and answers at once with a job ID;
+            # output then arrives as 'script_output' WebSocket messages
             response = requests.post(
                 f"{self.server_url}/api/execute/",
                 data=payload,
-                headers=headers
+                headers=headers,
+                timeout=10
             )
             
             result = response.json()
-            QMessageBox.information(self, "Script Execution Result", str(result))
+            if response.status_code != 202:
+                QMessageBox.warning(self, "Script Execution", result.get('error', str(result)))
+                return
+            
+            self.script_job_id = result['job_id']
+            self.script_output_view.clear()
+            self.script_status_label.setText(f"Script {payload['script']}: {result['status']}")
+            self.cancel_script_button.setEnabled(True)
+            self.script_poll_timer.start()
             
         except requests.exceptions.RequestException as e:
             QMessageBox.critical(self, "Error", f"Failed to connect to server: {e}")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"An error occurred: {e}")
 
+    def fetch_script_job(self, job_id):
+        try:
+            response = requests.get(
+                f"{self.server_url}/api/execute/{job_id}/",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=5
+            )
+            return response.json() if response.status_code == 200 else None
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Fetching script job failed: {e}")
+            return None
+
+    def poll_script_job(self):
+        if not self.script_job_id:
+            self.script_poll_timer.stop()
+            return
+        try:
+            # Status only; the output is streamed over the WebSocket
+            response = requests.get(
+                f"{self.server_url}/api/execute/{self.script_job_id}/",
+                params={"output": "0"},
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=5
+            )
+            if response.status_code == 404:
+                # Expired or lost (e.g. server restart)
+                self.finish_script_job({'job_id': self.script_job_id, 'status': 'unknown', 'error': 'Job not found on server'})
+                return
+            job = response.json()
+            if job.get('status') not in ('queued', 'running'):
+                # Finished: take the complete output, including anything the stream has not delivered yet
+                job = self.fetch_script_job(job['job_id']) or job
+            self.on_script_job_update(job)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Polling script job failed: {e}")
+
+    def cancel_script(self):
+        if not self.script_job_id:
+            return
+        try:
+            requests.post(
+                f"{self.server_url}/api/execute/{self.script_job_id}/cancel/",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=5
+            )
+        except requests.exceptions.RequestException as e:
+            QMessageBox.critical(self, "Error", f"Failed to cancel script: {e}")
+
+    def on_script_output(self, data):
+        """Append streamed output of the running script"""
+        if data.get('job_id') != self.script_job_id:
+            return
+        for frame in data.get('frames', []):
+            self.script_output_view.moveCursor(QTextCursor.MoveOperation.End)
+            self.script_output_view.insertPlainText(frame.get('data', ''))
+        self.script_output_view.ensureCursorVisible()
+
+    def on_script_job_update(self, job):
+        """Handle job state from polling or a 'script_result' WebSocket push"""
+        if job.get('job_id') != self.script_job_id:
+            return
+        if job.get('status') in ('queued', 'running'):
+            self.script_status_label.setText(f"Script {job.get('script')}: {job['status']}")
+            return
+        self.finish_script_job(job)
+
+    def finish_script_job(self, job):
+        self.script_job_id = None
+        self.script_poll_timer.stop()
+        self.cancel_script_button.setEnabled(False)
+        # A polled result carries the complete output; a pushed one follows the streamed output
+        if 'output' in job:
+            self.script_output_view.setPlainText(job.get('output', '') + job.get('error', ''))
+        status = f"Script {job.get('script', '')}: {job.get('status')}"
+        if job.get('return_code') is not None:
+            status += f" (exit code {job['return_code']})"
+        if job.get('truncated'):
+            status += " - output truncated"
+        self.script_status_label.setText(status)
+
     def register_ip_with_server(self):
         try:
             headers = {
@@ -623,6 +809,10 @@ class UserDashboardWindow(QMainWindow):
             
             if response.status_code == 200:
                 self.connection_status.setText("Connected")
+            elif response.status_code == 429:
+                # The server is busy (e.g. everyone reconnecting after a restart): come back when it says
+                self.connection_status.setText("Server busy, retrying registration")
+                QTimer.singleShot(retry_after_ms(response.headers.get('Retry-After')), self.register_ip_with_server)
             else:
                 self.connection_status.setText("Failed to register")
                 
@@ -661,6 +851,9 @@ class UserDashboardWindow(QMainWindow):
             blocked_sites = settings.get('blocked_sites', [])
             excluded_sites = settings.get('excluded_sites', [])
             categories = settings.get('categories', {})
+            # Before the lists are saved: the proxy reloads once blocked_sites.json changes
+            self.artifact_id = self.fetch_policy_artifact(settings.get('artifact'))
+            self.settings_version = settings.get('settings_version', self.settings_version)
             
             # Log changes for debugging
             logging.debug(f"New blocked sites: {blocked_sites}")
@@ -691,7 +884,9 @@ class UserDashboardWindow(QMainWindow):
                         json.dump({
                             'blocked_sites': self.blocked_sites,
                             'excluded_sites': self.excluded_sites,
-                            'categories': self.categories
+                            'categories': self.categories,
+                            'artifact_id': self.artifact_id,
+                            'settings_version': self.settings_version
                         }, f, indent=4)
                     logging.info("Settings saved to local file")
                 except Exception as save_error:
@@ -702,6 +897,38 @@ class UserDashboardWindow(QMainWindow):
         except Exception as e:
             logging.error(f"Error updating settings: {str(e)}", exc_info=True)
 
+    def fetch_policy_artifact(self, artifact):
+        """
+        Download the server-compiled policy for the proxy into policy_file.
+
+        Returns the artifact ID once the file holds it, or None, in which case
+        the proxy compiles the settings lists itself.
+        """
+        if not artifact or not artifact.get('id'):
+            return None
+        artifact_id = artifact['id']
+        if artifact_id == self.artifact_id and os.path.exists(self.policy_file):
+            return artifact_id
+        try:
+            response = requests.get(f"{self.server_url}{artifact['url']}", timeout=5, verify=False)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error downloading policy artifact: {str(e)}")
+            return None
+        # The ID is the SHA-256 of the body, after the magic, format byte and checksum (37 bytes)
+        if hashlib.sha256(response.content[37:]).hexdigest() != artifact_id:
+            logging.error("Downloaded policy artifact does not match its ID")
+            return None
+        try:
+            with open(self.policy_file + '.tmp', 'wb') as f:
+                f.write(response.content)
+            os.replace(self.policy_file + '.tmp', self.policy_file)
+        except OSError as e:
+            logging.error(f"Error saving policy artifact: {str(e)}")
+            return None
+        logging.info(f"Policy artifact {artifact_id[:12]} saved")
+        return artifact_id
+
     def reload_proxy_settings(self):
         """Reload the proxy settings by reloading the block_sites.py script"""
         logging.info("Reloading proxy settings...")
@@ -711,7 +938,8 @@ class UserDashboardWindow(QMainWindow):
                 json.dump({
                     'blocked_sites': self.blocked_sites,
                     'excluded_sites': self.excluded_sites,
-                    'categories': self.categories  # Use the instance categories
+                    'categories': self.categories,  # Use the instance categories
+                    'artifact_id': self.artifact_id
                 }, f, indent=4)
             
             logging.info("Proxy settings saved to blocked_sites.json for mitmproxy to reload")
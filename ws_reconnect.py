@@ -0,0 +1,72 @@
+"""
+WebSocket reconnects shared by the user GUI and the admin panel.
+
+Reconnecting every 5 seconds kept hammering a server that was down, and
+every client came back at the same moment when it restarted. Reconnects now
+back off exponentially with full jitter: the n-th attempt in a row waits a
+random time between 0 and min(max_delay, base_delay * 2**n) seconds, so
+clients spread out instead of arriving together. A connection that stays up
+for stable_after seconds resets the backoff. A 'retry_later' message from
+the server's admission control sets the earliest time of the next attempt.
+"""
+import os
+import random
+import time
+from PyQt6.QtCore import QTimer
+
+
+class ReconnectManager:
+    """
+    Schedule reconnect attempts of a QWebSocket.
+
+    Call connected() and disconnected() from the socket's signals; the
+    manager calls connect after the backoff delay.
+
+    Args:
+        connect: Function opening the socket
+        base_delay (float): Upper bound of the first delay, in seconds
+        max_delay (float): Cap of the delay, in seconds
+        stable_after (float): Seconds a connection must last to reset the backoff
+    """
+
+    def __init__(self, connect, base_delay=None, max_delay=None, stable_after=None):
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv('WS_RECONNECT_BASE_DELAY', '1'))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('WS_RECONNECT_MAX_DELAY', '60'))
+        self.stable_after = stable_after if stable_after is not None else float(os.getenv('WS_RECONNECT_STABLE_AFTER', '30'))
+        self.attempt = 0  # Failed attempts since the last stable connection
+        self.connected_at = None
+        self.retry_after = None  # Seconds the server asked to wait, for the next attempt only
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(connect)
+
+    def next_delay(self):
+        """Delay before the next attempt, in seconds; each call counts an attempt."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** min(self.attempt, 30)))
+        self.attempt += 1
+        if self.retry_after is not None:
+            delay = max(delay, self.retry_after + random.random())
+            self.retry_after = None
+        return delay
+
+    def connected(self):
+        self.connected_at = time.monotonic()
+
+    def disconnected(self):
+        """Schedule the next attempt; returns its delay in seconds."""
+        if self.connected_at is not None and time.monotonic() - self.connected_at >= self.stable_after:
+            self.attempt = 0
+        self.connected_at = None
+        delay = self.next_delay()
+        self.timer.start(int(delay * 1000))
+        return delay
+
+    def server_retry_after(self, seconds):
+        """The server turned the connection away and asked to wait this long."""
+        try:
+            self.retry_after = max(float(seconds), 0)
+        except (TypeError, ValueError):
+            pass
+
+    def stop(self):
+        self.timer.stop()